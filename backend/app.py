@@ -1,44 +1,550 @@
-from fastapi import FastAPI, HTTPException
-from backend.optimizer.model import run_optimizer
-import pandas as pd
+import asyncio
+import hashlib
+import io
+import json
 import os
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import Any, Dict, List, Literal, Optional
+import numpy as np
+import pandas as pd
+from fastapi import (
+    FastAPI, File, Header, HTTPException, Query, Request, Response, UploadFile, WebSocket, WebSocketDisconnect,
+)
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+from backend.optimizer.model import run_optimizer, plan_fingerprint, planning_date, risk_features, score_risk
+from backend.optimizer.branding import campaign_status
+from backend.optimizer.planframe import ARROW_MEDIA_TYPE, PlanFrame, pa
+from backend.optimizer.registry import registry
+from backend.optimizer.milp import DEFAULT_TIME_LIMIT, MAX_TIME_LIMIT
+from backend.optimizer.incremental import live_fleet
+from backend.optimizer.sweep import mileage_sweep
+from backend.optimizer.horizon import KM_PER_NIGHT, MAX_NIGHTS, plan_horizon
+from backend.optimizer.expiry import ANY, KINDS, day_number, expiry_index
+from backend.optimizer.batch import run_batch, expand_grid, shutdown_pool
+from backend.datastore import store, DATE_COLS
+from backend.jobs import jobs, QueueFull
+from backend.upload import UploadError, ingest_upload
+from backend.history import InputsChanged, commit_plan, history
+from backend.cache import plan_cache, etag_matches
+from backend.serialize import dumps
+from backend.metrics import HTTP_SECONDS, SERVER_TIMING, metrics, server_timing, stage, start_timing
 
-app = FastAPI(title="KMRL Induction Planner")
+@asynccontextmanager
+async def lifespan(app):
+    # Load (or fit once and persist) the default risk model before the first request
+    registry.warm()
+    yield
+    shutdown_pool()
+    jobs.shutdown()
 
-DATA_DIR = "data_samples"
+app = FastAPI(title="KMRL Induction Planner", lifespan=lifespan)
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    timings = start_timing()
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    # Route templates, not raw paths, so ids and file names don't explode the label set
+    route = request.scope.get("route")
+    HTTP_SECONDS.observe(
+        elapsed, method=request.method, route=route.path if route else "unmatched", status=response.status_code)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(timings + [("total", elapsed)])
+    return response
 
 @app.get("/")
 def root():
     return {"message": "KMRL Induction Planner API is running 🚇"}
 
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def _records(df):
+    # JSON-ready rows: ISO dates (null when unparseable), "" for other missing values
+    values = []
+    for col in df.columns:
+        missing = df[col].isna().to_numpy()
+        vals = df[col].astype(object).tolist()
+        fill = None if col in DATE_COLS else ""
+        for i in np.flatnonzero(missing):
+            vals[i] = fill
+        if col in DATE_COLS:
+            vals = [v.isoformat() if v is not None else None for v in vals]
+        values.append(vals)
+    columns = df.columns.tolist()
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+def _stream_ndjson(filename, columns, offset, limit):
+    skipped = 0
+    remaining = limit
+    for chunk in store.iter_chunks(filename, columns):
+        if skipped < offset:
+            drop = min(offset - skipped, len(chunk))
+            chunk = chunk.iloc[drop:]
+            skipped += drop
+        if remaining is not None:
+            chunk = chunk.iloc[:remaining]
+            remaining -= len(chunk)
+        if len(chunk):
+            yield "".join(json.dumps(r, default=str) + "\n" for r in _records(chunk))
+        if remaining == 0:
+            break
+
 @app.get("/ingest/{filename}")
-def ingest_file(filename: str):
+def ingest_file(
+    filename: str,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=0),
+    columns: Optional[str] = Query(None, description="Comma-separated column names"),
+    fmt: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+    if_none_match: Optional[str] = Header(None),
+):
     try:
-        path = os.path.join(DATA_DIR, filename)
-        if not os.path.exists(path):
+        try:
+            all_columns = store.header(filename)
+            digest = store.digest(filename)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail=f"{filename} not found")
 
-        # Load CSV safely
-        df = pd.read_csv(path)
+        # Same file content and same query give the same body
+        etag = '"%s"' % hashlib.sha1(repr((digest, offset, limit, columns, fmt)).encode()).hexdigest()
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
 
-        # Fill missing values with empty strings
-        df.fillna("", inplace=True)
+        selected = all_columns
+        if columns:
+            selected = [c.strip() for c in columns.split(",") if c.strip()]
+            unknown = [c for c in selected if c not in all_columns]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
 
-        # Convert datetime columns safely if they exist
-        for date_col in ["rolling_expiry", "signalling_expiry", "telecom_expiry", "window_end"]:
-            if date_col in df.columns:
-                df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
+        if fmt == "ndjson":
+            # Full exports: read the file in chunks and stream one JSON object per line
+            return StreamingResponse(
+                _stream_ndjson(filename, selected, offset, limit),
+                media_type="application/x-ndjson",
+                headers={"ETag": etag},
+            )
 
-        # Return full CSV for preview; frontend slider will control rows displayed
-        return {
-            "rows": len(df),
-            "columns": df.columns.tolist(),
-            "preview": df.to_dict(orient="records")
-        }
+        df = store.frame(filename)
+        page = df[selected].iloc[offset: None if limit is None else offset + limit]
+        with stage("serialization"):
+            return JSONResponse({
+                "rows": len(df),
+                "columns": selected,
+                "offset": offset,
+                "limit": limit,
+                "preview": _records(page)
+            }, headers={"ETag": etag})
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ingest/{filename}")
+def upload_file(
+    filename: str,
+    file: UploadFile = File(...),
+    on_error: str = Query("reject", pattern="^(reject|skip)$"),
+):
+    # Sync handler: validation runs on the threadpool, and readers keep the old file until the swap
+    if not filename.endswith(".csv"):
+        filename += ".csv"
+    try:
+        report = ingest_upload(filename, file.file, on_error)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"{filename} is not an uploadable source")
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(report, status_code=200 if report["swapped"] else 422)
+
+@app.get("/fitness/expiring")
+def fitness_expiring(
+    days: int = Query(30, ge=0),
+    kind: str = Query(ANY, pattern="^(any|rolling|signalling|telecom)$"),
+    include_expired: bool = False,
+    limit: Optional[int] = Query(None, ge=0),
+    if_none_match: Optional[str] = Header(None),
+):
+    today = datetime.now().date()
+    try:
+        digest = store.digest("fitness.csv")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="fitness.csv not found")
+    etag = '"%s"' % hashlib.sha1(repr((digest, str(today), days, kind, include_expired, limit)).encode()).hexdigest()
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    index = expiry_index.get()
+    key = KINDS.get(kind, ANY)
+    ref = day_number(today)
+    rows = index.expiring(key, ref + days, None if include_expired else ref)
+    return JSONResponse({
+        "as_of": today.isoformat(),
+        "days": days,
+        "kind": kind,
+        "count": len(rows),
+        "trains": index.records(key, rows[:limit], today),
+    }, headers={"ETag": etag})
+
+def _cached_plan(params, compute, if_none_match, encode=dumps, media_type="application/json"):
+    # Same inputs, planning date and parameters give the same body: answer 304 or from the plan cache
+    try:
+        etag = '"%s"' % plan_fingerprint(params)
+    except Exception:
+        # Inputs unreadable: let the planner report it
+        result = compute()
+        return result if "error" in result else Response(encode(result), media_type=media_type)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    body = plan_cache.get(etag)
+    if body is None:
+        result = compute()
+        if "error" in result:
+            return result
+        with stage("serialization"):
+            body = encode(result)
+        plan_cache.put(etag, body)
+    return Response(body, media_type=media_type, headers={"ETag": etag})
+
+def _arrow_plan(result):
+    # The plan as the Arrow table, everything else in the result as JSON in its schema metadata
+    return result["plan"].arrow(dumps({k: v for k, v in result.items() if k != "plan"}))
+
+# format= of /plan/run -> plan_format of run_optimizer
+PLAN_FORMATS = {"json": "records", "columnar": "columnar", "arrow": "frame"}
+
 @app.get("/plan/run")
-def run_plan(required_service: int, max_mileage: int = 8000):
-    return run_optimizer(required_service, max_mileage=max_mileage)
+def run_plan(
+    required_service: int,
+    max_mileage: int = 8000,
+    max_cleaning_slots: int = 2,
+    mode: str = Query("rules", pattern="^(rules|milp|sharded)$"),
+    time_limit: float = Query(DEFAULT_TIME_LIMIT, gt=0, le=MAX_TIME_LIMIT),
+    cleaning: str = Query("fcfs", pattern="^(fcfs|priority)$"),
+    fmt: str = Query("json", alias="format", pattern="^(json|columnar|arrow)$"),
+    turnout: bool = False,
+    if_none_match: Optional[str] = Header(None),
+):
+    if fmt == "arrow" and pa is None:
+        raise HTTPException(status_code=501, detail="format=arrow needs pyarrow installed")
+    params = dict(
+        required_service=required_service, max_cleaning_slots=max_cleaning_slots,
+        max_mileage=max_mileage, mode=mode, time_limit=time_limit, cleaning=cleaning,
+        plan_format=PLAN_FORMATS[fmt], turnout=turnout,
+    )
+    if fmt == "arrow":
+        return _cached_plan(params, lambda: run_optimizer(**params), if_none_match, _arrow_plan, ARROW_MEDIA_TYPE)
+    return _cached_plan(params, lambda: run_optimizer(**params), if_none_match)
+
+@app.post("/plan/commit")
+def commit_nightly_plan(
+    required_service: int,
+    max_mileage: int = 8000,
+    max_cleaning_slots: int = 2,
+    mode: str = Query("rules", pattern="^(rules|milp|sharded)$"),
+    time_limit: float = Query(DEFAULT_TIME_LIMIT, gt=0, le=MAX_TIME_LIMIT),
+    cleaning: str = Query("fcfs", pattern="^(fcfs|priority)$"),
+):
+    params = dict(
+        required_service=required_service, max_cleaning_slots=max_cleaning_slots,
+        max_mileage=max_mileage, mode=mode, time_limit=time_limit, cleaning=cleaning,
+    )
+    try:
+        result = commit_plan(params)
+    except InputsChanged as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
+@app.get("/history/plans")
+def history_plans(start: Optional[date] = None, end: Optional[date] = None, limit: Optional[int] = Query(None, ge=1)):
+    return {"plans": history.plans(start, end, limit)}
+
+@app.get("/history/trains/{train_id}/status")
+def history_train_status(
+    train_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    status: Optional[str] = Query(None, pattern="^(Service|Standby|IBL)$"),
+    limit: Optional[int] = Query(None, ge=1),
+):
+    return {"train_id": train_id, "history": history.status_history(train_id, start, end, status, limit)}
+
+@app.get("/history/trains/{train_id}/mileage")
+def history_train_mileage(train_id: str, start: Optional[date] = None, end: Optional[date] = None):
+    return {"train_id": train_id, "mileage": history.mileage(train_id, start, end)}
+
+@app.get("/history/ibl-reasons")
+def history_ibl_reasons(start: Optional[date] = None, end: Optional[date] = None):
+    return {"start": start, "end": end, "reasons": history.ibl_reasons(start, end)}
+
+@app.get("/branding/campaigns")
+def branding_campaigns(include_ended: bool = False):
+    try:
+        branding = store.frame("branding.csv")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="branding.csv not found")
+    tomorrow = planning_date()
+    return {"as_of": str(tomorrow), "campaigns": campaign_status(branding, tomorrow, include_ended)}
+
+MAX_SWEEP_THRESHOLDS = 400
+
+def _arrow_sweep(result):
+    # Every step's plan or changes in one Arrow table, each row headed by its step's threshold
+    frames = [s["plan"] if "plan" in s else s["changes"] for s in result["steps"]]
+    thresholds = np.repeat([s["max_mileage"] for s in result["steps"]], [len(f) for f in frames])
+    return PlanFrame.concat(frames).arrow(
+        dumps({k: v for k, v in result.items() if k != "steps"}), {"max_mileage": thresholds.astype(np.int64)})
+
+@app.get("/plan/mileage-sweep")
+def mileage_threshold_sweep(
+    required_service: int,
+    max_cleaning_slots: int = 2,
+    min_mileage: int = Query(1000, ge=0),
+    max_mileage: int = Query(20000, ge=0),
+    step: int = Query(500, ge=1),
+    changes: str = Query("diff", pattern="^(diff|full)$"),
+    fmt: str = Query("json", alias="format", pattern="^(json|columnar|arrow)$"),
+    if_none_match: Optional[str] = Header(None),
+):
+    if fmt == "arrow" and pa is None:
+        raise HTTPException(status_code=501, detail="format=arrow needs pyarrow installed")
+    if max_mileage < min_mileage:
+        raise HTTPException(status_code=400, detail="max_mileage must be at least min_mileage")
+    thresholds = list(range(min_mileage, max_mileage + 1, step))
+    if len(thresholds) > MAX_SWEEP_THRESHOLDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SWEEP_THRESHOLDS} thresholds per sweep")
+    params = dict(
+        sweep="mileage", required_service=required_service, max_cleaning_slots=max_cleaning_slots,
+        min_mileage=min_mileage, max_mileage=max_mileage, step=step, changes=changes, format=fmt,
+    )
+
+    def compute():
+        try:
+            return mileage_sweep(required_service, max_cleaning_slots, thresholds, diff=changes == "diff",
+                                 plan_format=PLAN_FORMATS[fmt])
+        except Exception as ex:
+            return {"error": str(ex)}
+    if fmt == "arrow":
+        return _cached_plan(params, compute, if_none_match, _arrow_sweep, ARROW_MEDIA_TYPE)
+    return _cached_plan(params, compute, if_none_match)
+
+@app.get("/plan/horizon")
+def rolling_horizon(
+    required_service: int,
+    nights: int = Query(14, ge=1, le=MAX_NIGHTS),
+    max_mileage: int = 8000,
+    max_cleaning_slots: int = 2,
+    km_per_night: int = Query(KM_PER_NIGHT, ge=0),
+    include_plans: bool = True,
+    if_none_match: Optional[str] = Header(None),
+):
+    params = dict(
+        mode="horizon", required_service=required_service, nights=nights, max_mileage=max_mileage,
+        max_cleaning_slots=max_cleaning_slots, km_per_night=km_per_night, include_plans=include_plans,
+    )
+
+    def compute():
+        try:
+            return plan_horizon(required_service, nights, max_cleaning_slots, max_mileage, km_per_night, include_plans)
+        except Exception as ex:
+            return {"error": str(ex)}
+    return _cached_plan(params, compute, if_none_match)
+
+class PlanJobRequest(BaseModel):
+    required_service: int
+    max_mileage: int = 8000
+    max_cleaning_slots: int = 2
+    mode: Literal["rules", "milp", "sharded"] = "rules"
+    time_limit: float = Field(DEFAULT_TIME_LIMIT, gt=0, le=MAX_TIME_LIMIT)
+    cleaning: Literal["fcfs", "priority"] = "fcfs"
+    plan_format: Literal["records", "columnar"] = "records"
+    turnout: bool = False
+
+@app.post("/plan/jobs", status_code=202)
+def submit_plan_job(req: PlanJobRequest):
+    try:
+        job, deduplicated = jobs.submit(req.model_dump())
+    except QueueFull as ex:
+        raise HTTPException(status_code=429, detail=str(ex))
+    return {**job.to_dict(with_result=False), "deduplicated": deduplicated}
+
+@app.get("/plan/jobs/{job_id}")
+def get_plan_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.to_dict()
+
+MAX_BATCH_SCENARIOS = 5000
+
+class Scenario(BaseModel):
+    required_service: int
+    max_mileage: int = 8000
+    max_cleaning_slots: int = 2
+
+class ScenarioGrid(BaseModel):
+    required_service: List[int]
+    max_mileage: List[int] = [8000]
+    max_cleaning_slots: List[int] = [2]
+
+class BatchRequest(BaseModel):
+    scenarios: List[Scenario] = []
+    grid: Optional[ScenarioGrid] = None
+    include_plans: bool = True
+
+class Event(BaseModel):
+    train_id: str
+    source: Literal["jobcards", "fitness", "cleaning", "mileage"]
+    # Column values as they would appear in that source's CSV row
+    values: Dict[str, Any] = {}
+
+class EventBatch(BaseModel):
+    required_service: int
+    max_mileage: int = 8000
+    max_cleaning_slots: int = 2
+    events: List[Event]
+
+@app.post("/events")
+def apply_events(batch: EventBatch):
+    try:
+        changes = live_fleet.apply(
+            [e.model_dump() for e in batch.events],
+            batch.required_service, batch.max_cleaning_slots, batch.max_mileage,
+        )
+    except KeyError as ex:
+        raise HTTPException(status_code=404, detail=str(ex.args[0]))
+    except Exception as ex:
+        return {"error": str(ex)}
+    return {"applied": len(batch.events), "changes": changes}
+
+@app.get("/plan/live")
+def live_plan(required_service: int, max_mileage: int = 8000, max_cleaning_slots: int = 2):
+    try:
+        plan = live_fleet.plan(required_service, max_cleaning_slots, max_mileage)
+    except Exception as ex:
+        return {"error": str(ex)}
+    return {"required_service": required_service, "plan": plan}
+
+# How often an open plan socket checks for new data or applied events, in seconds
+WS_POLL_SECONDS = float(os.environ.get("KMRL_WS_POLL_SECONDS", "1.0"))
+
+def _plan_diff(sent, plan):
+    changes = [r for r in plan if sent.get(r["train_id"]) != r]
+    current = {r["train_id"] for r in plan}
+    return changes, [t for t in sent if t not in current]
+
+async def _socket_messages(ws, queue):
+    try:
+        while True:
+            await queue.put(await ws.receive_json())
+    except (WebSocketDisconnect, ValueError):
+        await queue.put(None)
+
+@app.websocket("/ws/plan")
+async def plan_updates(ws: WebSocket, required_service: int = 2, max_mileage: int = 8000, max_cleaning_slots: int = 2):
+    """Sends the live plan once, then only the rows that change.
+
+    Changes come from new CSV content, applied /events, or the client sending
+    new parameters as {"required_service": .., "max_mileage": .., "max_cleaning_slots": ..}.
+    """
+    await ws.accept()
+    params = {"required_service": required_service, "max_mileage": max_mileage, "max_cleaning_slots": max_cleaning_slots}
+    queue = asyncio.Queue()
+    reader = asyncio.create_task(_socket_messages(ws, queue))
+    sent = None
+    seen = None
+    try:
+        while True:
+            key = (await run_in_threadpool(live_fleet.revision), tuple(params.values()))
+            if key != seen:
+                try:
+                    plan = await run_in_threadpool(
+                        live_fleet.plan, params["required_service"], params["max_cleaning_slots"], params["max_mileage"])
+                except Exception as ex:
+                    await ws.send_json({"type": "error", "error": str(ex)})
+                    plan = None
+                if plan is not None:
+                    if sent is None:
+                        await ws.send_json({"type": "plan", "params": params, "plan": plan})
+                    else:
+                        changes, removed = _plan_diff(sent, plan)
+                        if changes or removed:
+                            await ws.send_json({"type": "diff", "params": params, "changes": changes, "removed": removed})
+                    sent = {r["train_id"]: r for r in plan}
+                seen = key
+
+            try:
+                msg = await asyncio.wait_for(queue.get(), timeout=WS_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                continue
+            if msg is None:
+                break
+            try:
+                update = {k: int(msg[k]) for k in params if k in msg}
+            except (TypeError, ValueError):
+                await ws.send_json({"type": "error", "error": "Parameters must be integers"})
+                continue
+            params = {**params, **update}
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
+
+@app.post("/plan/batch")
+def run_plan_batch(req: BatchRequest):
+    scenarios = [sc.model_dump() for sc in req.scenarios]
+    if req.grid is not None:
+        scenarios += expand_grid(req.grid.required_service, req.grid.max_mileage, req.grid.max_cleaning_slots)
+    if not scenarios:
+        raise HTTPException(status_code=400, detail="No scenarios given")
+    if len(scenarios) > MAX_BATCH_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SCENARIOS} scenarios per batch")
+    try:
+        return {"count": len(scenarios), "results": run_batch(scenarios, include_plans=req.include_plans)}
+    except Exception as ex:
+        return {"error": str(ex)}
+
+def _risk_columns(body, content_type):
+    # Columnar JSON ({"km": [...], ...}) or a CSV with a header row
+    if content_type.startswith("text/csv"):
+        df = pd.read_csv(io.BytesIO(body), dtype={"train_id": str})
+        return {c: df[c].tolist() for c in df.columns}
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object of columns")
+    return data
+
+@app.post("/risk/score")
+async def score_risk_batch(
+    request: Request,
+    max_mileage: int = 8000,
+    path: str = Query("auto", pattern="^(auto|heuristic)$"),
+):
+    try:
+        columns = _risk_columns(await request.body(), request.headers.get("content-type", ""))
+        feats = risk_features(columns)
+        train_ids = columns.get("train_id")
+        if train_ids is not None and len(train_ids) != len(feats):
+            raise ValueError(f"Column train_id has {len(train_ids)} values, expected {len(feats)}")
+    except (ValueError, TypeError) as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+
+    scores, labels, used = await run_in_threadpool(score_risk, feats, max_mileage, path == "auto")
+    out = {"count": len(feats), "path": used, "max_mileage": max_mileage}
+    if train_ids is not None:
+        out["train_id"] = [None if t != t else t for t in train_ids]
+    out["risk_score"] = np.round(scores, 3).tolist()
+    out["label"] = labels.tolist()
+    with stage("serialization"):
+        return JSONResponse(out)
@@ -0,0 +1,61 @@
+import os
+import threading
+from collections import OrderedDict
+
+from backend.metrics import CACHE_REQUESTS
+
+MAX_BYTES = int(os.environ.get("KMRL_PLAN_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+
+class ResultCache:
+    """LRU of serialized responses keyed by input fingerprint, bounded by total body size."""
+
+    def __init__(self, name="plan", max_bytes=MAX_BYTES):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._items.get(key)
+            if body is None:
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache=self.name, result="miss")
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache=self.name, result="hit")
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, dropped = self._items.popitem(last=False)
+                self.size -= len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match may list several tags, weak ones, or "*"
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+
+plan_cache = ResultCache()
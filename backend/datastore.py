@@ -0,0 +1,200 @@
+import hashlib
+import io
+import os
+import threading
+
+import pandas as pd
+
+from backend.metrics import CACHE_REQUESTS, stage
+from backend.snapshot import SNAPSHOT_NAME, Snapshot, write_snapshot
+
+DATA_DIR = os.environ.get("KMRL_DATA_DIR", "data_samples")
+
+# Compiled snapshot to read through (python -m backend.snapshot); empty means
+# <data dir>/fleet.snapshot when it exists, "off" disables it
+SNAPSHOT = os.environ.get("KMRL_SNAPSHOT", "")
+
+SOURCES = ["jobcards.csv", "fitness.csv", "cleaning.csv", "mileage.csv", "branding.csv", "stabling.csv"]
+# Optional: cleaning bays and their opening windows; a default set of bays is used without it
+CLEANING_BAYS = "cleaning_bays.csv"
+
+DATE_COLS = ["rolling_expiry", "signalling_expiry", "telecom_expiry", "window_end"]
+
+
+class _Entry:
+    __slots__ = ("mtime_ns", "size", "digest", "frame")
+
+    def __init__(self, mtime_ns, size, digest, frame):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+        self.frame = frame
+
+
+def _parse_dates(df):
+    for col in DATE_COLS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    return df
+
+
+def parse_csv(buf):
+    return _parse_dates(pd.read_csv(buf, dtype={"train_id": str}))
+
+
+class DataStore:
+    """Parsed, date-typed frames for the depot CSVs, reloaded only when a file changes.
+
+    A cheap stat() runs on every access; the file is re-hashed only when its
+    mtime or size moved, and re-parsed only when the content hash differs.
+    Returned frames are shared between callers and must not be mutated.
+
+    When a compiled snapshot still matches a file's stat, the frame and digest
+    come from the memory-mapped snapshot instead of reading and parsing the CSV.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, snapshot=SNAPSHOT):
+        self.data_dir = data_dir
+        self.snapshot_path = snapshot
+        self._entries = {}
+        self._snapshot_key = None
+        self._snapshot_file = None
+        self._lock = threading.Lock()
+
+    def path(self, filename):
+        # Only plain file names inside the data directory
+        if os.path.basename(filename) != filename or filename in ("", ".", ".."):
+            raise FileNotFoundError(filename)
+        return os.path.join(self.data_dir, filename)
+
+    def snapshot(self):
+        """The current snapshot file, reopened when it is recompiled; None when there is none."""
+        if self.snapshot_path == "off":
+            return None
+        path = self.snapshot_path or os.path.join(self.data_dir, SNAPSHOT_NAME)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if key == self._snapshot_key:
+                return self._snapshot_file
+        try:
+            snapshot = Snapshot(path)
+        except ValueError:
+            snapshot = None
+        with self._lock:
+            self._snapshot_key, self._snapshot_file = key, snapshot
+        return snapshot
+
+    def exists(self, filename):
+        return os.path.exists(self.path(filename))
+
+    def _current(self, filename):
+        # The snapshot, if it was compiled from the file as it is on disk now
+        snapshot = self.snapshot()
+        if snapshot is not None and snapshot.matches(filename, os.stat(self.path(filename))):
+            return snapshot
+        return None
+
+    def _entry(self, filename):
+        path = self.path(filename)
+        st = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is not None and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+            CACHE_REQUESTS.inc(cache="datastore", result="hit")
+            return entry
+
+        snapshot = self.snapshot()
+        if snapshot is not None and snapshot.matches(filename, st):
+            digest = snapshot.digest(filename)
+            if entry is not None and entry.digest == digest:
+                CACHE_REQUESTS.inc(cache="datastore", result="unchanged")
+                frame = entry.frame
+            else:
+                CACHE_REQUESTS.inc(cache="datastore", result="snapshot")
+                with stage("snapshot"):
+                    frame = snapshot.frame(filename)
+            entry = _Entry(st.st_mtime_ns, st.st_size, digest, frame)
+            with self._lock:
+                self._entries[filename] = entry
+            return entry
+
+        with stage("load"):
+            with open(path, "rb") as fh:
+                raw = fh.read()
+            digest = hashlib.sha1(raw).hexdigest()
+        if entry is not None and entry.digest == digest:
+            # Touched but not changed: keep the parsed frame
+            CACHE_REQUESTS.inc(cache="datastore", result="unchanged")
+            entry = _Entry(st.st_mtime_ns, st.st_size, digest, entry.frame)
+        else:
+            CACHE_REQUESTS.inc(cache="datastore", result="miss")
+            with stage("parse"):
+                frame = parse_csv(io.BytesIO(raw))
+            entry = _Entry(st.st_mtime_ns, st.st_size, digest, frame)
+        with self._lock:
+            self._entries[filename] = entry
+        return entry
+
+    def frame(self, filename):
+        return self._entry(filename).frame
+
+    def frames(self, filenames=SOURCES):
+        return {f: self.frame(f) for f in filenames}
+
+    def header(self, filename):
+        snapshot = self._current(filename)
+        if snapshot is not None:
+            return snapshot.columns(filename)
+        return pd.read_csv(self.path(filename), nrows=0).columns.tolist()
+
+    def iter_chunks(self, filename, columns=None, chunksize=50_000):
+        snapshot = self._current(filename)
+        if snapshot is not None:
+            # Slices of the mapping; only each chunk's text columns are decoded
+            for start in range(0, snapshot.rows(filename), chunksize):
+                yield snapshot.frame(filename, columns, start, start + chunksize)
+            return
+        # Straight from disk so full exports of large files never sit in memory at once
+        reader = pd.read_csv(self.path(filename), dtype={"train_id": str}, usecols=columns, chunksize=chunksize)
+        for chunk in reader:
+            yield _parse_dates(chunk if columns is None else chunk[columns])
+
+    def digest(self, filename):
+        return self._entry(filename).digest
+
+    def version(self, filenames=SOURCES):
+        # Fingerprint of the current content of several sources
+        h = hashlib.sha1()
+        for f in filenames:
+            h.update(f.encode())
+            h.update(self.digest(f).encode())
+        return h.hexdigest()
+
+    def compile_snapshot(self, out=None, filenames=SOURCES):
+        """Parse the CSVs that exist and write them to a snapshot file; returns {filename: rows}."""
+        sources = {}
+        for f in filenames:
+            path = self.path(f)
+            if not os.path.exists(path):
+                continue
+            # stat before reading: if the file changes meanwhile the snapshot just won't match it
+            st = os.stat(path)
+            with open(path, "rb") as fh:
+                raw = fh.read()
+            sources[f] = (st, hashlib.sha1(raw).hexdigest(), parse_csv(io.BytesIO(raw)))
+        write_snapshot(out or os.path.join(self.data_dir, SNAPSHOT_NAME), sources)
+        return {f: len(df) for f, (_, _, df) in sources.items()}
+
+    def invalidate(self, filename=None):
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(filename, None)
+
+
+store = DataStore()
@@ -0,0 +1,268 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+
+import numpy as np
+
+from backend.datastore import store
+from backend.optimizer.branding import SERVICE_HOURS, active_campaigns, exposure
+from backend.optimizer.model import load_fleet, plan_inputs, planning_date, run_optimizer
+
+HISTORY_DB = os.environ.get("KMRL_HISTORY_DB", "history.db")
+# Rows per executemany call when committing a plan
+INSERT_BATCH = 10_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    plan_date TEXT PRIMARY KEY,
+    committed_at TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    required_service INTEGER NOT NULL,
+    max_cleaning_slots INTEGER NOT NULL,
+    max_mileage INTEGER NOT NULL,
+    data_version TEXT NOT NULL,
+    trains INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS plan_rows (
+    plan_date TEXT NOT NULL,
+    train_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    reason_group TEXT NOT NULL,
+    km INTEGER,
+    risk_score REAL,
+    risk_label TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS plan_rows_date_train ON plan_rows (plan_date, train_id);
+CREATE INDEX IF NOT EXISTS plan_rows_train_status ON plan_rows (train_id, status);
+CREATE TABLE IF NOT EXISTS fleet_inputs (
+    plan_date TEXT NOT NULL,
+    train_id TEXT NOT NULL,
+    has_data INTEGER NOT NULL,
+    days_to_expiry REAL,
+    km REAL,
+    needs_cleaning INTEGER NOT NULL,
+    jobcard_open INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS fleet_inputs_date_train ON fleet_inputs (plan_date, train_id);
+CREATE TABLE IF NOT EXISTS exposure (
+    plan_date TEXT NOT NULL,
+    train_id TEXT NOT NULL,
+    campaign_id TEXT NOT NULL,
+    hours REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS exposure_date ON exposure (plan_date);
+CREATE TABLE IF NOT EXISTS exposure_totals (
+    train_id TEXT NOT NULL,
+    campaign_id TEXT NOT NULL,
+    hours REAL NOT NULL,
+    PRIMARY KEY (train_id, campaign_id)
+);
+CREATE TABLE IF NOT EXISTS exposure_revision (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    revision INTEGER NOT NULL
+);
+"""
+
+_ADD_EXPOSURE = (
+    "INSERT INTO exposure_totals VALUES (?, ?, ?) "
+    "ON CONFLICT (train_id, campaign_id) DO UPDATE SET hours = hours + excluded.hours"
+)
+_BUMP_REVISION = (
+    "INSERT INTO exposure_revision VALUES (0, 1) "
+    "ON CONFLICT (id) DO UPDATE SET revision = revision + 1"
+)
+
+# "High mileage (12345 km)" and "Exceeded mileage threshold (8000 km)" count as one reason each
+_REASON_DETAIL = re.compile(r"\s*\(.*\)$")
+
+
+class InputsChanged(Exception):
+    pass
+
+
+def _batches(rows, size=INSERT_BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _nullable(values):
+    # NaN -> NULL, numpy scalars -> Python numbers
+    return [None if v != v else v for v in np.asarray(values, dtype=float).tolist()]
+
+
+class HistoryStore:
+    """Committed nightly plans and the fleet inputs they were planned from, in SQLite.
+
+    One plan per planning date; committing a date again replaces it. Every
+    call opens its own connection, and WAL mode lets queries run while a
+    commit is being written.
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._ready = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        with self._lock:
+            if self._ready != self.path:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+                self._ready = self.path
+        return conn
+
+    def commit(self, plan_date, params, plan, fleet, data_version, branding=None):
+        """Record a plan (a PlanFrame), replacing any plan of the same date.
+
+        Service rakes of a campaign running that night add SERVICE_HOURS of
+        exposure, kept per plan and in running totals; replacing a plan takes
+        its exposure back out of the totals first.
+        """
+        plan_date = str(plan_date)
+        reasons = plan.reason.tolist()
+        plan_rows = zip(
+            (plan_date for _ in range(len(plan))),
+            plan.train_id.tolist(),
+            plan.status.tolist(),
+            reasons,
+            # Distinct reasons are few, so each is stripped once
+            map({r: _REASON_DETAIL.sub("", r) for r in set(reasons)}.get, reasons),
+            plan.km_values().tolist(),
+            plan.risk_score.tolist(),
+            plan.recommendation.tolist(),
+        )
+        input_rows = zip(
+            (plan_date for _ in range(len(fleet))),
+            fleet["train_id"].tolist(),
+            fleet["has_data"].astype(int).tolist(),
+            _nullable(fleet["dte"]),
+            _nullable(fleet["km"]),
+            fleet["needs_cleaning"].astype(int).tolist(),
+            fleet["jobcard_open"].astype(int).tolist(),
+        )
+        exposed = []
+        if branding is not None:
+            campaign = active_campaigns(branding, plan_date).set_index("train_id")["campaign_id"]
+            exposed = [
+                (plan_date, t, campaign[t], SERVICE_HOURS) for t in plan.service_ids() if t in campaign.index
+            ]
+
+        def write():
+            with closing(self._connect()) as conn, conn:
+                old = conn.execute(
+                    "SELECT train_id, campaign_id, -hours FROM exposure WHERE plan_date = ?", (plan_date,)).fetchall()
+                conn.execute("DELETE FROM plan_rows WHERE plan_date = ?", (plan_date,))
+                conn.execute("DELETE FROM fleet_inputs WHERE plan_date = ?", (plan_date,))
+                conn.execute("DELETE FROM exposure WHERE plan_date = ?", (plan_date,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (plan_date, datetime.now().isoformat(timespec="seconds"), params["mode"],
+                     params["required_service"], params["max_cleaning_slots"], params["max_mileage"],
+                     data_version, len(plan)),
+                )
+                for batch in _batches(plan_rows):
+                    conn.executemany("INSERT INTO plan_rows VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                for batch in _batches(input_rows):
+                    conn.executemany("INSERT INTO fleet_inputs VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                change = [tuple(r) for r in old] + [e[1:] for e in exposed]
+                for batch in _batches(exposed):
+                    conn.executemany("INSERT INTO exposure VALUES (?, ?, ?, ?)", batch)
+                for batch in _batches(change):
+                    conn.executemany(_ADD_EXPOSURE, batch)
+                # Other processes compare this against the totals they hold
+                conn.execute(_BUMP_REVISION)
+                revision = conn.execute("SELECT revision FROM exposure_revision").fetchone()[0]
+            return tuple(zip(*change)) or ((), (), ()), revision
+
+        exposure.update(write)
+        return {"plan_date": plan_date, "trains": len(plan), "data_version": data_version,
+                "exposure_hours": len(exposed) * SERVICE_HOURS}
+
+    def exposure_totals(self):
+        """(train_ids, campaign_ids, hours) of the running exposure totals; empty before the first commit."""
+        if not os.path.exists(self.path):
+            return (), (), ()
+        rows = self._query("SELECT train_id, campaign_id, hours FROM exposure_totals", ())
+        return tuple(zip(*((r["train_id"], r["campaign_id"], r["hours"]) for r in rows))) or ((), (), ())
+
+    def exposure_revision(self):
+        """Bumped by every commit; 0 before the first."""
+        if not os.path.exists(self.path):
+            return 0
+        rows = self._query("SELECT revision FROM exposure_revision", ())
+        return rows[0]["revision"] if rows else 0
+
+    def _query(self, sql, args):
+        with closing(self._connect()) as conn:
+            return [dict(r) for r in conn.execute(sql, args)]
+
+    @staticmethod
+    def _range(start, end, where, args):
+        if start is not None:
+            where.append("plan_date >= ?")
+            args.append(str(start))
+        if end is not None:
+            where.append("plan_date <= ?")
+            args.append(str(end))
+        return " AND ".join(where)
+
+    def plans(self, start=None, end=None, limit=None):
+        args = []
+        where = self._range(start, end, ["1 = 1"], args)
+        return self._query(
+            f"SELECT * FROM plans WHERE {where} ORDER BY plan_date DESC LIMIT ?", args + [limit or -1])
+
+    def status_history(self, train_id, start=None, end=None, status=None, limit=None):
+        args = [train_id]
+        where = ["train_id = ?"]
+        if status is not None:
+            where.append("status = ?")
+            args.append(status)
+        where = self._range(start, end, where, args)
+        return self._query(
+            "SELECT plan_date, status, reason, risk_score, risk_label FROM plan_rows "
+            f"WHERE {where} ORDER BY plan_date LIMIT ?", args + [limit or -1])
+
+    def mileage(self, train_id, start=None, end=None):
+        args = [train_id]
+        where = self._range(start, end, ["train_id = ?"], args)
+        return self._query(f"SELECT plan_date, km FROM plan_rows WHERE {where} ORDER BY plan_date", args)
+
+    def ibl_reasons(self, start=None, end=None):
+        args = []
+        where = self._range(start, end, ["status = 'IBL'"], args)
+        return self._query(
+            "SELECT reason_group AS reason, COUNT(*) AS count, COUNT(DISTINCT train_id) AS trains, "
+            "COUNT(DISTINCT plan_date) AS nights "
+            f"FROM plan_rows WHERE {where} GROUP BY reason_group ORDER BY count DESC, reason", args)
+
+
+history = HistoryStore()
+
+
+def commit_plan(params):
+    """Plan with params and record the plan and its fleet inputs as tomorrow's committed plan."""
+    tomorrow = planning_date()
+    files = plan_inputs(params["mode"], params.get("cleaning"), params.get("turnout", False))
+    version = store.version(files)
+    fleet = load_fleet(tomorrow)
+    result = run_optimizer(**{**params, "plan_format": "frame"})
+    if "error" in result:
+        return result
+    # Plan and recorded inputs must come from the same data
+    if store.version(files) != version:
+        raise InputsChanged("Input data changed while planning; commit again")
+    branding = store.frame("branding.csv") if "branding.csv" in files else None
+    return history.commit(tomorrow, params, result["plan"], fleet, version, branding)
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from backend.metrics import JOB_SECONDS, JOBS_SUBMITTED
+from backend.optimizer.model import run_optimizer, plan_fingerprint
+
+MAX_WORKERS = int(os.environ.get("KMRL_JOB_WORKERS", "2"))
+MAX_PENDING = int(os.environ.get("KMRL_MAX_PENDING_JOBS", "100"))
+# Finished jobs kept around for polling; the oldest are dropped first
+KEEP_FINISHED = int(os.environ.get("KMRL_KEEP_FINISHED_JOBS", "500"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    __slots__ = ("id", "key", "params", "status", "created", "started", "finished", "result", "error", "future")
+
+    def __init__(self, key, params):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.params = params
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.future = None
+
+    def to_dict(self, with_result=True):
+        if self.status == "queued" and self.future is not None and self.future.running():
+            self.status = "running"
+            self.started = self.started or time.time()
+        out = {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.error is not None:
+            out["error"] = self.error
+        if with_result and self.status == "done":
+            out["result"] = self.result
+        return out
+
+
+class JobQueue:
+    """Runs run_optimizer on a bounded process pool; identical in-flight requests share one job."""
+
+    def __init__(self, max_workers=MAX_WORKERS, max_pending=MAX_PENDING, keep_finished=KEEP_FINISHED):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self._pool = None
+        self._jobs = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def submit(self, params):
+        """Return (job, deduplicated)."""
+        # Same parameters on the same data and planning date give the same plan
+        key = plan_fingerprint(params)
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is not None:
+                JOBS_SUBMITTED.inc(deduplicated="true")
+                return job, True
+            if len(self._inflight) >= self.max_pending:
+                raise QueueFull(f"{len(self._inflight)} jobs already pending")
+            job = Job(key, params)
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+            job.future = self._get_pool().submit(run_optimizer, **params)
+        JOBS_SUBMITTED.inc(deduplicated="false")
+        job.future.add_done_callback(lambda f, job=job: self._finish(job, f))
+        return job, False
+
+    def _finish(self, job, future):
+        with self._lock:
+            job.finished = time.time()
+            try:
+                result = future.result()
+            except Exception as ex:
+                result = {"error": str(ex)}
+            if "error" in result:
+                job.status = "failed"
+                job.error = result["error"]
+            else:
+                job.status = "done"
+                job.result = result
+            JOB_SECONDS.observe(job.finished - job.created, status=job.status)
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            finished = [j for j in self._jobs.values() if j.status in ("done", "failed")]
+            for j in finished[:max(len(finished) - self.keep_finished, 0)]:
+                del self._jobs[j.id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+jobs = JobQueue()
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Off by default: stage names and timings are visible to any client
+SERVER_TIMING = os.environ.get("KMRL_SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+# Seconds; covers a cached lookup up to a long MILP solve
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+
+def _num(x):
+    if x == float("inf"):
+        return "+Inf"
+    return repr(float(x)) if isinstance(x, float) else str(x)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[n]) for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[n]) for n in self.labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            yield f"{self.name}{_labels(self.labels, key)} {_num(v)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [non-cumulative bucket counts (+Inf last), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[n]) for n in self.labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(str(labels[n]) for n in self.labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                yield f"{self.name}_bucket{_labels(self.labels, key, [('le', _num(float(le)))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_num(total)}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {cumulative}"
+
+
+class Metrics:
+    """Process-local counters and histograms rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, doc, labels=()):
+        return self._add(Counter(name, doc, labels))
+
+    def histogram(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, doc, labels, buckets))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.doc}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.samples())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+STAGE_SECONDS = metrics.histogram(
+    "kmrl_stage_seconds", "Time spent in each planning/ingest stage", ["stage"])
+HTTP_SECONDS = metrics.histogram(
+    "kmrl_http_request_seconds", "HTTP request latency by route", ["method", "route", "status"])
+CACHE_REQUESTS = metrics.counter(
+    "kmrl_cache_requests_total", "Cache lookups by cache and outcome", ["cache", "result"])
+RISK_SCORING = metrics.counter(
+    "kmrl_risk_scoring_total", "Risk scoring calls by path (model or heuristic fallback)", ["path"])
+RISK_ROWS = metrics.counter(
+    "kmrl_risk_rows_total", "Rows risk-scored by path", ["path"])
+RISK_FALLBACKS = metrics.counter(
+    "kmrl_risk_fallback_total", "Heuristic fallbacks by the error that caused them", ["error"])
+OPTIMIZER_RUNS = metrics.counter(
+    "kmrl_optimizer_runs_total", "run_optimizer calls by mode and outcome", ["mode", "outcome"])
+OPTIMIZER_ERRORS = metrics.counter(
+    "kmrl_optimizer_errors_total", "run_optimizer failures by exception type", ["error"])
+JOB_SECONDS = metrics.histogram(
+    "kmrl_plan_job_seconds", "Plan job time from submission to completion (stages run in worker processes)", ["status"])
+JOBS_SUBMITTED = metrics.counter(
+    "kmrl_plan_jobs_total", "Plan job submissions, deduplicated onto a running job or not", ["deduplicated"])
+UPLOADS = metrics.counter(
+    "kmrl_uploads_total", "CSV uploads by source and outcome (swapped or rejected)", ["source", "outcome"])
+
+# Stage timings of the request being handled, for the Server-Timing header
+_timings = ContextVar("kmrl_timings", default=None)
+
+
+def start_timing():
+    timings = []
+    _timings.set(timings)
+    return timings
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def server_timing(timings):
+    # Repeated stages (e.g. one load per source file) are summed into one entry
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    return ", ".join(f"{name};dur={elapsed * 1000:.3f}" for name, elapsed in totals.items())
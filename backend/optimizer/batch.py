@@ -0,0 +1,100 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+
+from backend.optimizer.model import load_fleet, plan_fleet, _ml_predict
+from backend.optimizer.registry import registry
+from backend.optimizer.rules import apply_rules, feature_frame
+
+MAX_WORKERS = int(os.environ.get("KMRL_BATCH_WORKERS", str(os.cpu_count() or 1)))
+# Below this many scenarios the pool round trip costs more than planning inline
+MIN_PARALLEL_SCENARIOS = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def expand_grid(required_service, max_mileage, max_cleaning_slots):
+    return [
+        {"required_service": r, "max_mileage": m, "max_cleaning_slots": c}
+        for r, m, c in product(required_service, max_mileage, max_cleaning_slots)
+    ]
+
+
+def summarize(status, risk_scores):
+    status = np.asarray(status)
+    return {
+        "service_count": int((status == "Service").sum()),
+        "standby_count": int((status == "Standby").sum()),
+        "ibl_count": int((status == "IBL").sum()),
+        "mean_risk": round(sum(risk_scores) / len(risk_scores), 3) if len(risk_scores) else None,
+    }
+
+
+def _plan_group(fleet, max_mileage, scenarios, include_plans):
+    # Risk scores depend only on the fleet and max_mileage, so score (and round) once per group
+    scores, labels = _ml_predict(feature_frame(fleet), max_mileage)
+    risk = ([round(float(x), 3) for x in scores], labels)
+    results = []
+    for i, sc in scenarios:
+        if include_plans:
+            plan = plan_fleet(fleet, sc["required_service"], sc["max_cleaning_slots"], max_mileage, risk=risk)
+            result = {"scenario": sc, "summary": summarize(plan.status, risk[0]), "plan": plan.records()}
+        else:
+            status, _ = apply_rules(fleet, sc["required_service"], sc["max_cleaning_slots"], max_mileage)
+            result = {"scenario": sc, "summary": summarize(status, risk[0])}
+        results.append((i, result))
+    return results
+
+
+def run_batch(scenarios, include_plans=True, fleet=None):
+    """Plan every scenario against one fleet snapshot, spreading mileage groups over a process pool."""
+    if fleet is None:
+        fleet = load_fleet()
+
+    groups = {}
+    for i, sc in enumerate(scenarios):
+        groups.setdefault(sc["max_mileage"], []).append((i, sc))
+
+    # Fit/persist each distinct model here so workers load it from disk instead of refitting
+    for max_mileage in groups:
+        registry.warm(max_mileage)
+
+    results = [None] * len(scenarios)
+    if len(scenarios) < MIN_PARALLEL_SCENARIOS or MAX_WORKERS <= 1:
+        for max_mileage, items in groups.items():
+            for i, r in _plan_group(fleet, max_mileage, items, include_plans):
+                results[i] = r
+        return results
+
+    # Split large groups so a sweep over one max_mileage still uses every worker
+    chunk = max(1, -(-len(scenarios) // (MAX_WORKERS * 2)))
+    pool = _get_pool()
+    futures = [
+        pool.submit(_plan_group, fleet, max_mileage, items[k:k + chunk], include_plans)
+        for max_mileage, items in groups.items()
+        for k in range(0, len(items), chunk)
+    ]
+    for f in futures:
+        for i, r in f.result():
+            results[i] = r
+    return results
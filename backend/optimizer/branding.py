@@ -0,0 +1,186 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Revenue hours a rake in service runs tomorrow, counted towards its branding exposure
+SERVICE_HOURS = 16.0
+# Packs a (train code, campaign code) pair into one dict key
+_PAIR = 1 << 32
+
+
+def campaign_rows(branding, tomorrow):
+    """Branded trains: train_id, campaign_id, min_exposure_hours, window_end and days_left.
+
+    days_left counts the nights from tomorrow to window_end, both included, so
+    it is 0 or less once the window has ended. The first row of each train
+    counts; rows without a campaign, hours or window_end are left out.
+    """
+    tomorrow = pd.Timestamp(tomorrow)
+    b = branding.dropna(subset=["train_id"]).drop_duplicates("train_id", keep="first")
+    hours = pd.to_numeric(b["min_exposure_hours"], errors="coerce")
+    window_end = pd.to_datetime(b["window_end"], errors="coerce").dt.normalize()
+    campaign = b["campaign_id"].astype(str).str.strip()
+    keep = (hours.gt(0) & window_end.notna() & campaign.ne("") & b["campaign_id"].notna()).to_numpy()
+    return pd.DataFrame({
+        "train_id": b["train_id"].to_numpy()[keep],
+        "campaign_id": campaign.to_numpy()[keep],
+        "min_exposure_hours": hours.to_numpy(dtype=float)[keep],
+        "window_end": window_end.to_numpy()[keep],
+        "days_left": (window_end - tomorrow).dt.days.to_numpy()[keep] + 1,
+    })
+
+
+def active_campaigns(branding, tomorrow):
+    """campaign_rows of the campaigns still running tomorrow."""
+    rows = campaign_rows(branding, tomorrow)
+    return rows[rows["days_left"].to_numpy() >= 1].reset_index(drop=True)
+
+
+class ExposureTracker:
+    """Cumulative exposure hours per (train, campaign) from committed plans, in growable arrays.
+
+    Train and campaign ids are interned to integer codes and each pair has a
+    slot in one hours array, with a second array of per-campaign totals, so
+    a lookup is O(1) per train however many campaigns there are.
+
+    The totals are loaded from loader() and kept against the store's
+    revision, which stamp() returns. Every read checks the stamp first and
+    reloads when another process (a job worker, another server worker) has
+    committed since; this process's own commits are added in place.
+    """
+
+    def __init__(self, loader=None, stamp=None):
+        self._loader = loader
+        self._stamp_of = stamp
+        self._lock = threading.Lock()
+        self._reset()
+        self._stamp = None
+        self._version = 0
+
+    def _reset(self):
+        self._trains, self._campaigns, self._slots = {}, {}, {}
+        self._hours = np.zeros(1024)
+        self._campaign_hours = np.zeros(64)
+
+    @staticmethod
+    def _code(table, key):
+        code = table.get(key)
+        if code is None:
+            code = table[key] = len(table)
+        return code
+
+    def _add(self, train_ids, campaign_ids, hours):
+        for t, c, h in zip(train_ids, campaign_ids, hours):
+            tc, cc = self._code(self._trains, t), self._code(self._campaigns, c)
+            slot = self._slots.setdefault(tc * _PAIR + cc, len(self._slots))
+            if slot >= len(self._hours):
+                self._hours = np.concatenate([self._hours, np.zeros(len(self._hours))])
+            if cc >= len(self._campaign_hours):
+                self._campaign_hours = np.concatenate([self._campaign_hours, np.zeros(len(self._campaign_hours))])
+            self._hours[slot] += h
+            self._campaign_hours[cc] += h
+        self._version += 1
+
+    def _ensure(self):
+        # Called with the lock held
+        if self._loader is None:
+            return
+        # Stamp first: a commit landing between the two reads only causes one more reload
+        stamp = self._stamp_of()
+        if stamp != self._stamp:
+            self._reset()
+            self._add(*self._loader())
+            self._stamp = stamp
+
+    def revision(self):
+        """Changes with every update seen by this process, so plans can be cached against it."""
+        with self._lock:
+            self._ensure()
+            return self._version
+
+    def update(self, write):
+        """Run write(), which stores a change and returns it with the store's new revision, and add it.
+
+        write() returns ((train_ids, campaign_ids, hours), revision). The
+        change is added in place when nothing else was committed since the
+        last load; otherwise the next read reloads the totals.
+        """
+        with self._lock:
+            change, stamp = write()
+            if self._loader is None or (self._stamp is not None and stamp == self._stamp + 1):
+                self._add(*change)
+                self._stamp = stamp
+            return change
+
+    def hours(self, train_ids, campaign_ids):
+        """Exposure of each train in the campaign next to it, 0 when none is recorded."""
+        with self._lock:
+            self._ensure()
+            slots = np.array([
+                -1 if tc is None or cc is None else self._slots.get(tc * _PAIR + cc, -1)
+                for tc, cc in zip(map(self._trains.get, train_ids), map(self._campaigns.get, campaign_ids))
+            ], dtype=int)
+            return np.where(slots >= 0, self._hours[slots], 0.0) if len(slots) else np.zeros(0)
+
+    def campaign_hours(self, campaign_id):
+        """Total exposure of a campaign over all its trains."""
+        with self._lock:
+            self._ensure()
+            cc = self._campaigns.get(campaign_id)
+            return 0.0 if cc is None else float(self._campaign_hours[cc])
+
+
+def _history_totals():
+    # Imported here: the history module plans through the model, which reads this one
+    from backend.history import history
+    return history.exposure_totals()
+
+
+def _history_revision():
+    from backend.history import history
+    return history.exposure_revision()
+
+
+exposure = ExposureTracker(_history_totals, _history_revision)
+
+
+def exposure_deficits(train_ids, branding, tomorrow, tracker=exposure):
+    """Per train: hours its running campaign still needs from it, and the nights left (0 and 0 without one)."""
+    a = active_campaigns(branding, tomorrow)
+    needed = a["min_exposure_hours"].to_numpy() - tracker.hours(a["train_id"].tolist(), a["campaign_id"].tolist())
+    idx = pd.Index(a["train_id"]).get_indexer(train_ids)
+    # Trains without a running campaign index the trailing 0
+    deficit = np.append(np.maximum(needed, 0), 0.0)[idx]
+    days = np.append(a["days_left"].to_numpy(dtype=float), 0.0)[idx]
+    return deficit, days
+
+
+def campaign_status(branding, tomorrow, include_ended=False, tracker=exposure):
+    """Per campaign: trains, required, recorded and remaining exposure hours, window_end and days left.
+
+    Remaining hours add up what each train still owes its campaign, and
+    hours_per_night spreads them over the nights left. Campaigns furthest
+    behind come first.
+    """
+    rows = campaign_rows(branding, tomorrow)
+    if not include_ended:
+        rows = rows[rows["days_left"].to_numpy() >= 1]
+    got = tracker.hours(rows["train_id"].tolist(), rows["campaign_id"].tolist())
+    rows = rows.assign(remaining=np.maximum(rows["min_exposure_hours"].to_numpy() - got, 0))
+    out = []
+    for campaign_id, g in rows.groupby("campaign_id", sort=True):
+        days_left = int(g["days_left"].max())
+        remaining = float(g["remaining"].sum())
+        out.append({
+            "campaign_id": campaign_id,
+            "trains": len(g),
+            "required_hours": float(g["min_exposure_hours"].sum()),
+            "exposure_hours": tracker.campaign_hours(campaign_id),
+            "remaining_hours": remaining,
+            "window_end": str(pd.Timestamp(g["window_end"].max()).date()),
+            "days_left": days_left,
+            "hours_per_night": round(remaining / days_left, 3) if days_left > 0 else None,
+        })
+    out.sort(key=lambda c: (c["hours_per_night"] is None, -(c["hours_per_night"] or 0), c["campaign_id"]))
+    return out
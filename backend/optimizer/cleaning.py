@@ -0,0 +1,193 @@
+import heapq
+import os
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+
+from backend.optimizer.branding import active_campaigns
+from backend.optimizer.horizon import KM_PER_NIGHT
+from backend.optimizer.shard import depot_of
+
+# Without CLEANING_BAYS (columns bay, opens, closes as HH:MM, optional depot): this many bays, open for the same window, shared by every depot
+DEFAULT_BAYS = int(os.environ.get("KMRL_CLEANING_BAYS", "2"))
+DEFAULT_WINDOW = os.environ.get("KMRL_CLEANING_WINDOW", "21:00-05:00")
+# Minutes per cleaning when cleaning.csv has no cleaning_minutes column
+CLEANING_MINUTES = int(os.environ.get("KMRL_CLEANING_MINUTES", "90"))
+
+_DAY = 24 * 60
+
+
+def night_minutes(value, default):
+    """Minutes from midnight before the planning night; clock times before 12:00 are the morning after."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)) or str(value).strip() == "":
+        return default
+    hh, mm = str(value).strip().split(":")[:2]
+    minutes = int(hh) * 60 + int(mm)
+    return minutes + _DAY if minutes < 12 * 60 else minutes
+
+
+def _window():
+    start, end = DEFAULT_WINDOW.split("-")
+    return night_minutes(start, 0), night_minutes(end, 0)
+
+
+def load_bays(bays=None):
+    """[(bay, depot or None, opens, closes)] in night minutes from a CLEANING_BAYS frame; depot None serves every depot."""
+    if bays is None:
+        opens, closes = _window()
+        return [(f"CB{k + 1}", None, opens, closes) for k in range(DEFAULT_BAYS)]
+    opens, closes = _window()
+    out = []
+    for r in bays.to_dict("records"):
+        depot = r.get("depot")
+        depot = None if depot is None or pd.isna(depot) or str(depot).strip() == "" else str(depot).strip()
+        out.append((str(r["bay"]), depot, night_minutes(r.get("opens"), opens),
+                    night_minutes(r.get("closes"), closes)))
+    return out
+
+
+def branding_deadlines(train_ids, branding, tomorrow):
+    """Days until the end of each train's active branding window (inf when it has none)."""
+    a = active_campaigns(branding, tomorrow)
+    days = pd.Series(a["days_left"].to_numpy(dtype=float) - 1, index=a["train_id"].to_numpy())
+    return pd.Index(train_ids).map(days).to_numpy(dtype=float, na_value=np.inf)
+
+
+def service_due(fleet, max_mileage):
+    """Nights until each train is next due for service: its first certificate expiry or reaching max_mileage."""
+    km = fleet["km"].to_numpy(dtype=float)
+    dte = fleet["dte"].to_numpy(dtype=float)
+    with np.errstate(invalid="ignore"):
+        by_km = np.floor(np.maximum(max_mileage - km, 0) / max(KM_PER_NIGHT, 1))
+    return np.fmin(np.where(np.isnan(by_km), np.inf, by_km), np.where(np.isnan(dte), np.inf, dte))
+
+
+def _availability(train_ids, cleaning):
+    # Per-train availability window and duration from optional cleaning.csv columns
+    c = cleaning.dropna(subset=["train_id"]).drop_duplicates("train_id", keep="first").set_index("train_id")
+    idx = pd.Index(train_ids)
+
+    def column(name, default, convert):
+        if name not in c.columns:
+            return np.full(len(idx), default, dtype=float)
+        values = c[name].reindex(idx)
+        return np.array([convert(v, default) for v in values.tolist()], dtype=float)
+
+    def minutes(v, default):
+        v = pd.to_numeric(v, errors="coerce")
+        return default if pd.isna(v) or v <= 0 else float(v)
+
+    return (
+        column("available_from", -np.inf, night_minutes),
+        column("available_until", np.inf, night_minutes),
+        column("cleaning_minutes", float(CLEANING_MINUTES), minutes),
+    )
+
+
+def _earliest_slot(heap, ready, until, duration, closes, shortest):
+    # Pop bays in order of when they are free until one fits, leaving that one popped; returns
+    # (start, bay, free) or None. Bays free later can only start later, so once the train's own
+    # window is missed there is no point looking further. Bays too full for even the shortest
+    # cleaning are dropped for good.
+    skipped = []
+    found = None
+    while heap:
+        free, k = heapq.heappop(heap)
+        if free + shortest > closes[k]:
+            continue
+        start = max(free, ready)
+        if start + duration > until:
+            skipped.append((free, k))
+            break
+        if start + duration <= closes[k]:
+            found = (start, k, free)
+            break
+        skipped.append((free, k))
+    for item in skipped:
+        heapq.heappush(heap, item)
+    return found
+
+
+def schedule(requests, bays, max_slots):
+    """Greedy interval scheduling in priority order.
+
+    requests are (priority key, row, depot, ready, until, duration) tuples, the
+    smallest key served first; each train takes the bay of its depot (or a
+    shared bay) where it can start, and so finish, earliest. At most max_slots
+    trains are scheduled. Returns {row: (bay index, start, end)}.
+    """
+    closes = [b[3] for b in bays]
+    heaps = {}
+    for k, (_, depot, opens, _) in enumerate(bays):
+        heaps.setdefault(depot, []).append((opens, k))
+    for h in heaps.values():
+        heapq.heapify(h)
+
+    queue = list(requests)
+    heapq.heapify(queue)
+    shortest = min((r[5] for r in queue), default=0)
+    out = {}
+    while queue and len(out) < max_slots and any(heaps.values()):
+        _, row, depot, ready, until, duration = heapq.heappop(queue)
+        candidates = []
+        for key in ([depot, None] if depot is not None else [None]):
+            if heaps.get(key):
+                slot = _earliest_slot(heaps[key], ready, until, duration, closes, shortest)
+                if slot is not None:
+                    candidates.append(slot + (key,))
+        if not candidates:
+            continue
+        candidates.sort(key=lambda c: (c[0], c[1]))
+        start, k, _, key = candidates[0]
+        heapq.heappush(heaps[key], (start + duration, k))
+        for _, k2, free2, key2 in candidates[1:]:
+            heapq.heappush(heaps[key2], (free2, k2))
+        out[row] = (k, start, start + duration)
+    return out
+
+
+def plan_cleaning(fleet, candidates, risk_scores, cleaning, branding, stabling, bays, tomorrow,
+                  max_slots, max_mileage):
+    """Cleaning slots for the candidate rows, highest risk first, then the nearest branding
+    deadline, then the soonest service due, then fleet order.
+
+    branding and stabling are None when their files are missing: no train then has a
+    branding deadline or a depot. Returns the slot mask over the fleet and the schedule
+    records (train_id, bay, start, end).
+    """
+    rows = np.flatnonzero(candidates)
+    train_ids = fleet["train_id"].to_numpy(dtype=object)
+    ids = train_ids[rows]
+    risk = np.asarray(risk_scores, dtype=float)[rows]
+    # Only the candidates' rows of each source are looked at
+    wanted = pd.Index(ids)
+    branding, stabling, cleaning = (
+        None if df is None else df[df["train_id"].isin(wanted)] for df in (branding, stabling, cleaning))
+    deadline = np.full(len(ids), np.inf) if branding is None else branding_deadlines(ids, branding, tomorrow)
+    due = service_due(fleet, max_mileage)[rows]
+    depots = pd.Series(dtype=object) if stabling is None else depot_of(stabling)
+    depot = wanted.map(depots).to_numpy(dtype=object) if len(depots) else np.full(len(ids), None)
+    ready, until, minutes = _availability(ids, cleaning)
+
+    bay_list = load_bays(bays)
+    requests = [
+        ((-risk[j], deadline[j], due[j], int(r)), int(r), None if pd.isna(depot[j]) else depot[j],
+         ready[j], until[j], minutes[j])
+        for j, r in enumerate(rows)
+    ]
+    slots = schedule(requests, bay_list, max(int(max_slots), 0))
+
+    night = datetime.combine(pd.Timestamp(tomorrow).date() - timedelta(days=1), time())
+    mask = np.zeros(len(fleet), dtype=bool)
+    records = []
+    for r in sorted(slots):
+        k, start, end = slots[r]
+        mask[r] = True
+        records.append({
+            "train_id": train_ids[r],
+            "bay": bay_list[k][0],
+            "start": (night + timedelta(minutes=start)).isoformat(timespec="minutes"),
+            "end": (night + timedelta(minutes=end)).isoformat(timespec="minutes"),
+        })
+    return mask, records
@@ -0,0 +1,108 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from backend.datastore import store
+from backend.optimizer.rules import CERT_COLS
+
+# Query kinds: one per certificate, plus the earliest of the three
+KINDS = {"rolling": "rolling_expiry", "signalling": "signalling_expiry", "telecom": "telecom_expiry"}
+ANY = "any"
+
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def day_number(d):
+    """Days since 1970-01-01 of a date, the unit the index is kept in."""
+    return int((np.datetime64(pd.Timestamp(d).date(), "D") - _EPOCH).astype(int))
+
+
+class ExpiryIndex:
+    """Per-train expiry day of every certificate, kept sorted per kind for range queries.
+
+    Uses the same row per train as the planner (the first one for each
+    train_id) and day-level dates, so days_until() gives exactly the
+    <cert>_days columns merge_sources would compute.
+    """
+
+    def __init__(self, fitness):
+        fitness = fitness.dropna(subset=["train_id"]).drop_duplicates("train_id", keep="first")
+        self.train_ids = fitness["train_id"].to_numpy(dtype=object)
+        self._pos = pd.Index(self.train_ids)
+        self.days = {}
+        for col in CERT_COLS:
+            values = fitness[col] if col in fitness.columns else pd.Series(pd.NaT, index=fitness.index)
+            if not pd.api.types.is_datetime64_any_dtype(values):
+                values = pd.to_datetime(values, errors="coerce")
+            days = values.dt.normalize().to_numpy(dtype="datetime64[D]")
+            self.days[col] = np.where(np.isnat(days), np.nan, (days - _EPOCH).astype(float))
+
+        stacked = np.column_stack([self.days[c] for c in CERT_COLS]) if len(self.train_ids) else np.empty((0, 3))
+        filled = np.where(np.isnan(stacked), np.inf, stacked)
+        earliest = filled.min(axis=1)
+        self.days[ANY] = np.where(np.isinf(earliest), np.nan, earliest)
+        self.earliest_kind = np.array(CERT_COLS, dtype=object)[filled.argmin(axis=1)] if len(filled) else \
+            np.array([], dtype=object)
+
+        # Sorted (expiry day, row) per kind; rows without a date are left out
+        self._sorted = {}
+        for kind, days in self.days.items():
+            rows = np.flatnonzero(~np.isnan(days))
+            rows = rows[np.argsort(days[rows], kind="stable")]
+            self._sorted[kind] = (days[rows], rows)
+
+    def __len__(self):
+        return len(self.train_ids)
+
+    def days_until(self, train_ids, tomorrow):
+        """Per certificate, days from tomorrow to expiry for each train (NaN when unknown), and
+        whether each train has a fitness row at all."""
+        rows = self._pos.get_indexer(pd.Index(train_ids, dtype=object))
+        found = rows >= 0
+        ref = day_number(tomorrow)
+        out = {}
+        for col in CERT_COLS:
+            days = np.full(len(rows), np.nan)
+            days[found] = self.days[col][rows[found]] - ref
+            out[col] = days
+        return out, found
+
+    def expiring(self, kind, last_day, first_day=None):
+        """Rows whose expiry day lies in [first_day, last_day], earliest first; binary search per bound."""
+        keys, rows = self._sorted[kind]
+        lo = 0 if first_day is None else np.searchsorted(keys, first_day, side="left")
+        hi = np.searchsorted(keys, last_day, side="right")
+        return rows[lo:hi]
+
+    def records(self, kind, rows, today):
+        ref = day_number(today)
+        days = self.days[kind][rows]
+        out = {
+            "train_id": self.train_ids[rows].tolist(),
+            "expiry": [str(_EPOCH + int(d)) for d in days],
+            "days_left": (days - ref).astype(int).tolist(),
+        }
+        if kind == ANY:
+            out["certificate"] = self.earliest_kind[rows].tolist()
+        return [dict(zip(out, r)) for r in zip(*out.values())]
+
+
+class FitnessIndex:
+    """The expiry index of the current fitness.csv, rebuilt only when its content changes."""
+
+    def __init__(self):
+        self._index = None
+        self._digest = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        digest = store.digest("fitness.csv")
+        with self._lock:
+            if self._index is None or digest != self._digest:
+                self._index = ExpiryIndex(store.frame("fitness.csv"))
+                self._digest = digest
+            return self._index
+
+
+expiry_index = FitnessIndex()
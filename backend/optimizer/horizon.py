@@ -0,0 +1,104 @@
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from backend.optimizer.branding import SERVICE_HOURS
+from backend.optimizer.model import load_fleet, planning_date, score_risk
+from backend.optimizer.rules import BRAND_COLS, apply_rules, feature_frame
+
+# Kilometres a rake in service runs per night, added to its projected km_since_last_service
+KM_PER_NIGHT = int(os.environ.get("KMRL_KM_PER_NIGHT", "350"))
+MAX_NIGHTS = 31
+
+
+def _advance(km, dte, needs_cleaning, status, reason, max_mileage, km_per_night):
+    # State the next night starts from: service rakes run, mileage holds reset the counter,
+    # cleaned rakes are clean, and every certificate is a day closer to expiry
+    km = np.where(status == "Service", km + km_per_night, km)
+    km[reason == f"Exceeded mileage threshold ({max_mileage} km)"] = 0
+    needs_cleaning = np.where(reason == "Cleaning slot assigned", 0, needs_cleaning)
+    return km, dte - 1, needs_cleaning
+
+
+def _advance_branding(deficit, days, status):
+    # Service rakes earn a night of exposure towards their campaign, whose window is a night shorter
+    deficit = np.where(status == "Service", np.maximum(deficit - SERVICE_HOURS, 0), deficit)
+    return deficit, np.maximum(days - 1, 0)
+
+
+def plan_horizon(required_service, nights=14, max_cleaning_slots=2, max_mileage=8000,
+                 km_per_night=KM_PER_NIGHT, include_plans=True, fleet=None):
+    """Plans for `nights` consecutive nights from tomorrow, each starting from the state the night before left.
+
+    The fleet is loaded and merged once; later nights only update the projected
+    km, days to expiry and cleaning flags and re-run the column-wise rules.
+    Risk is scored for all nights in a single model call. Night 0 is exactly
+    the plan run_optimizer gives; later nights also count the branding
+    exposure the earlier ones earned when promoting. Open jobcards stay open
+    and trains without data stay without data, since nothing is known about
+    when that changes.
+    """
+    tomorrow = planning_date()
+    if fleet is None:
+        fleet = load_fleet(tomorrow)
+    has_data = fleet["has_data"].to_numpy(dtype=bool)
+    km = fleet["km"].to_numpy(dtype=float).copy()
+    dte = fleet["dte"].to_numpy(dtype=float).copy()
+    needs_cleaning = fleet["needs_cleaning"].to_numpy().copy()
+    branded = all(c in fleet.columns for c in BRAND_COLS)
+    if branded:
+        deficit, days = (fleet[c].to_numpy(dtype=float) for c in BRAND_COLS)
+
+    statuses, reasons, kms, dtes, features = [], [], [], [], []
+    for _ in range(nights):
+        night = fleet.assign(km=km, dte=dte, expired=has_data & (dte < 0), needs_cleaning=needs_cleaning)
+        if branded:
+            night = night.assign(brand_deficit=deficit, brand_days_left=days)
+        status, reason = apply_rules(night, required_service, max_cleaning_slots, max_mileage)
+        statuses.append(status)
+        reasons.append(reason)
+        kms.append(km)
+        dtes.append(dte)
+        features.append(feature_frame(night))
+        km, dte, needs_cleaning = _advance(km, dte, needs_cleaning, status, reason, max_mileage, km_per_night)
+        if branded:
+            deficit, days = _advance_branding(deficit, days, status)
+
+    scores, labels, _ = score_risk(pd.concat(features, ignore_index=True), max_mileage)
+    scores = np.round(scores.astype(float), 3).reshape(nights, len(fleet))
+    labels = np.asarray(labels, dtype=object).reshape(nights, len(fleet))
+
+    summary = [
+        {
+            "night": str(tomorrow + timedelta(days=n)),
+            "service": int((statuses[n] == "Service").sum()),
+            "standby": int((statuses[n] == "Standby").sum()),
+            "ibl": int((statuses[n] == "IBL").sum()),
+            "cleaning": int((reasons[n] == "Cleaning slot assigned").sum()),
+            "mileage_holds": int((reasons[n] == f"Exceeded mileage threshold ({max_mileage} km)").sum()),
+            "mean_risk": round(float(scores[n].mean()), 3) if len(fleet) else None,
+        }
+        for n in range(nights)
+    ]
+    out = {
+        "required_service": required_service,
+        "max_cleaning_slots": max_cleaning_slots,
+        "max_mileage": max_mileage,
+        "km_per_night": km_per_night,
+        "nights": [s["night"] for s in summary],
+        "summary": summary,
+    }
+    if include_plans:
+        # Matrices are [night][train], trains in plan order
+        out.update({
+            "train_id": fleet["train_id"].tolist(),
+            "status": [s.tolist() for s in statuses],
+            "reason": [r.tolist() for r in reasons],
+            "km_since_last_service": [[int(k) if k == k else None for k in night] for night in kms],
+            "days_to_expiry": [[int(d) if d == d else None for d in night] for night in dtes],
+            "risk_score": scores.tolist(),
+            "risk_label": labels.tolist(),
+        })
+    return out
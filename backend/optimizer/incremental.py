@@ -0,0 +1,259 @@
+import threading
+from bisect import bisect_left, insort
+
+import numpy as np
+import pandas as pd
+
+from backend.datastore import store
+from backend.optimizer.branding import exposure
+from backend.optimizer.model import _ml_predict, planning_date, plan_records, with_branding
+from backend.optimizer.rules import (
+    CERT_COLS, SOURCE_KEYS, apply_rules, feature_frame, finish_fleet, merge_sources, promotion_order,
+    promotion_weight,
+)
+
+# Rule outcome of a train before the fleet-wide passes (balancing, cleaning slots, quota)
+MISSING, OPEN, EXPIRED, HIGH, CLEAN, HEALTHY = range(6)
+FORCED_REASONS = {MISSING: "Missing data", OPEN: "Open jobcard", EXPIRED: "Expired fitness certificate"}
+
+
+def _remove(lst, i):
+    k = bisect_left(lst, i)
+    if k < len(lst) and lst[k] == i:
+        del lst[k]
+
+
+def _contains(lst, i):
+    k = bisect_left(lst, i)
+    return k < len(lst) and lst[k] == i
+
+
+class FleetState:
+    """A plan kept up to date from single-train change events.
+
+    Applying an event re-derives only that train's rule outcome and risk
+    score. The fleet-wide passes keep sorted member lists (high mileage,
+    cleaning candidates, pre-quota standby) so only the trains around each
+    cut-off need to be looked at again. The result always equals a full
+    apply_rules run over the patched data.
+
+    Events do not touch branding, so the promotion order is fixed for the
+    life of the state and the standby list holds positions in that order.
+    """
+
+    def __init__(self, raw, tomorrow, required_service, max_cleaning_slots, max_mileage):
+        self.raw = raw.reset_index(drop=True)
+        self.tomorrow = pd.Timestamp(tomorrow)
+        self.required_service = required_service
+        self.max_cleaning_slots = max_cleaning_slots
+        self.slots = max(max_cleaning_slots, 0)
+        self.max_mileage = max_mileage
+        self.pos = {t: i for i, t in enumerate(self.raw["train_id"].tolist())}
+
+        self.fleet = finish_fleet(self.raw)
+        self.status, self.reason = apply_rules(self.fleet, required_service, max_cleaning_slots, max_mileage)
+        scores, labels = _ml_predict(feature_frame(self.fleet), max_mileage)
+        self.risk = np.asarray(scores, dtype=float)
+        self.labels = np.asarray(labels, dtype=object)
+
+        self.cat = self._categories(np.arange(len(self.raw)))
+        self.high_list = np.flatnonzero(self._in_high(np.arange(len(self.raw)))).tolist()
+        self.clean_list = np.flatnonzero(self.cat == CLEAN).tolist()
+        slot = set(self.clean_list[:self.slots])
+        self.order = promotion_order(promotion_weight(self.fleet), len(self.raw))
+        self.rank = np.empty(len(self.raw), dtype=int)
+        self.rank[self.order] = np.arange(len(self.raw))
+        self.standby_list = [
+            r for r, i in enumerate(self.order.tolist())
+            if self.cat[i] == HEALTHY or (self.cat[i] == CLEAN and i not in slot)
+        ]
+
+    def _in_high(self, rows):
+        km = self.fleet["km"].to_numpy()[rows]
+        with np.errstate(invalid="ignore"):
+            return ~np.isnan(km) & (km != 0) & (km > self.max_mileage)
+
+    def _categories(self, rows):
+        f = self.fleet
+        has_data = f["has_data"].to_numpy()[rows]
+        jc_open = f["jobcard_open"].to_numpy()[rows] == 1
+        expired = f["expired"].to_numpy()[rows]
+        needs_clean = f["needs_cleaning"].to_numpy()[rows] == 1
+        high = self._in_high(rows)
+        return np.select(
+            [~has_data, jc_open, expired, high, needs_clean],
+            [MISSING, OPEN, EXPIRED, HIGH, CLEAN],
+            default=HEALTHY,
+        )
+
+    def _outcome(self, i):
+        # Same precedence as apply_rules, answered from ranks in the sorted member lists
+        n_high = len(self.high_list)
+        if _contains(self.high_list, i):
+            if bisect_left(self.high_list, i) < n_high // 2:
+                return "Service", "Promoted for balanced mileage distribution"
+            return "IBL", f"Exceeded mileage threshold ({self.max_mileage} km)"
+        cat = self.cat[i]
+        if cat in FORCED_REASONS:
+            return "IBL", FORCED_REASONS[cat]
+        if cat == CLEAN and bisect_left(self.clean_list, i) < self.max_cleaning_slots:
+            return "IBL", "Cleaning slot assigned"
+        if bisect_left(self.standby_list, self.rank[i]) < self.required_service - n_high // 2:
+            return "Service", "Promoted to meet service quota"
+        return "Standby", "Needs cleaning but no slot left" if cat == CLEAN else "Healthy"
+
+    def _patch(self, event):
+        i = self.pos[event["train_id"]]
+        source = event["source"]
+        values = event.get("values") or {}
+        self.raw.at[i, f"has_{source}"] = True
+        if source == "jobcards" and "status" in values:
+            self.raw.at[i, "jc_open"] = str(values["status"]).lower() == "open"
+        elif source == "cleaning" and "needs_cleaning" in values:
+            self.raw.at[i, "clean_yes"] = str(values["needs_cleaning"]).lower() == "yes"
+        elif source == "mileage" and "km_since_last_service" in values:
+            self.raw.at[i, "km_raw"] = float(pd.to_numeric(values["km_since_last_service"], errors="coerce"))
+        elif source == "fitness":
+            for c in CERT_COLS:
+                if c in values:
+                    d = pd.to_datetime(values[c], errors="coerce")
+                    self.raw.at[i, f"{c}_days"] = np.nan if pd.isna(d) else float((d.normalize() - self.tomorrow).days)
+        return i
+
+    def apply(self, events):
+        """Apply change events and return the plan rows whose status, reason or risk changed."""
+        for e in events:
+            if e["train_id"] not in self.pos:
+                raise KeyError(f"Unknown train {e['train_id']}")
+            if e["source"] not in SOURCE_KEYS:
+                raise ValueError(f"Unknown source {e['source']}")
+
+        old_slot = set(self.clean_list[:self.slots])
+        old_k_high = len(self.high_list) // 2
+        touched = sorted({self._patch(e) for e in events})
+        if not touched:
+            return []
+
+        for i in touched:
+            _remove(self.high_list, i)
+            _remove(self.clean_list, i)
+            _remove(self.standby_list, self.rank[i])
+
+        # Re-derive the touched rows only
+        sub = finish_fleet(self.raw.iloc[touched])
+        self.fleet.iloc[touched] = sub
+        self.cat[touched] = self._categories(touched)
+        for i, h in zip(touched, self._in_high(touched)):
+            if h:
+                insort(self.high_list, i)
+            if self.cat[i] == CLEAN:
+                insort(self.clean_list, i)
+
+        # Cleaning-slot boundary: rakes that gained or lost a slot leave or join the standby pool
+        new_slot = set(self.clean_list[:self.slots])
+        touched_set = set(touched)
+        for i in old_slot - new_slot - touched_set:
+            if self.cat[i] == CLEAN:
+                insort(self.standby_list, self.rank[i])
+        for i in new_slot - old_slot - touched_set:
+            _remove(self.standby_list, self.rank[i])
+        for i in touched:
+            if self.cat[i] == HEALTHY or (self.cat[i] == CLEAN and i not in new_slot):
+                insort(self.standby_list, self.rank[i])
+
+        # Only rakes near a moved cut-off can change outcome
+        affected = set(touched) | (old_slot ^ new_slot)
+        d = len(touched) + len(old_slot ^ new_slot) + 2
+        k_high = len(self.high_list) // 2
+        w = abs(k_high - old_k_high) + 2 * len(touched) + 2
+        affected.update(self.high_list[max(k_high - w, 0):k_high + w])
+        quota = self.required_service - k_high
+        w = abs(k_high - old_k_high) + 2 * d
+        affected.update(self.order[self.standby_list[max(quota - w, 0):max(quota + w, 0)]].tolist())
+
+        # Touched rakes are always reported: their mileage or risk may have moved even if the status did not
+        scores, labels = _ml_predict(feature_frame(sub), self.max_mileage)
+        self.risk[touched] = scores
+        self.labels[touched] = labels
+        changed = set(touched)
+
+        previous = {}
+        for i in affected:
+            st, rs = self._outcome(i)
+            if st != self.status[i] or rs != self.reason[i]:
+                previous[i] = (self.status[i], self.reason[i])
+                self.status[i] = st
+                self.reason[i] = rs
+                changed.add(i)
+
+        rows = sorted(changed)
+        diff = plan_records(
+            self.fleet.iloc[rows], self.status[rows], self.reason[rows],
+            (self.risk[rows].tolist(), self.labels[rows].tolist()),
+        )
+        for r, i in zip(diff, rows):
+            if i in previous:
+                r["previous_status"], r["previous_reason"] = previous[i]
+        return diff
+
+    def plan(self):
+        return plan_records(self.fleet, self.status, self.reason, (self.risk.tolist(), self.labels.tolist()))
+
+
+class LiveFleet:
+    """The fleet state the /events endpoint patches, rebuilt when the CSVs, the parameters or the date change.
+
+    A parameter change alone re-plans the already patched data, so events are not lost,
+    and so does new branding exposure from a committed plan.
+    """
+
+    def __init__(self):
+        self._state = None
+        self._data = None
+        self._params = None
+        self._brand = None
+        self._lock = threading.Lock()
+        # Bumped when applied events change the plan; with the data key it tells watchers when to re-plan
+        self.version = 0
+
+    def _data_key(self):
+        digests = tuple(store.digest(f"{k}.csv") for k in SOURCE_KEYS)
+        return digests, planning_date()
+
+    def _brand_key(self):
+        digest = store.digest("branding.csv") if store.exists("branding.csv") else None
+        return digest, exposure.revision()
+
+    def revision(self):
+        return self._data_key(), self._brand_key(), self.version
+
+    def state(self, required_service, max_cleaning_slots=2, max_mileage=8000):
+        params = (required_service, max_cleaning_slots, max_mileage)
+        data, brand = self._data_key(), self._brand_key()
+        if self._state is None or data != self._data:
+            tomorrow = data[1]
+            raw = merge_sources(*(store.frame(f"{k}.csv") for k in SOURCE_KEYS), tomorrow)
+            self._state = FleetState(with_branding(raw, tomorrow), tomorrow, *params)
+        elif brand != self._brand:
+            self._state = FleetState(with_branding(self._state.raw, data[1]), data[1], *params)
+        elif params != self._params:
+            self._state = FleetState(self._state.raw, data[1], *params)
+        else:
+            return self._state
+        self._data, self._brand, self._params = data, brand, params
+        return self._state
+
+    def apply(self, events, required_service, max_cleaning_slots=2, max_mileage=8000):
+        with self._lock:
+            state = self.state(required_service, max_cleaning_slots, max_mileage)
+            changes = state.apply(events)
+            if changes:
+                self.version += 1
+            return changes
+
+    def plan(self, required_service, max_cleaning_slots=2, max_mileage=8000):
+        with self._lock:
+            return self.state(required_service, max_cleaning_slots, max_mileage).plan()
+
+
+live_fleet = LiveFleet()
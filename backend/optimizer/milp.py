@@ -0,0 +1,276 @@
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy.optimize import milp, LinearConstraint, Bounds
+    from scipy.sparse import coo_matrix, csr_matrix, vstack
+except ImportError:  # the rule path keeps working without scipy
+    milp = None
+
+from backend.optimizer.branding import SERVICE_HOURS, active_campaigns, exposure
+from backend.optimizer.rules import apply_rules, high_mileage
+
+DEFAULT_TIME_LIMIT = 10.0
+MAX_TIME_LIMIT = 300.0
+# Below this much time left after building the model, HiGHS is not started and the rule plan stands
+MIN_SOLVE_SECONDS = 0.05
+# Share of the time left that HiGHS gets as its own limit; the rest covers starting and reporting back
+SOLVER_SHARE = 0.9
+
+# Objective weights (minimised)
+W_SERVICE = 0.01      # per rake in service, so the quota is met without over-inducting
+W_KM = 1.0            # per (km / max_mileage) of a rake in service: run the low-mileage ones
+W_RISK = 0.5          # per unit of predicted risk of a rake in service
+W_CLEAN = -1.0        # reward for using a cleaning slot on a rake that needs it
+W_MAINT = -0.5        # reward for sending an over-mileage rake to the IBL
+W_QUOTA = 1000.0      # per rake short of required_service
+W_BRAND = 5.0         # per exposure hour short of a campaign's nightly need
+
+SERVICE, STANDBY, CLEAN, MAINT = range(4)
+
+
+def branding_needs(fleet, branding, tomorrow):
+    """Per-train campaign index (-1 when none) and each active campaign's exposure hours needed tonight."""
+    if branding is None:
+        return np.full(len(fleet), -1), [], np.zeros(0)
+    a = active_campaigns(branding, tomorrow)
+    held = exposure.hours(a["train_id"].tolist(), a["campaign_id"].tolist())
+    b = pd.DataFrame({
+        "train_id": a["train_id"],
+        "campaign_id": a["campaign_id"],
+        # Spread the hours not yet recorded for committed plans evenly over the days left in the window
+        "need": np.maximum(a["min_exposure_hours"].to_numpy() - held, 0) / a["days_left"].to_numpy(),
+    })
+
+    campaigns = sorted(b["campaign_id"].unique())
+    code_of = {c: k for k, c in enumerate(campaigns)}
+    codes = fleet[["train_id"]].merge(b, on="train_id", how="left")["campaign_id"].map(code_of)
+    need = b.groupby("campaign_id")["need"].sum().reindex(campaigns).to_numpy(dtype=float)
+    return codes.fillna(-1).astype(int).to_numpy(), campaigns, need
+
+
+def _quota_bound(service_cost, other_cost, high, cap_high, required_service):
+    """Lower bound on the objective: the LP bound with only the quota and mileage-balancing rows kept.
+
+    Without the other rows each rake takes its cheapest choice, at most
+    cap_high high-mileage rakes run, and pricing the quota row at the rate
+    where required_service rakes are worth running gives the bound in
+    closed form. Used when HiGHS stops before it has a better one.
+    """
+    margin = service_cost - other_cost
+    runnable = np.sort(np.r_[margin[~high], np.sort(margin[high])[:cap_high]])
+    if required_service <= 0:
+        price = 0.0
+    elif required_service <= len(runnable):
+        price = float(np.clip(runnable[required_service - 1], 0, W_QUOTA))
+    else:
+        price = W_QUOTA
+    return (price * max(required_service, 0) + float(other_cost.sum())
+            + float(np.minimum(runnable - price, 0).sum()))
+
+
+def _highs(conn, c, integrality, bounds, constraints, options):
+    res = milp(c, integrality=integrality, bounds=bounds, constraints=constraints, options=options)
+    conn.send((res.status, res.message, res.x, res.fun, getattr(res, "mip_dual_bound", None)))
+    conn.close()
+
+
+def run_highs(c, integrality, bounds, constraints, seconds):
+    """(status, message, x, objective, dual_bound) from scipy's milp, or None when it has not finished in seconds.
+
+    HiGHS checks its time limit only between some of its steps and can
+    overrun it many times over on large fleets, so it runs in a child
+    process that is stopped once the seconds are up.
+    """
+    receive, send = multiprocessing.Pipe(duplex=False)
+    # HiGHS presolve is among the steps that overrun, and gains little on this model
+    options = {"time_limit": seconds * SOLVER_SHARE, "presolve": False}
+    worker = multiprocessing.Process(target=_highs, args=(send, c, integrality, bounds, constraints, options))
+    worker.start()
+    send.close()
+    try:
+        if receive.poll(seconds):
+            return receive.recv()
+        return None
+    except EOFError:
+        # The child died without answering
+        return None
+    finally:
+        if worker.is_alive():
+            worker.terminate()
+        worker.join()
+        receive.close()
+
+
+def _greedy_assignment(status, reason, avail, high, cap_high):
+    # Map the rule plan onto the model's choices, repairing anything the model forbids
+    choice = np.full(len(status), STANDBY)
+    choice[status == "Service"] = SERVICE
+    choice[(status == "IBL") & (reason == "Cleaning slot assigned")] = CLEAN
+    choice[(status == "IBL") & high] = MAINT
+    over = avail & high & (choice == SERVICE)
+    choice[np.flatnonzero(over)[cap_high:]] = MAINT
+    return choice[avail]
+
+
+def solve_milp(fleet, branding, tomorrow, required_service, max_cleaning_slots=2, max_mileage=8000,
+               risk_scores=None, time_limit=DEFAULT_TIME_LIMIT, service_hours=SERVICE_HOURS, started=None):
+    """Exact Service/Standby/IBL assignment with scipy's HiGHS MILP.
+
+    Returns (status, reason, info) with status/reason in fleet order, like apply_rules.
+    branding is None without branding.csv; there are then no exposure rows.
+    time_limit counts from started (a time.perf_counter() value, now by
+    default), so callers can include their own preparation. The rule plan
+    is scored under the same objective and kept when scipy is missing or the
+    solver finds nothing better in time; info then reports its gap to the
+    best lower bound known.
+    """
+    started = time.perf_counter() if started is None else started
+    time_limit = float(min(max(time_limit, 0.1), MAX_TIME_LIMIT))
+    greedy_status, greedy_reason = apply_rules(fleet, required_service, max_cleaning_slots, max_mileage)
+    if milp is None:
+        return greedy_status, greedy_reason, {"mode": "rules", "status": "scipy unavailable"}
+
+    n = len(fleet)
+    km = fleet["km"].to_numpy()
+    needs_clean = fleet["needs_cleaning"].to_numpy() == 1
+    avail = fleet["has_data"].to_numpy() & (fleet["jobcard_open"].to_numpy() == 0) & ~fleet["expired"].to_numpy()
+    high = high_mileage(fleet, max_mileage)
+    risk = np.zeros(n) if risk_scores is None else np.asarray(risk_scores, dtype=float)
+    codes, campaigns, need = branding_needs(fleet, branding, tomorrow)
+
+    idx = np.flatnonzero(avail)
+    na, nc = len(idx), len(campaigns)
+    cap_high = int(high[avail].sum()) // 2
+    # Variables: Service per available rake, cleaning-slot per rake needing one, IBL maintenance
+    # per high-mileage rake, then campaign shortfalls and the quota shortfall; Standby is none of them
+    clean_at = np.flatnonzero(needs_clean[idx])
+    maint_at = np.flatnonzero(high[idx])
+    nl, nm = len(clean_at), len(maint_at)
+    serve = np.arange(na)
+    clean = na + np.arange(nl)
+    maint = na + nl + np.arange(nm)
+    short_c = na + nl + nm + np.arange(nc)
+    short_q = na + nl + nm + nc
+    nv = short_q + 1
+
+    c = np.zeros(nv)
+    c[serve] = W_SERVICE + W_KM * np.nan_to_num(km[idx]) / max(max_mileage, 1) + W_RISK * risk[idx]
+    c[clean] = W_CLEAN
+    c[maint] = W_MAINT
+    c[short_c] = W_BRAND
+    c[short_q] = W_QUOTA
+
+    ub = np.ones(nv)
+    ub[short_c] = np.inf
+    ub[short_q] = np.inf
+    integrality = np.ones(nv)
+    integrality[short_c] = 0
+    integrality[short_q] = 0
+
+    rows = []
+    lo = []
+    hi = []
+    # At most one choice per rake; only rakes with more than Service to choose from need the row
+    both = np.union1d(clean_at, maint_at)
+    r = np.r_[np.arange(len(both)), np.searchsorted(both, clean_at), np.searchsorted(both, maint_at)]
+    rows.append(coo_matrix((np.ones(len(r)), (r, np.r_[both, clean, maint])), shape=(len(both), nv)))
+    lo.append(np.full(len(both), -np.inf)); hi.append(np.ones(len(both)))
+    # Service quota (soft), cleaning capacity, mileage balancing
+    row = np.zeros(nv); row[serve] = 1; row[short_q] = 1
+    rows.append(csr_matrix(row)); lo.append([required_service]); hi.append([np.inf])
+    row = np.zeros(nv); row[clean] = 1
+    rows.append(csr_matrix(row)); lo.append([-np.inf]); hi.append([max_cleaning_slots])
+    row = np.zeros(nv); row[serve[maint_at]] = 1
+    rows.append(csr_matrix(row)); lo.append([-np.inf]); hi.append([cap_high])
+    # Branding exposure (soft): hours from rakes in service plus shortfall cover tonight's need
+    if nc:
+        branded = codes[idx] >= 0
+        bc = codes[idx][branded]
+        a = coo_matrix(
+            (np.r_[np.full(len(bc), service_hours), np.ones(nc)],
+             (np.r_[bc, np.arange(nc)], np.r_[serve[branded], short_c])),
+            shape=(nc, nv),
+        )
+        rows.append(a); lo.append(need); hi.append(np.full(nc, np.inf))
+
+    # The repaired rule plan is feasible: the solution to beat, and the plan kept if nothing does
+    x0 = np.zeros(nv)
+    choice = _greedy_assignment(greedy_status, greedy_reason, avail, high, cap_high)
+    x0[serve] = choice == SERVICE
+    x0[clean] = choice[clean_at] == CLEAN
+    x0[maint] = choice[maint_at] == MAINT
+    served = np.bincount(codes[idx][(choice == SERVICE) & (codes[idx] >= 0)], minlength=nc) * service_hours
+    x0[short_c] = np.maximum(need - served, 0)
+    x0[short_q] = max(required_service - int((choice == SERVICE).sum()), 0)
+    z0 = float(c @ x0)
+
+    info = {"mode": "milp", "greedy_objective": round(z0, 4), "time_limit": time_limit}
+    remaining = started + time_limit - time.perf_counter()
+    res = None
+    if remaining >= MIN_SOLVE_SECONDS:
+        res = run_highs(
+            c, integrality, Bounds(np.zeros(nv), ub),
+            LinearConstraint(vstack(rows).tocsr(), np.concatenate(lo), np.concatenate(hi)),
+            remaining,
+        )
+    if res is None:
+        info["status"] = "time_limit"
+        info["message"] = "Time limit reached"
+        x = fun = highs_dual = None
+    else:
+        code, info["message"], x, fun, highs_dual = res
+        info["status"] = {0: "optimal", 1: "time_limit"}.get(code, "failed")
+
+    other = np.zeros(na)
+    other[clean_at] = W_CLEAN
+    other[maint_at] = np.minimum(other[maint_at], W_MAINT)
+    dual = _quota_bound(c[serve], other, high[idx], cap_high, required_service)
+    if highs_dual is not None and np.isfinite(highs_dual):
+        dual = max(dual, float(highs_dual))
+    if x is not None and fun <= z0:
+        x = x > 0.5
+        choice = np.full(na, STANDBY)
+        choice[x[serve]] = SERVICE
+        choice[clean_at[x[clean]]] = CLEAN
+        choice[maint_at[x[maint]]] = MAINT
+        objective = float(fun)
+    else:
+        # Nothing beat the rule plan in time: keep it and report how far it may be from optimal
+        info["mode"] = "milp_fallback"
+        objective = z0
+    dual = min(dual, objective)
+    info["objective"] = round(objective, 4)
+    info["dual_bound"] = round(dual, 4)
+    info["gap"] = 0.0 if info["status"] == "optimal" else round((objective - dual) / max(abs(objective), 1e-9), 6)
+
+    status = greedy_status.copy()
+    reason = greedy_reason.copy()
+    a_status = np.full(na, "Standby", dtype=object)
+    a_reason = np.full(na, "Healthy", dtype=object)
+    a_reason[needs_clean[idx]] = "Needs cleaning but no slot left"
+    hi_idx = np.flatnonzero(high[idx])
+    a_reason[hi_idx] = [f"High mileage ({int(k)} km)" for k in km[idx][hi_idx]]
+    a_status[choice == SERVICE] = "Service"
+    a_reason[choice == SERVICE] = "Assigned to service by optimizer"
+    a_reason[(choice == SERVICE) & (codes[idx] >= 0)] = "Assigned to service for branding exposure"
+    a_status[choice == CLEAN] = "IBL"
+    a_reason[choice == CLEAN] = "Cleaning slot assigned"
+    a_status[choice == MAINT] = "IBL"
+    a_reason[choice == MAINT] = f"Exceeded mileage threshold ({max_mileage} km)"
+    status[idx] = a_status
+    reason[idx] = a_reason
+
+    # Rakes the rules force into IBL are never candidates here
+    has_data = fleet["has_data"].to_numpy()
+    jc_open = fleet["jobcard_open"].to_numpy() == 1
+    status[~avail] = "IBL"
+    reason[~has_data] = "Missing data"
+    reason[has_data & jc_open] = "Open jobcard"
+    reason[has_data & ~jc_open & fleet["expired"].to_numpy()] = "Expired fitness certificate"
+    info["service_shortfall"] = max(required_service - int((status == "Service").sum()), 0)
+    info["solve_seconds"] = round(time.perf_counter() - started, 3)
+    return status, reason, info
@@ -1,222 +1,226 @@
+import hashlib
+import time
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
+from backend.optimizer.rules import FEATURE_COLS, build_fleet, apply_rules, cleaning_candidates, feature_frame
+from backend.optimizer.registry import registry
+from backend.optimizer.milp import solve_milp, DEFAULT_TIME_LIMIT
+from backend.optimizer.expiry import expiry_index
+from backend.optimizer.branding import exposure, exposure_deficits
+from backend.optimizer.planframe import PlanFrame, render
+from backend.datastore import CLEANING_BAYS, store
+from backend.metrics import OPTIMIZER_ERRORS, OPTIMIZER_RUNS, RISK_FALLBACKS, RISK_ROWS, RISK_SCORING, stage
+
+HIGH_RISK = "⚠️ High Risk (Service Soon)"
+MEDIUM_RISK = "△ Medium Risk"
+LOW_RISK = "✅ Low Risk"
+FEATURE_DEFAULTS = {"km": 0, "days_to_expiry": 30, "needs_cleaning": 0, "jobcard_open": 0}
+
+
+def risk_labels(scores):
+    scores = np.asarray(scores, dtype=float)
+    return np.select([scores >= 0.66, scores >= 0.33], [HIGH_RISK, MEDIUM_RISK], LOW_RISK).astype(object)
+
+
+def heuristic_risk(features_df, max_mileage):
+    """Rule-of-thumb risk in [0, 1] from mileage, certificate expiry, cleaning and jobcards."""
+    km = features_df["km"].fillna(0).to_numpy(dtype=float)
+    dte = features_df["days_to_expiry"].to_numpy(dtype=float)
+    needs_clean = features_df["needs_cleaning"].fillna(0).to_numpy(dtype=float).astype(int)
+    jc_open = features_df["jobcard_open"].fillna(0).to_numpy(dtype=float).astype(int)
+    scale = max(max_mileage, 1)
+
+    over = np.minimum((km - max_mileage) / scale, 1.5)
+    risk = np.where(km > max_mileage, 0.45 * np.minimum(1.0, 0.2 + over), 0.10 * (km / scale))
+    # Unknown expiry counts like a distant one
+    risk = risk + np.select([dte <= 0, dte <= 3, dte <= 7], [0.35, 0.25, 0.15], 0.05)
+    risk = risk + 0.06 * needs_clean
+    risk = risk + 0.22 * jc_open
+    return np.clip(risk, 0.0, 1.0)
+
+
+def score_risk(features_df, max_mileage, use_model=True):
+    """Risk scores and labels as arrays, plus which path produced them ("model" or "heuristic")."""
+    with stage("model_predict"):
+        if use_model:
+            try:
+                rf = registry.get(max_mileage)
+                feats = features_df[FEATURE_COLS].fillna({"days_to_expiry": 30})
+                feats["needs_cleaning"] = feats["needs_cleaning"].astype(int)
+                feats["jobcard_open"] = feats["jobcard_open"].astype(int)
+                scores = rf.predict_proba(feats)[:, 1]
+                path = "model"
+            except Exception as ex:
+                RISK_FALLBACKS.inc(error=type(ex).__name__)
+                use_model = False
+        if not use_model:
+            scores = heuristic_risk(features_df, max_mileage)
+            path = "heuristic"
+        RISK_SCORING.inc(path=path)
+        RISK_ROWS.inc(len(scores), path=path)
+        return scores, risk_labels(scores), path
 
-def _days_to_earliest_expiry(fit_row, tomorrow):
-    try:
-        dates = [
-            fit_row.get("rolling_expiry"),
-            fit_row.get("signalling_expiry"),
-            fit_row.get("telecom_expiry"),
-        ]
-        dates = [d.date() if pd.notna(d) else None for d in dates]
-        future = [(d - tomorrow).days for d in dates if d is not None]
-        return min(future) if future else None
-    except Exception:
-        return None
 
 def _ml_predict(features_df, max_mileage):
-    risk_scores = []
-    labels = []
-    try:
-        from sklearn.ensemble import RandomForestClassifier
-        import numpy as np
-
-        X_syn = []
-        y_syn = []
-
-        # Low-risk
-        for km in [1000, 3000, 5000, 7000]:
-            for d in [15, 30, 60]:
-                X_syn.append([km, d, 0, 0]); y_syn.append(0)
-                X_syn.append([km, d, 1, 0]); y_syn.append(0)
-        # Medium-risk
-        for km in [max_mileage-500, max_mileage, max_mileage+200]:
-            for d in [3, 7, 14]:
-                X_syn.append([km, d, 0, 0]); y_syn.append(1)
-                X_syn.append([km, d, 1, 0]); y_syn.append(1)
-        # High-risk
-        for km in [max_mileage+500, max_mileage+1500, max_mileage+3000]:
-            for d in [-5, 0, 2]:
-                X_syn.append([km, d, 1, 1]); y_syn.append(1)
-                X_syn.append([km, d, 0, 1]); y_syn.append(1)
-
-        X_syn = pd.DataFrame(X_syn, columns=["km", "days_to_expiry", "needs_cleaning", "jobcard_open"])
-        y_syn = pd.Series(y_syn)
-
-        rf = RandomForestClassifier(n_estimators=60, max_depth=6, random_state=42)
-        rf.fit(X_syn, y_syn)
-
-        feats = features_df.fillna({"days_to_expiry": 30})
-        feats["needs_cleaning"] = feats["needs_cleaning"].astype(int)
-        feats["jobcard_open"] = feats["jobcard_open"].astype(int)
-
-        proba = rf.predict_proba(feats[["km","days_to_expiry","needs_cleaning","jobcard_open"]])[:,1]
-        risk_scores = proba.tolist()
-
-        for p in proba:
-            if p >= 0.66:
-                labels.append("⚠️ High Risk (Service Soon)")
-            elif p >= 0.33:
-                labels.append("△ Medium Risk")
-            else:
-                labels.append("✅ Low Risk")
-
-        return risk_scores, labels
-
-    except Exception:
-        # Heuristic fallback
-        for _, r in features_df.iterrows():
-            km = r.get("km", 0) or 0
-            dte = r.get("days_to_expiry", 30)
-            needs_clean = int(r.get("needs_cleaning", 0) or 0)
-            jc_open = int(r.get("jobcard_open", 0) or 0)
-
-            risk = 0.0
-            if km > max_mileage:
-                over = min((km - max_mileage) / max(max_mileage,1), 1.5)
-                risk += 0.45 * min(1.0, 0.2 + over)
-            else:
-                risk += 0.10 * (km / max(max_mileage,1))
-
-            if dte is not None:
-                if dte <= 0:
-                    risk += 0.35
-                elif dte <= 3:
-                    risk += 0.25
-                elif dte <= 7:
-                    risk += 0.15
-                else:
-                    risk += 0.05
-
-            risk += 0.06 * needs_clean
-            risk += 0.22 * jc_open
-            risk = max(0.0, min(1.0, risk))
-            risk_scores.append(risk)
-
-            if risk >= 0.66:
-                labels.append("⚠️ High Risk (Service Soon)")
-            elif risk >= 0.33:
-                labels.append("△ Medium Risk")
-            else:
-                labels.append("✅ Low Risk")
-
-        return risk_scores, labels
-
-
-def run_optimizer(required_service:int, max_cleaning_slots:int=2, max_mileage:int=8000):
+    scores, labels, _ = score_risk(features_df, max_mileage)
+    return scores.tolist(), labels.tolist()
+
+
+def risk_features(columns):
+    """Feature frame from columns given by a client, filling optional ones with the planner's defaults."""
+    if "km" not in columns:
+        raise ValueError("Missing column: km")
+    for col in FEATURE_DEFAULTS:
+        if col in columns and not isinstance(columns[col], (list, tuple, np.ndarray, pd.Series)):
+            raise ValueError(f"Column {col} must be a list of values")
+    n = len(columns["km"])
+    out = {}
+    for col, default in FEATURE_DEFAULTS.items():
+        values = columns.get(col)
+        if values is None:
+            out[col] = np.full(n, default, dtype=float)
+            continue
+        if len(values) != n:
+            raise ValueError(f"Column {col} has {len(values)} values, expected {n}")
+        values = pd.to_numeric(pd.Series(values), errors="coerce")
+        if col != "days_to_expiry":
+            values = values.fillna(default)
+        out[col] = values.to_numpy(dtype=float)
+    return pd.DataFrame(out)
+
+
+def planning_date():
+    return datetime.now().date() + timedelta(days=1)
+
+
+def plan_inputs(mode, cleaning="fcfs", turnout=False):
+    """Source files a plan in this mode reads."""
+    files = ["jobcards.csv", "fitness.csv", "cleaning.csv", "mileage.csv"]
+    # Every plan weighs branding in its promotions
+    if store.exists("branding.csv"):
+        files.append("branding.csv")
+    # Depots come from stabling.csv when sharding or scheduling cleaning bays, and the turnout shunts its tracks
+    if (turnout or mode == "sharded" or cleaning == "priority") and store.exists("stabling.csv"):
+        files.append("stabling.csv")
+    if cleaning == "priority" and store.exists(CLEANING_BAYS):
+        files.append(CLEANING_BAYS)
+    return files
+
+
+def plan_fingerprint(params):
+    """Identifies a plan result: the inputs it reads, the planning date and the parameters."""
+    files = plan_inputs(params.get("mode"), params.get("cleaning"), params.get("turnout", False))
+    h = hashlib.sha1(store.version(files).encode())
+    h.update(str(planning_date()).encode())
+    # Committed plans add branding exposure, which moves the promotion preferences
+    h.update(str(exposure.revision()).encode())
+    h.update(repr(sorted(params.items())).encode())
+    return h.hexdigest()
+
+
+def load_fleet(tomorrow=None):
+    # One merge, then the rules run as column operations over the whole fleet
+    frames = [store.frame(f) for f in ("jobcards.csv", "fitness.csv", "cleaning.csv", "mileage.csv")]
+    with stage("expiry_index"):
+        expiry = expiry_index.get()
+    tomorrow = tomorrow or planning_date()
+    with stage("merge"):
+        fleet = build_fleet(*frames, tomorrow, expiry=expiry)
+    return with_branding(fleet, tomorrow)
+
+
+def with_branding(fleet, tomorrow):
+    """The fleet with the branding exposure each train's campaign still needs (see BRAND_COLS)."""
+    if not store.exists("branding.csv"):
+        return fleet
+    with stage("branding"):
+        deficit, days = exposure_deficits(fleet["train_id"], store.frame("branding.csv"), tomorrow)
+    return fleet.assign(brand_deficit=deficit, brand_days_left=days)
+
+
+def plan_records(fleet, status, reason, risk):
+    return PlanFrame.build(fleet, status, reason, risk).records()
+
+
+def plan_fleet(fleet, required_service, max_cleaning_slots=2, max_mileage=8000, risk=None):
+    status, reason = apply_rules(fleet, required_service, max_cleaning_slots, max_mileage)
+
+    # AI/ML inference; callers planning several scenarios can pass in scores for this max_mileage
+    if risk is None:
+        risk = _ml_predict(feature_frame(fleet), max_mileage)
+    return PlanFrame.build(fleet, status, reason, risk)
+
+
+def run_optimizer(required_service:int, max_cleaning_slots:int=2, max_mileage:int=8000,
+                  mode:str="rules", time_limit:float=DEFAULT_TIME_LIMIT, cleaning:str="fcfs",
+                  plan_format:str="records", turnout:bool=False):
+    """Plan tomorrow; the plan comes as render() gives it for plan_format.
+
+    With turnout, the result also has the next morning's turnout sequence from stabling.csv.
+    """
     try:
-        jobcards = pd.read_csv("data_samples/jobcards.csv")
-        fitness = pd.read_csv("data_samples/fitness.csv")
-        cleaning = pd.read_csv("data_samples/cleaning.csv")
-        mileage = pd.read_csv("data_samples/mileage.csv")
-
-        try: pd.read_csv("data_samples/branding.csv")
-        except: pass
-        try: pd.read_csv("data_samples/stabling.csv")
-        except: pass
-
-        for col in ["rolling_expiry","signalling_expiry","telecom_expiry"]:
-            fitness[col] = pd.to_datetime(fitness[col], errors="coerce")
-
-        tomorrow = datetime.now().date() + timedelta(days=1)
-        plan = []
-        feature_rows = []
-        trains = jobcards["train_id"].unique()
-        cleaning_count = 0
-
-        for t in trains:
-            status = "Standby"
-            reason = ""
-            jc_rows = jobcards[jobcards["train_id"]==t]
-            fit_rows = fitness[fitness["train_id"]==t]
-            clean_rows = cleaning[cleaning["train_id"]==t]
-            mil_rows = mileage[mileage["train_id"]==t]
-
-            km_val = None
-            dte_val = None
-            needs_clean_flag = 0
-            jc_open_flag = 0
-
-            if jc_rows.empty or fit_rows.empty or clean_rows.empty or mil_rows.empty:
-                status="IBL"
-                reason="Missing data"
-            else:
-                jc = jc_rows.iloc[0]
-                fit = fit_rows.iloc[0]
-                clean = clean_rows.iloc[0]
-                mil = mil_rows.iloc[0]
-
-                km_val = int(mil.get("km_since_last_service",0)) if pd.notna(mil.get("km_since_last_service")) else None
-                dte_val = _days_to_earliest_expiry(fit, tomorrow)
-                needs_clean_flag = 1 if str(clean.get("needs_cleaning","")).lower()=="yes" else 0
-                jc_open_flag = 1 if str(jc.get("status","")).lower()=="open" else 0
-
-                if jc_open_flag==1:
-                    status="IBL"
-                    reason="Open jobcard"
-                elif any([pd.notna(fit.get(col)) and fit[col].date()<tomorrow for col in ["rolling_expiry","signalling_expiry","telecom_expiry"]]):
-                    status="IBL"
-                    reason="Expired fitness certificate"
-                elif km_val and km_val > max_mileage:
-                    status="Standby"
-                    reason=f"High mileage ({km_val} km)"
-                elif needs_clean_flag==1:
-                    if cleaning_count<max_cleaning_slots:
-                        cleaning_count+=1
-                        status="IBL"
-                        reason="Cleaning slot assigned"
-                    else:
-                        status="Standby"
-                        reason="Needs cleaning but no slot left"
-                else:
-                    reason="Healthy"
-
-            plan.append({
-                "train_id": t,
-                "status": status,
-                "reason": reason,
-                "km_since_last_service": km_val,
-                "Rakes Assigned": 1  # Default for demo; can be replaced with real allocation logic
-            })
-
-            feature_rows.append({
-                "train_id": t,
-                "km": km_val if km_val is not None else 0,
-                "days_to_expiry": dte_val if dte_val is not None else 30,
-                "needs_cleaning": needs_clean_flag,
-                "jobcard_open": jc_open_flag
-            })
-
-        # Balanced mileage
-        high_mileage_trains = [e for e in plan if e["km_since_last_service"] and e["km_since_last_service"]>max_mileage]
-        num_to_promote = len(high_mileage_trains)//2
-        for e in high_mileage_trains[:num_to_promote]:
-            if e["status"]!="Service":
-                e["status"]="Service"
-                e["reason"]="Promoted for balanced mileage distribution"
-        for e in high_mileage_trains[num_to_promote:]:
-            if e["status"]!="Service":
-                e["status"]="IBL"
-                e["reason"]=f"Exceeded mileage threshold ({max_mileage} km)"
-
-        # Promotion to meet required_service
-        service_count = sum(1 for e in plan if e["status"]=="Service")
-        for e in plan:
-            if e["status"]=="Standby" and service_count<required_service:
-                e["status"]="Service"
-                e["reason"]="Promoted to meet service quota"
-                service_count+=1
-
-        # AI/ML inference
-        features_df = pd.DataFrame(feature_rows)
-        risk_scores, labels = _ml_predict(features_df, max_mileage)
-        label_map = {row["train_id"]:(risk_scores[i],labels[i]) for i,row in enumerate(feature_rows)}
-        for e in plan:
-            score,label = label_map.get(e["train_id"],(None,None))
-            e["AI_risk_score"]=round(float(score),3) if score is not None else None
-            e["AI_recommendation"]=label if label else "N/A"
-
-        return {"required_service": required_service, "plan": plan}
+        tomorrow = planning_date()
+        if plan_format not in ("records", "columnar", "frame"):
+            raise ValueError(f"Unknown plan format: {plan_format}")
+        if cleaning not in ("fcfs", "priority"):
+            raise ValueError(f"Unknown cleaning allocation: {cleaning}")
+        if cleaning == "priority" and mode != "rules":
+            raise ValueError("cleaning=priority is only available with mode=rules")
+        if mode == "sharded":
+            # Imported here: the shard module builds on this one
+            from backend.optimizer.shard import plan_sharded
+            plan, depots = plan_sharded(required_service, max_cleaning_slots, max_mileage, tomorrow)
+            result = {"required_service": required_service, "plan": plan, "depots": depots}
+        else:
+            result = _plan_mode(tomorrow, required_service, max_cleaning_slots, max_mileage, mode, time_limit, cleaning)
+
+        if turnout and store.exists("stabling.csv"):
+            # Imported here: the stabling module builds on the shard module
+            from backend.optimizer.stabling import plan_turnout
+            with stage("turnout"):
+                result["turnout"] = plan_turnout(result["plan"].service_ids(), store.frame("stabling.csv"))
+        result["plan"] = render(result["plan"], plan_format)
+        OPTIMIZER_RUNS.inc(mode=mode, outcome="ok")
+        return result
 
     except Exception as ex:
+        OPTIMIZER_RUNS.inc(mode=mode, outcome="error")
+        OPTIMIZER_ERRORS.inc(error=type(ex).__name__)
         return {"error": str(ex)}
+
+
+def _plan_mode(tomorrow, required_service, max_cleaning_slots, max_mileage, mode, time_limit, cleaning):
+    # The MILP time limit covers loading and scoring the fleet too
+    started = time.perf_counter()
+    fleet = load_fleet(tomorrow)
+    if mode == "milp":
+        # Exact solve; risk is scored first so the model can keep risky rakes out of service
+        risk = _ml_predict(feature_frame(fleet), max_mileage)
+        branding = store.frame("branding.csv") if store.exists("branding.csv") else None
+        with stage("milp"):
+            status, reason, solver = solve_milp(
+                fleet, branding, tomorrow, required_service,
+                max_cleaning_slots, max_mileage, risk_scores=risk[0], time_limit=time_limit, started=started,
+            )
+        return {"required_service": required_service, "plan": PlanFrame.build(fleet, status, reason, risk), "solver": solver}
+
+    if mode != "rules":
+        raise ValueError(f"Unknown planning mode: {mode}")
+    if cleaning == "priority":
+        # Slots from the bay scheduler instead of the fleet-order counter; it ranks by risk, so score first
+        from backend.optimizer.cleaning import plan_cleaning
+        risk = _ml_predict(feature_frame(fleet), max_mileage)
+        branding, stabling, bays = (
+            store.frame(f) if store.exists(f) else None for f in ("branding.csv", "stabling.csv", CLEANING_BAYS))
+        with stage("cleaning"):
+            clean_slot, schedule = plan_cleaning(
+                fleet, cleaning_candidates(fleet, max_mileage), risk[0], store.frame("cleaning.csv"),
+                branding, stabling, bays, tomorrow, max_cleaning_slots, max_mileage,
+            )
+        status, reason = apply_rules(fleet, required_service, max_cleaning_slots, max_mileage, clean_slot)
+        return {"required_service": required_service, "plan": PlanFrame.build(fleet, status, reason, risk),
+                "cleaning_schedule": schedule}
+    plan = plan_fleet(fleet, required_service, max_cleaning_slots, max_mileage)
+    return {"required_service": required_service, "plan": plan}
+
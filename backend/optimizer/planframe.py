@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # format=arrow needs pyarrow; the JSON formats do not
+    pa = None
+
+# Plan columns sent as codes into a list of their distinct values
+CODED = ("status", "reason", "AI_recommendation")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.file"
+
+
+class PlanFrame:
+    """A plan as one array per column, in plan order.
+
+    Planners build this instead of a dict per train; it is turned into
+    records, dictionary-encoded columns or an Arrow table only when the
+    plan leaves the process.
+    """
+
+    __slots__ = ("train_id", "status", "reason", "km", "risk_score", "recommendation")
+
+    def __init__(self, train_id, status, reason, km, risk_score, recommendation):
+        self.train_id = train_id
+        self.status = status
+        self.reason = reason
+        self.km = km
+        self.risk_score = risk_score
+        self.recommendation = recommendation
+
+    @classmethod
+    def build(cls, fleet, status, reason, risk):
+        risk_scores, labels = risk
+        labels = np.array(labels, dtype=object)
+        labels[~labels.astype(bool)] = "N/A"
+        return cls(
+            fleet["train_id"].to_numpy(dtype=object),
+            np.asarray(status, dtype=object),
+            np.asarray(reason, dtype=object),
+            fleet["km"].to_numpy(dtype=float),
+            np.array([round(float(s), 3) for s in risk_scores], dtype=float),
+            labels,
+        )
+
+    @classmethod
+    def concat(cls, frames):
+        """One PlanFrame with the rows of every frame, in order."""
+        return cls(*(np.concatenate([getattr(f, name) for f in frames]) for name in cls.__slots__))
+
+    def __len__(self):
+        return len(self.train_id)
+
+    def service_ids(self):
+        return self.train_id[self.status == "Service"].tolist()
+
+    def km_values(self):
+        # Whole kilometres, None where the train has no mileage
+        missing = np.isnan(self.km)
+        km = np.where(missing, 0, self.km).astype(np.int64).astype(object)
+        km[missing] = None
+        return km
+
+    def records(self):
+        """One dict per train: the plan rows /plan/run has always returned."""
+        return [
+            {
+                "train_id": t,
+                "status": st,
+                "reason": rs,
+                "km_since_last_service": k,
+                "Rakes Assigned": 1,  # Default for demo; can be replaced with real allocation logic
+                "AI_risk_score": score,
+                "AI_recommendation": label,
+            }
+            for t, st, rs, k, score, label in zip(
+                self.train_id.tolist(), self.status.tolist(), self.reason.tolist(), self.km_values().tolist(),
+                self.risk_score.tolist(), self.recommendation.tolist(),
+            )
+        ]
+
+    def _coded(self):
+        return dict(zip(CODED, (self.status, self.reason, self.recommendation)))
+
+    def columnar(self):
+        """{"rows": n, column: values}; CODED columns are {"values": distinct, "codes": index per row}."""
+        out = {"rows": len(self), "train_id": self.train_id.tolist()}
+        for name, values in self._coded().items():
+            codes, uniques = pd.factorize(values)
+            out[name] = {"values": uniques.tolist(), "codes": codes.tolist()}
+        out["km_since_last_service"] = self.km_values().tolist()
+        out["AI_risk_score"] = self.risk_score.tolist()
+        return out
+
+    def arrow(self, metadata=None, leading=None):
+        """Arrow IPC file (Feather v2) bytes of the plan; CODED columns are dictionary arrays.
+
+        metadata (bytes) is kept in the schema under b"kmrl"; leading ({name: array})
+        adds columns ahead of the plan's.
+        """
+        if pa is None:
+            raise RuntimeError("pyarrow is not installed")
+        columns = {name: pa.array(values) for name, values in (leading or {}).items()}
+        columns["train_id"] = pa.array(self.train_id.tolist(), pa.string())
+        for name, values in self._coded().items():
+            codes, uniques = pd.factorize(values)
+            columns[name] = pa.DictionaryArray.from_arrays(
+                pa.array(codes.astype(np.int32)), pa.array(uniques.tolist(), pa.string()))
+        missing = np.isnan(self.km)
+        columns["km_since_last_service"] = pa.array(
+            np.where(missing, 0, self.km).astype(np.int64), pa.int64(), mask=missing)
+        columns["AI_risk_score"] = pa.array(self.risk_score, pa.float64())
+        table = pa.table(columns)
+        if metadata is not None:
+            table = table.replace_schema_metadata({b"kmrl": metadata})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+def render(plan, plan_format):
+    """The plan as a caller asked for it: "records", "columnar" or the PlanFrame itself ("frame")."""
+    if plan_format == "records":
+        return plan.records()
+    if plan_format == "columnar":
+        return plan.columnar()
+    if plan_format == "frame":
+        return plan
+    raise ValueError(f"Unknown plan format: {plan_format}")
@@ -0,0 +1,146 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from backend.metrics import CACHE_REQUESTS, stage
+from backend.optimizer.rules import FEATURE_COLS
+
+try:
+    import joblib
+    from sklearn.ensemble import RandomForestClassifier
+except ImportError:  # heuristic scoring still works without sklearn
+    joblib = None
+    RandomForestClassifier = None
+
+# Bump when the synthetic training set or the forest settings change so stale files are ignored
+MODEL_VERSION = "rf-v1"
+DEFAULT_MAX_MILEAGE = 8000
+
+MODEL_DIR = os.environ.get("KMRL_MODEL_DIR", "model_cache")
+MAX_MODELS = int(os.environ.get("KMRL_MAX_MODELS", "16"))
+
+
+def synthetic_training_set(max_mileage):
+    X_syn = []
+    y_syn = []
+
+    # Low-risk
+    for km in [1000, 3000, 5000, 7000]:
+        for d in [15, 30, 60]:
+            X_syn.append([km, d, 0, 0]); y_syn.append(0)
+            X_syn.append([km, d, 1, 0]); y_syn.append(0)
+    # Medium-risk
+    for km in [max_mileage-500, max_mileage, max_mileage+200]:
+        for d in [3, 7, 14]:
+            X_syn.append([km, d, 0, 0]); y_syn.append(1)
+            X_syn.append([km, d, 1, 0]); y_syn.append(1)
+    # High-risk
+    for km in [max_mileage+500, max_mileage+1500, max_mileage+3000]:
+        for d in [-5, 0, 2]:
+            X_syn.append([km, d, 1, 1]); y_syn.append(1)
+            X_syn.append([km, d, 0, 1]); y_syn.append(1)
+
+    return pd.DataFrame(X_syn, columns=FEATURE_COLS), pd.Series(y_syn)
+
+
+def fit_model(max_mileage):
+    X_syn, y_syn = synthetic_training_set(max_mileage)
+    rf = RandomForestClassifier(n_estimators=60, max_depth=6, random_state=42)
+    rf.fit(X_syn, y_syn)
+    return rf
+
+
+class ModelRegistry:
+    """LRU cache of fitted risk models keyed by (max_mileage, version), backed by joblib files."""
+
+    def __init__(self, model_dir=MODEL_DIR, max_models=MAX_MODELS, version=MODEL_VERSION):
+        self.model_dir = model_dir
+        self.max_models = max_models
+        self.version = version
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per key so concurrent requests for the same model fit it once
+        self._key_locks = {}
+
+    def _path(self, key):
+        max_mileage, version = key
+        return os.path.join(self.model_dir, f"risk_{version}_{max_mileage}.joblib")
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return joblib.load(path)
+        except Exception:
+            # Corrupt or written by an incompatible sklearn; refit instead
+            return None
+
+    def _save(self, key, model):
+        try:
+            os.makedirs(self.model_dir, exist_ok=True)
+            path = self._path(key)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            joblib.dump(model, tmp)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _remember(self, key, model):
+        with self._lock:
+            self._models[key] = model
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+
+    def get(self, max_mileage):
+        if RandomForestClassifier is None:
+            raise RuntimeError("scikit-learn is not installed")
+        key = (int(max_mileage), self.version)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                CACHE_REQUESTS.inc(cache="model", result="hit")
+                return model
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                model = self._models.get(key)
+            if model is None:
+                model = self._load(key)
+                if model is None:
+                    CACHE_REQUESTS.inc(cache="model", result="miss")
+                    with stage("model_fit"):
+                        model = fit_model(key[0])
+                    self._save(key, model)
+                else:
+                    CACHE_REQUESTS.inc(cache="model", result="disk")
+                self._remember(key, model)
+            else:
+                CACHE_REQUESTS.inc(cache="model", result="hit")
+            with self._lock:
+                self._key_locks.pop(key, None)
+        return model
+
+    def reserve(self, count):
+        """Hold at least count models from now on (about 50 KB each), so one request using
+        that many, like a mileage sweep, does not evict its own models and reload them next time."""
+        with self._lock:
+            self.max_models = max(self.max_models, int(count))
+
+    def warm(self, max_mileage=DEFAULT_MAX_MILEAGE):
+        try:
+            self.get(max_mileage)
+        except Exception:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+
+registry = ModelRegistry()
@@ -0,0 +1,215 @@
+import numpy as np
+import pandas as pd
+
+from backend.metrics import stage
+
+CERT_COLS = ["rolling_expiry", "signalling_expiry", "telecom_expiry"]
+
+FEATURE_COLS = ["km", "days_to_expiry", "needs_cleaning", "jobcard_open"]
+
+# Branding exposure a train's campaign still needs from it, and the nights left to get it
+BRAND_COLS = ["brand_deficit", "brand_days_left"]
+
+
+def _first_per_train(df, cols):
+    # Same row the per-train lookup used to pick: the first one for each train_id
+    df = df.dropna(subset=["train_id"]).drop_duplicates("train_id", keep="first")
+    out = df[["train_id"] + [c for c in cols if c in df.columns]].copy()
+    for c in cols:
+        if c not in out.columns:
+            out[c] = np.nan
+    return out
+
+
+SOURCE_KEYS = ["jobcards", "fitness", "cleaning", "mileage"]
+
+
+def merge_sources(jobcards, fitness, cleaning, mileage, tomorrow, expiry=None):
+    """Merge the four sources once on train_id into one raw row per train.
+
+    Keeps which sources each train appears in and the per-source values, so
+    single rows can be patched later and re-derived with finish_fleet. With
+    an ExpiryIndex of the same fitness data, certificate days are looked up
+    in it instead of being recomputed from the timestamps.
+    """
+    raw = pd.DataFrame({"train_id": jobcards["train_id"].unique()})
+
+    parts = [
+        _first_per_train(jobcards, ["status"]).rename(columns={"status": "jc_status"}),
+        None,
+        _first_per_train(cleaning, ["needs_cleaning"]).rename(columns={"needs_cleaning": "clean_flag"}),
+        _first_per_train(mileage, ["km_since_last_service"]),
+    ]
+    if expiry is None:
+        # Parse on the full source column so format inference sees the same values as before
+        # (frames from the data store are already parsed, so skip those)
+        fitness = fitness.copy()
+        for col in CERT_COLS:
+            if not pd.api.types.is_datetime64_any_dtype(fitness[col]):
+                fitness[col] = pd.to_datetime(fitness[col], errors="coerce")
+        parts[1] = _first_per_train(fitness, CERT_COLS)
+
+    for key, part in zip(SOURCE_KEYS, parts):
+        if part is None:
+            continue
+        part = part.assign(**{f"has_{key}": True})
+        raw = raw.merge(part, on="train_id", how="left")
+        raw[f"has_{key}"] = raw[f"has_{key}"].notna().to_numpy()
+
+    # Day-level expiry relative to the planning date, one column per certificate
+    tomorrow = pd.Timestamp(tomorrow)
+    if expiry is None:
+        for c in CERT_COLS:
+            raw[f"{c}_days"] = (raw.pop(c).dt.normalize() - tomorrow).dt.days.to_numpy(dtype=float)
+    else:
+        days, found = expiry.days_until(raw["train_id"].to_numpy(dtype=object), tomorrow)
+        raw["has_fitness"] = found
+        for c in CERT_COLS:
+            raw[f"{c}_days"] = days[c]
+    raw["km_raw"] = pd.to_numeric(raw.pop("km_since_last_service"), errors="coerce").to_numpy(dtype=float)
+    raw["clean_yes"] = (raw.pop("clean_flag").astype(str).str.lower() == "yes").to_numpy()
+    raw["jc_open"] = (raw.pop("jc_status").astype(str).str.lower() == "open").to_numpy()
+    return raw
+
+
+def finish_fleet(raw):
+    has_data = np.ones(len(raw), dtype=bool)
+    for key in SOURCE_KEYS:
+        has_data &= raw[f"has_{key}"].to_numpy(dtype=bool)
+
+    # The earliest certificate decides both the IBL rule and the feature
+    days = raw[[f"{c}_days" for c in CERT_COLS]].to_numpy(dtype=float)
+    dte = np.where(np.isnan(days), np.inf, days).min(axis=1)
+    dte[np.isinf(dte)] = np.nan
+    dte = np.where(has_data, dte, np.nan)
+
+    return pd.DataFrame({
+        "train_id": raw["train_id"].to_numpy(),
+        "has_data": has_data,
+        "dte": dte,
+        "expired": has_data & (dte < 0),
+        "km": np.where(has_data, np.trunc(raw["km_raw"].to_numpy(dtype=float)), np.nan),
+        "needs_cleaning": (has_data & raw["clean_yes"].to_numpy(dtype=bool)).astype(int),
+        "jobcard_open": (has_data & raw["jc_open"].to_numpy(dtype=bool)).astype(int),
+        **{c: raw[c].to_numpy(dtype=float) for c in BRAND_COLS if c in raw.columns},
+    }, index=raw.index)
+
+
+def build_fleet(jobcards, fitness, cleaning, mileage, tomorrow, expiry=None):
+    """One row per train with everything the rules need.
+
+    Only depends on the data and the planning date, so callers can reuse it
+    across parameter changes.
+    """
+    return finish_fleet(merge_sources(jobcards, fitness, cleaning, mileage, tomorrow, expiry))
+
+
+def high_mileage(fleet, max_mileage):
+    km = fleet["km"].to_numpy()
+    with np.errstate(invalid="ignore"):
+        return ~np.isnan(km) & (km != 0) & (km > max_mileage)
+
+
+def cleaning_candidates(fleet, max_mileage):
+    """Trains that reach the cleaning rule: data present, no open jobcard, fit, not over mileage, needing a clean."""
+    has_data = fleet["has_data"].to_numpy()
+    return (has_data & ~(fleet["jobcard_open"].to_numpy() == 1) & ~fleet["expired"].to_numpy()
+            & ~high_mileage(fleet, max_mileage) & (fleet["needs_cleaning"].to_numpy() == 1))
+
+
+def evaluate_rules(fleet, max_cleaning_slots, max_mileage, clean_slot=None):
+    """Per-train IBL/Standby/cleaning-slot/high-mileage rules; returns status, reason and the high-mileage mask.
+
+    clean_slot, when given, marks the cleaning candidates a scheduler gave a slot;
+    otherwise slots go first-come-first-served in fleet order.
+    """
+    has_data = fleet["has_data"].to_numpy()
+    km = fleet["km"].to_numpy()
+    jc_open = fleet["jobcard_open"].to_numpy() == 1
+    expired = fleet["expired"].to_numpy()
+    high = high_mileage(fleet, max_mileage)
+
+    # Rule order matters: each train takes the first branch it matches
+    missing = ~has_data
+    rule_open = has_data & jc_open
+    rule_expired = has_data & ~jc_open & expired
+    rule_high = has_data & ~jc_open & ~expired & high
+    clean_candidate = cleaning_candidates(fleet, max_mileage)
+    if clean_slot is None:
+        clean_slot = clean_candidate & (np.cumsum(clean_candidate) <= max_cleaning_slots)
+    else:
+        clean_slot = clean_candidate & clean_slot
+    clean_no_slot = clean_candidate & ~clean_slot
+
+    status = np.select(
+        [missing, rule_open, rule_expired, clean_slot],
+        ["IBL", "IBL", "IBL", "IBL"],
+        default="Standby",
+    ).astype(object)
+    reason = np.select(
+        [missing, rule_open, rule_expired, clean_slot, clean_no_slot],
+        ["Missing data", "Open jobcard", "Expired fitness certificate",
+         "Cleaning slot assigned", "Needs cleaning but no slot left"],
+        default="Healthy",
+    ).astype(object)
+    reason[rule_high] = [f"High mileage ({int(k)} km)" for k in km[rule_high]]
+    return status, reason, high
+
+
+def balance_mileage(status, reason, high, max_mileage):
+    # Balanced mileage: first half of the high-mileage trains go to service, the rest to IBL
+    num_to_promote = int(high.sum()) // 2
+    promote = high & (np.cumsum(high) <= num_to_promote)
+    demote = high & ~promote
+    status[promote] = "Service"
+    reason[promote] = "Promoted for balanced mileage distribution"
+    status[demote] = "IBL"
+    reason[demote] = f"Exceeded mileage threshold ({max_mileage} km)"
+    return int(promote.sum())
+
+
+def promotion_weight(fleet):
+    """Branding preference of each train for quota promotion: the exposure hours its campaign still
+    needs from it per night left. None when the fleet carries no branding, 0 for unbranded trains."""
+    if not all(c in fleet.columns for c in BRAND_COLS):
+        return None
+    deficit = fleet["brand_deficit"].to_numpy(dtype=float)
+    days = fleet["brand_days_left"].to_numpy(dtype=float)
+    return np.divide(deficit, days, out=np.zeros(len(fleet)), where=days > 0)
+
+
+def promotion_order(weight, n):
+    """Row order quota promotions follow: highest weight first, then fleet order."""
+    if weight is None or not np.any(weight > 0):
+        return np.arange(n)
+    return np.argsort(-weight, kind="stable")
+
+
+def promote_quota(status, reason, required_service, service_count, weight=None):
+    # Promotion to meet required_service; standby rakes whose branding is furthest behind go first
+    order = promotion_order(weight, len(status))
+    standby = status[order] == "Standby"
+    quota = np.zeros(len(status), dtype=bool)
+    quota[order] = standby & (np.cumsum(standby) <= required_service - service_count)
+    status[quota] = "Service"
+    reason[quota] = "Promoted to meet service quota"
+
+
+def apply_rules(fleet, required_service, max_cleaning_slots, max_mileage, clean_slot=None):
+    """Evaluate the IBL/Standby/cleaning/high-mileage rules and the quota promotion as column operations."""
+    with stage("rules"):
+        status, reason, high = evaluate_rules(fleet, max_cleaning_slots, max_mileage, clean_slot)
+    with stage("promotion"):
+        service_count = balance_mileage(status, reason, high, max_mileage)
+        promote_quota(status, reason, required_service, service_count, promotion_weight(fleet))
+    return status, reason
+
+
+def feature_frame(fleet):
+    return pd.DataFrame({
+        "train_id": fleet["train_id"].to_numpy(),
+        "km": fleet["km"].fillna(0).to_numpy(),
+        "days_to_expiry": fleet["dte"].fillna(30).to_numpy(),
+        "needs_cleaning": fleet["needs_cleaning"].to_numpy(),
+        "jobcard_open": fleet["jobcard_open"].to_numpy(),
+    })
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+from backend.datastore import store
+from backend.optimizer.batch import MAX_WORKERS, _get_pool
+from backend.optimizer.branding import exposure_deficits
+from backend.optimizer.model import _ml_predict, planning_date
+from backend.optimizer.planframe import PlanFrame
+from backend.optimizer.registry import registry
+from backend.optimizer.rules import (
+    SOURCE_KEYS, balance_mileage, build_fleet, evaluate_rules, feature_frame, promotion_order, promotion_weight,
+)
+
+# Trains with no depot in stabling.csv (or no depot column at all) are planned together
+DEFAULT_DEPOT = "default"
+
+
+def depot_of(stabling):
+    """train_id -> depot from stabling.csv; empty when the file has no depot column."""
+    if "depot" not in stabling.columns:
+        return pd.Series(dtype=object)
+    s = stabling.dropna(subset=["train_id"]).drop_duplicates("train_id", keep="first")
+    depots = s["depot"].astype(object).where(s["depot"].notna(), DEFAULT_DEPOT).astype(str).str.strip()
+    return pd.Series(depots.replace("", DEFAULT_DEPOT).to_numpy(), index=s["train_id"].to_numpy())
+
+
+def partition(frames, depots):
+    """Split every source frame by the depot of its train_id; returns {depot: {filename: frame}}."""
+    keys = {
+        name: df["train_id"].map(depots).fillna(DEFAULT_DEPOT).to_numpy() if len(depots) else
+        np.full(len(df), DEFAULT_DEPOT, dtype=object)
+        for name, df in frames.items()
+    }
+    names = sorted(set().union(*(set(k) for k in keys.values())))
+    return {
+        depot: {name: df[keys[name] == depot] if len(names) > 1 else df for name, df in frames.items()}
+        for depot in names
+    }
+
+
+def _plan_shard(frames, tomorrow, max_mileage):
+    # Everything that only needs this depot's trains: merge, per-train rules, mileage balancing, risk
+    fleet = build_fleet(*(frames[f"{k}.csv"] for k in SOURCE_KEYS), tomorrow)
+    # Every cleaning candidate gets a slot here; the network-wide capacity is applied when merging
+    status, reason, high = evaluate_rules(fleet, len(fleet), max_mileage)
+    balance_mileage(status, reason, high, max_mileage)
+    scores, labels = _ml_predict(feature_frame(fleet), max_mileage)
+    return fleet, status, reason, scores, labels
+
+
+def allot(capacity, demand):
+    """Split capacity over depots in proportion to demand (largest remainder, ties to the first depot)."""
+    demand = np.asarray(demand, dtype=int)
+    capacity = max(int(capacity), 0)
+    if capacity >= demand.sum():
+        return demand
+    share = capacity * demand / demand.sum()
+    out = np.floor(share).astype(int)
+    left = capacity - out.sum()
+    out[np.argsort(-(share - out), kind="stable")[:left]] += 1
+    return out
+
+
+def _rank_within(codes, mask, order=None):
+    # 0-based position of each masked row among the masked rows of its depot, in `order` (fleet order by default)
+    rank = np.zeros(len(codes), dtype=int)
+    idx = np.flatnonzero(mask) if order is None else order[mask[order]]
+    rank[idx] = pd.Series(codes[idx]).groupby(codes[idx]).cumcount().to_numpy()
+    return rank
+
+
+def reconcile(codes, status, reason, required_service, max_cleaning_slots, n_depots, weight=None):
+    """Apply the network-wide cleaning capacity and service quota to the merged shard plans, in place.
+
+    Cleaning slots and quota promotions are split over depots by demand, then
+    handed out first-come-first-served within each depot, quota promotions
+    in promotion_order of the branding weight. With one depot this is
+    exactly the single-process rule plan.
+    """
+    clean = reason == "Cleaning slot assigned"
+    slots = allot(max_cleaning_slots, np.bincount(codes[clean], minlength=n_depots))
+    no_slot = clean & (_rank_within(codes, clean) >= slots[codes])
+    status[no_slot] = "Standby"
+    reason[no_slot] = "Needs cleaning but no slot left"
+
+    standby = status == "Standby"
+    needed = required_service - int((status == "Service").sum())
+    quota = allot(needed, np.bincount(codes[standby], minlength=n_depots))
+    order = promotion_order(weight, len(status))
+    promote = standby & (_rank_within(codes, standby, order) < quota[codes])
+    status[promote] = "Service"
+    reason[promote] = "Promoted to meet service quota"
+    return slots, quota
+
+
+def plan_sharded(required_service, max_cleaning_slots=2, max_mileage=8000, tomorrow=None, frames=None, stabling=None):
+    """Plan each depot on its own worker, then merge and reconcile the network-wide constraints.
+
+    Returns (plan, depots): a PlanFrame in the single-process fleet order and a per-depot summary.
+    """
+    tomorrow = tomorrow or planning_date()
+    if frames is None:
+        frames = {f"{k}.csv": store.frame(f"{k}.csv") for k in SOURCE_KEYS}
+    if stabling is None:
+        # Without stabling.csv the whole fleet is one DEFAULT_DEPOT
+        stabling = store.frame("stabling.csv") if store.exists("stabling.csv") else pd.DataFrame()
+    shards = partition(frames, depot_of(stabling))
+    names = list(shards)
+
+    # Fit/persist the model here so workers load it from disk instead of refitting
+    registry.warm(max_mileage)
+    if len(shards) == 1 or MAX_WORKERS <= 1:
+        results = [_plan_shard(shards[d], tomorrow, max_mileage) for d in names]
+    else:
+        pool = _get_pool()
+        futures = [pool.submit(_plan_shard, shards[d], tomorrow, max_mileage) for d in names]
+        results = [f.result() for f in futures]
+
+    fleet = pd.concat([r[0] for r in results], ignore_index=True)
+    codes = np.concatenate([np.full(len(r[0]), k) for k, r in enumerate(results)]).astype(int)
+    status = np.concatenate([r[1] for r in results])
+    reason = np.concatenate([r[2] for r in results])
+    scores = np.concatenate([np.asarray(r[3], dtype=float) for r in results])
+    labels = np.concatenate([np.asarray(r[4], dtype=object) for r in results])
+    if len(results) > 1:
+        # Deterministic merge: back into the order a single merge would list the trains
+        position = pd.Index(frames["jobcards.csv"]["train_id"].unique()).get_indexer(fleet["train_id"])
+        order = np.argsort(position, kind="stable")
+        fleet = fleet.iloc[order].reset_index(drop=True)
+        codes, status, reason, scores, labels = codes[order], status[order], reason[order], scores[order], labels[order]
+
+    weight = None
+    if store.exists("branding.csv"):
+        deficit, days = exposure_deficits(fleet["train_id"], store.frame("branding.csv"), tomorrow)
+        weight = promotion_weight(fleet.assign(brand_deficit=deficit, brand_days_left=days))
+    slots, quota = reconcile(codes, status, reason, required_service, max_cleaning_slots, len(names), weight)
+    depots = [
+        {
+            "depot": d,
+            "trains": int((codes == k).sum()),
+            "service": int(((codes == k) & (status == "Service")).sum()),
+            "cleaning_slots": int(slots[k]),
+            "quota_promotions": int(quota[k]),
+        }
+        for k, d in enumerate(names)
+    ]
+    return PlanFrame.build(fleet, status, reason, (scores, labels)), depots
@@ -0,0 +1,329 @@
+import heapq
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from backend.optimizer.shard import DEFAULT_DEPOT
+
+# Longest the turnout search may spend improving on the greedy sequence, over all depots
+SHUNT_TIME_LIMIT = float(os.environ.get("KMRL_SHUNT_TIME_LIMIT", "0.25"))
+# Rakes one stabling bay holds; 0 means as many as the fullest bay of the depot holds tonight
+BAY_CAPACITY = int(os.environ.get("KMRL_BAY_CAPACITY", "0"))
+
+
+def yard_tracks(stabling):
+    """{depot: {bay: [train_id, ...]}} with each bay listed from the back of the track to the exit.
+
+    A bay is a dead-end track, so only the rake nearest the exit (the last in
+    the list) can leave or be moved. Rows give that order with a position
+    column (1 = nearest the exit), or else front to back in file order.
+    """
+    if "stabling_bay" not in stabling.columns:
+        return {}
+    if "position" in stabling.columns:
+        order = pd.to_numeric(stabling["position"], errors="coerce").to_numpy(dtype=float)
+        stabling = stabling.iloc[np.argsort(order, kind="stable")]
+    n = len(stabling)
+    depots = stabling["depot"].tolist() if "depot" in stabling.columns else [None] * n
+    yard, seen = {}, set()
+    # Plain lists: a Python pass beats pandas string ops on a column per yard
+    for t, b, d in zip(stabling["train_id"].tolist(), stabling["stabling_bay"].tolist(), depots):
+        if not isinstance(t, str) or t in seen:
+            continue
+        seen.add(t)
+        b = b.strip() if isinstance(b, str) else ""
+        if not b:
+            continue
+        d = d.strip() if isinstance(d, str) else ""
+        yard.setdefault(d or DEFAULT_DEPOT, {}).setdefault(b, []).append(t)
+    return {d: {b: rakes[::-1] for b, rakes in bays.items()} for d, bays in yard.items()}
+
+
+class _Yard:
+    """One depot's tracks while the turnout is played out; `above` counts the rakes in front of each
+    bay's nearest leaving rake, `dirty` the rakes parked in front of one that still has to leave."""
+
+    __slots__ = ("stacks", "left", "above", "steps", "moves", "dirty")
+
+    def __init__(self, stacks, leaving):
+        self.stacks = stacks
+        self.left = [sum(t in leaving for t in s) for s in stacks]
+        self.above = [self._above(b, leaving) for b in range(len(stacks))]
+        self.steps = []
+        self.moves = 0
+        self.dirty = 0
+
+    def copy(self):
+        other = _Yard.__new__(_Yard)
+        other.stacks = [list(s) for s in self.stacks]
+        other.left, other.above, other.steps = list(self.left), list(self.above), list(self.steps)
+        other.moves, other.dirty = self.moves, self.dirty
+        return other
+
+    def _above(self, b, leaving):
+        stack = self.stacks[b]
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i] in leaving:
+                return len(stack) - 1 - i
+        return 0
+
+    def drain(self, leaving, bays=None):
+        # Every leaving rake with a clear way out leaves
+        for b in range(len(self.stacks)) if bays is None else bays:
+            stack = self.stacks[b]
+            while self.left[b] and not self.above[b]:
+                self.steps.append(("depart", stack.pop(), b, None))
+                self.left[b] -= 1
+                self.above[b] = self._above(b, leaving) if self.left[b] else 0
+
+    def shunt(self, src, dst):
+        train = self.stacks[src].pop()
+        self.stacks[dst].append(train)
+        self.above[src] -= 1
+        if self.left[dst]:
+            self.above[dst] += 1
+            self.dirty += 1
+        self.moves += 1
+        self.steps.append(("shunt", train, src, dst))
+
+    def options(self, capacity):
+        """Candidate shunts, most promising first: the bay closest to releasing a rake gives up
+        its front rake to a bay with nothing left to leave, then to the bay furthest from
+        releasing one. Bays with nothing left to leave are interchangeable, so one is enough."""
+        sources = sorted((b for b, n in enumerate(self.left) if n), key=lambda b: (self.above[b], b))
+        room = [b for b, s in enumerate(self.stacks) if len(s) < capacity[b]]
+        clean = sorted((b for b in room if not self.left[b]), key=lambda b: (capacity[b] - len(self.stacks[b]), b))
+        dirty = sorted((b for b in room if self.left[b]), key=lambda b: (-self.above[b], b))
+        if clean:
+            for src in sources:
+                yield src, clean[0]
+        for src in sources:
+            for dst in dirty:
+                if dst != src:
+                    yield src, dst
+
+
+def _score(yard):
+    # Stuck rakes first: a sequence that gets every leaving rake out beats any that doesn't
+    return sum(yard.left), yard.moves
+
+
+def _greedy(stacks, leaving, capacity, deadline):
+    """The greedy sequence, as (start, yard, lower bound, complete).
+
+    start is the yard once the rakes with a clear way out have left, for
+    _improve to search from. complete is False when the deadline passed
+    before the greedy pass got through; the yard then holds the sequence
+    so far.
+    """
+    best = _Yard([list(s) for s in stacks], leaving)
+    # Every staying rake in front of a bay's deepest leaving rake has to move at least once,
+    # and moves that park a rake in front of another leaving rake each cost one more later
+    bound = sum(
+        sum(t not in leaving for t in s[next((i for i, t in enumerate(s) if t in leaving), len(s)):])
+        for s in stacks
+    )
+
+    # Greedy descent: the least buried bay whose blockers fit in the room left elsewhere gives
+    # them up, to the fullest bay with nothing left to leave, or else to the bay furthest from
+    # releasing a rake. That bay stays the least buried until its leaving rake is out, so this
+    # clears one bay after another and cannot go round in circles. Its shunt stays the same
+    # until the bay is released or the bay it shunts to is full, so it is repeated without
+    # asking again. Heaps keep each step O(log bays); entries a move made stale are skipped.
+    best.drain(leaving)
+    start = best.copy()
+    room = lambda b: capacity[b] - len(best.stacks[b])
+    free = sum(room(b) for b in range(len(stacks)))
+    sources, clean, dirty = [], [], []
+
+    def index(b):
+        if best.left[b]:
+            heapq.heappush(sources, (best.above[b], b))
+            if room(b) > 0:
+                heapq.heappush(dirty, (-best.above[b], b))
+        elif room(b) > 0:
+            heapq.heappush(clean, (room(b), b))
+
+    for b in range(len(stacks)):
+        index(b)
+    while True:
+        if time.perf_counter() > deadline:
+            return start, best, bound, False
+        src, skipped = None, []
+        while sources:
+            above, b = heapq.heappop(sources)
+            if not best.left[b] or best.above[b] != above:
+                continue
+            if free - room(b) >= above:
+                src = b
+                break
+            skipped.append((above, b))
+        for item in skipped:
+            heapq.heappush(sources, item)
+        if src is None:
+            break
+
+        dst = None
+        while clean and dst is None:
+            r, b = clean[0]
+            if best.left[b] or room(b) != r:
+                heapq.heappop(clean)
+            else:
+                dst = b
+        aside = []
+        while dirty and dst is None:
+            above, b = dirty[0]
+            if not best.left[b] or room(b) <= 0 or best.above[b] != -above:
+                heapq.heappop(dirty)
+            elif b == src:
+                aside.append(heapq.heappop(dirty))
+            else:
+                dst = b
+        for item in aside:
+            heapq.heappush(dirty, item)
+
+        for _ in range(min(best.above[src], room(dst))):
+            best.shunt(src, dst)
+        waiting = best.left[src]
+        best.drain(leaving, [src])
+        free += waiting - best.left[src]
+        index(src)
+        index(dst)
+    return start, best, bound, True
+
+
+def _improve(start, best, bound, leaving, capacity, deadline):
+    """Depth-first branch and bound from start for fewer moves than best, as (yard, optimal)."""
+    if _score(best) == (0, bound):
+        return best, True
+
+    seen = {}
+    frontier = [(start, start.options(capacity))]
+    exhausted = True
+    while frontier:
+        if time.perf_counter() > deadline:
+            exhausted = False
+            break
+        yard, options = frontier[-1]
+        step = next(options, None)
+        if step is None:
+            frontier.pop()
+            continue
+        child = yard.copy()
+        child.shunt(*step)
+        child.drain(leaving, [step[0]])
+        if (0, bound + child.dirty) >= _score(best):
+            continue
+        key = tuple(map(tuple, child.stacks))
+        if seen.get(key, float("inf")) <= child.moves:
+            continue
+        seen[key] = child.moves
+        if not any(child.left):
+            best = child
+            if _score(best) == (0, bound):
+                break
+            continue
+        options = child.options(capacity)
+        first = next(options, None)
+        if first is None:
+            # Stuck: no bay has room for the rake in the way
+            if _score(child) < _score(best):
+                best = child
+            continue
+        frontier.append((child, itertools.chain([first], options)))
+    optimal = _score(best) == (0, bound) or (exhausted and not any(best.left))
+    return best, optimal
+
+
+def _solve(stacks, leaving, capacity, deadline):
+    """Fewest shunting moves that let every leaving rake out, as (yard, lower bound, optimal, complete).
+
+    complete is False when the deadline passed before the greedy pass got
+    through; the yard then holds the sequence so far, and optimal is False.
+    """
+    start, best, bound, complete = _greedy(stacks, leaving, capacity, deadline)
+    if not complete:
+        return best, bound, False, False
+    best, optimal = _improve(start, best, bound, leaving, capacity, deadline)
+    return best, bound, optimal, True
+
+
+def plan_turnout(service_ids, stabling, time_limit=SHUNT_TIME_LIMIT, capacity=BAY_CAPACITY):
+    """Morning turnout order and shunting moves for the rakes inducted into service.
+
+    The service_ids rakes leave their bays; every other rake stays in the yard, and
+    any standing in front of a leaving one is shunted to another bay of the
+    same depot. A bay holds `capacity` rakes, or with 0 as many as the
+    fullest bay of its depot. Returns the sequence per depot, the bays the
+    shunted rakes end up in, the shunting moves against the lower bound,
+    and any leaving rake no sequence could get out for lack of room.
+
+    time_limit covers the whole call. When it runs out before a depot's
+    greedy pass is through, that depot's sequence stops where it got to,
+    complete is False and its leaving rakes still in the yard are pending.
+    """
+    leaving = set(service_ids)
+    deadline = time.perf_counter() + time_limit
+    # Greedy sequences for every depot first, so one depot's search cannot starve the others
+    depots = []
+    pending = []
+    for depot, tracks in yard_tracks(stabling).items():
+        bays = list(tracks)
+        stacks = [tracks[b] for b in bays]
+        if not any(t in leaving for s in stacks for t in s):
+            continue
+        if time.perf_counter() > deadline:
+            pending += [t for s in stacks for t in s if t in leaving]
+            continue
+        fullest = capacity or max(map(len, stacks))
+        cap = [max(len(s), fullest) for s in stacks]
+        depots.append((depot, bays, stacks, cap, *_greedy(stacks, leaving, cap, deadline)))
+
+    # Then the search, the time left shared between the depots still to search
+    searching = sum(1 for d in depots if d[-1])
+    sequence, reassignments, unreachable = [], [], []
+    moves = bound = departures = 0
+    optimal = complete = not pending
+    for depot, bays, stacks, cap, start, yard, depot_bound, depot_complete in depots:
+        depot_optimal = False
+        if depot_complete:
+            share = max(deadline - time.perf_counter(), 0) / searching
+            yard, depot_optimal = _improve(start, yard, depot_bound, leaving, cap, time.perf_counter() + share)
+            searching -= 1
+
+        home = {t: b for b, s in zip(bays, stacks) for t in s}
+        final = {}
+        for step, (action, train, src, dst) in enumerate(yard.steps, start=1):
+            item = {"step": step, "depot": depot, "action": action, "train_id": train, "from_bay": bays[src]}
+            if action == "shunt":
+                item["to_bay"] = bays[dst]
+                final[train] = bays[dst]
+            sequence.append(item)
+        reassignments += [
+            {"train_id": t, "depot": depot, "from_bay": home[t], "to_bay": b}
+            for t, b in final.items() if b != home[t]
+        ]
+        stuck = [t for s in yard.stacks for t in s if t in leaving]
+        if depot_complete:
+            unreachable += stuck
+        else:
+            pending += stuck
+        moves += yard.moves
+        bound += depot_bound
+        departures += sum(1 for s in yard.steps if s[0] == "depart")
+        optimal &= depot_optimal
+        complete &= depot_complete
+    return {
+        "departures": departures,
+        "shunting_moves": moves,
+        "lower_bound": bound,
+        "optimal": optimal,
+        "complete": complete,
+        "sequence": sequence,
+        "reassignments": reassignments,
+        "unreachable": unreachable,
+        "pending": pending,
+    }
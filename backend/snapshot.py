@@ -0,0 +1,195 @@
+# backend/snapshot.py
+#
+# Columnar binary snapshot of the depot CSVs, memory-mapped by every worker.
+#
+#   python -m backend.snapshot                      # data_samples/ -> data_samples/fleet.snapshot
+#   python -m backend.snapshot --data-dir /srv/kmrl --out /srv/kmrl/fleet.snapshot
+#
+# Layout: 8-byte magic, little-endian uint64 header length, JSON header, then
+# the column buffers, each aligned to 64 bytes. Numeric, bool and datetime
+# columns are stored as raw fixed-width arrays and come back as zero-copy views
+# of the mapping, so the pages are shared through the OS page cache by all
+# processes that map the file. Text columns are dictionary-encoded: int32 codes
+# (-1 for missing) plus a NUL-separated UTF-8 dictionary; train_id uses one
+# dictionary shared by all sources.
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"KMRLSNP1"
+ALIGN = 64
+SNAPSHOT_NAME = "fleet.snapshot"
+TRAIN_ID = "train_id"
+
+
+def _pad(n):
+    return -n % ALIGN
+
+
+def _encode_dictionary(values):
+    # values: unique non-missing strings, in code order
+    if any("\x00" in v for v in values):
+        raise ValueError("Text values must not contain NUL characters")
+    return np.frombuffer("\x00".join(values).encode(), dtype=np.uint8)
+
+
+def _text(series):
+    values = series.to_numpy(dtype=object)
+    missing = pd.isna(values)
+    values[~missing] = [str(v) for v in values[~missing]]
+    return values, missing
+
+
+class _Writer:
+    def __init__(self):
+        self.buffers = []
+        self.size = 0
+
+    def add(self, array):
+        array = np.ascontiguousarray(array)
+        spec = {"offset": self.size, "nbytes": int(array.nbytes)}
+        self.buffers.append(array)
+        self.size += array.nbytes + _pad(array.nbytes)
+        return spec
+
+
+def write_snapshot(path, sources):
+    """Write sources ({filename: (stat_result, sha1 digest, parsed frame)}) to path, atomically.
+
+    The stat and digest of each CSV are recorded so readers can tell whether
+    the snapshot still matches the file on disk without reading the file.
+    """
+    w = _Writer()
+    train_ids = pd.unique(np.concatenate([
+        _text(df[TRAIN_ID])[0][~df[TRAIN_ID].isna().to_numpy()] for _, _, df in sources.values()
+        if TRAIN_ID in df.columns
+    ] or [np.array([], dtype=object)]))
+    train_index = pd.Index(train_ids, dtype=object)
+    header = {"version": 1, "train_ids": {"count": len(train_ids), **w.add(_encode_dictionary(list(train_ids)))},
+              "files": {}}
+
+    for filename, (st, digest, df) in sources.items():
+        columns = []
+        for name in df.columns:
+            col = df[name]
+            dtype = str(col.dtype)
+            if col.dtype.kind in "biufM" and not isinstance(col.dtype, pd.DatetimeTZDtype):
+                columns.append({"name": name, "kind": "values", "dtype": dtype, **w.add(col.to_numpy())})
+                continue
+            values, missing = _text(col)
+            if name == TRAIN_ID:
+                codes = train_index.get_indexer(values)
+                columns.append({"name": name, "kind": "train_id", "dtype": dtype})
+            else:
+                uniques = pd.unique(values[~missing])
+                codes = pd.Index(uniques, dtype=object).get_indexer(values)
+                columns.append({"name": name, "kind": "text", "dtype": dtype, "count": len(uniques),
+                                "dictionary": w.add(_encode_dictionary(list(uniques)))})
+            codes[missing] = -1
+            columns[-1].update(w.add(codes.astype("<i4")))
+        header["files"][filename] = {
+            "mtime_ns": st.st_mtime_ns, "size": st.st_size, "digest": digest, "rows": len(df), "columns": columns,
+        }
+
+    head = json.dumps(header).encode()
+    prefix = MAGIC + np.uint64(len(head)).astype("<u8").tobytes() + head
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as fh:
+        fh.write(prefix + b"\x00" * _pad(len(prefix)))
+        for array in w.buffers:
+            fh.write(array.tobytes())
+            fh.write(b"\x00" * _pad(array.nbytes))
+    # Readers keep their mapping of the old file; new opens see the complete new one
+    os.replace(tmp, path)
+
+
+class Snapshot:
+    """Read-only view of a snapshot file; frames share the mapped pages instead of copying them."""
+
+    def __init__(self, path):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        if len(self._map) < 16 or self._map[:8].tobytes() != MAGIC:
+            raise ValueError(f"{path} is not a fleet snapshot")
+        length = int(self._map[8:16].view("<u8")[0])
+        header = json.loads(self._map[16:16 + length].tobytes())
+        self._data = 16 + length + _pad(16 + length)
+        self.files = header["files"]
+        self._train_ids_spec = header["train_ids"]
+        self._train_ids = None
+        self._lock = threading.Lock()
+
+    def _buffer(self, spec, dtype):
+        start = self._data + spec["offset"]
+        return self._map[start:start + spec["nbytes"]].view(np.ndarray).view(dtype)
+
+    def _dictionary(self, spec, count):
+        if count == 0:
+            return np.array([], dtype=object)
+        return np.array(self._buffer(spec, np.uint8).tobytes().decode().split("\x00"), dtype=object)
+
+    def train_ids(self):
+        # Decoded once per process; every source's train_id codes index into it
+        with self._lock:
+            if self._train_ids is None:
+                self._train_ids = self._dictionary(self._train_ids_spec, self._train_ids_spec["count"])
+            return self._train_ids
+
+    def matches(self, filename, st):
+        meta = self.files.get(filename)
+        return meta is not None and meta["mtime_ns"] == st.st_mtime_ns and meta["size"] == st.st_size
+
+    def digest(self, filename):
+        return self.files[filename]["digest"]
+
+    def columns(self, filename):
+        return [c["name"] for c in self.files[filename]["columns"]]
+
+    def rows(self, filename):
+        return self.files[filename]["rows"]
+
+    def frame(self, filename, columns=None, start=0, stop=None):
+        """Rows [start, stop) of a source as a frame with the dtypes parse_csv gives."""
+        specs = {c["name"]: c for c in self.files[filename]["columns"]}
+        rows = slice(start, stop)
+        data = {}
+        for name in columns if columns is not None else list(specs):
+            spec = specs[name]
+            if spec["kind"] == "values":
+                data[name] = self._buffer(spec, np.dtype(spec["dtype"]))[rows]
+                continue
+            codes = self._buffer(spec, "<i4")[rows]
+            if spec["kind"] == "train_id":
+                dictionary = self.train_ids()
+            else:
+                dictionary = self._dictionary(spec["dictionary"], spec["count"])
+            # Missing values (code -1) pick up the NaN appended after the dictionary
+            values = np.append(dictionary, np.nan)[codes]
+            data[name] = pd.array(values, dtype=spec["dtype"])
+        n = len(range(self.rows(filename))[rows])
+        return pd.DataFrame(data, index=pd.RangeIndex(n), copy=False)
+
+
+def main():
+    from backend.datastore import DATA_DIR, SOURCES, DataStore
+
+    parser = argparse.ArgumentParser(description="Compile the depot CSVs into a memory-mapped snapshot")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--out", default=None, help=f"default: <data-dir>/{SNAPSHOT_NAME}")
+    parser.add_argument("--sources", default=",".join(SOURCES), help="comma-separated CSV file names")
+    args = parser.parse_args()
+
+    out = args.out or os.path.join(args.data_dir, SNAPSHOT_NAME)
+    sources = [s.strip() for s in args.sources.split(",") if s.strip()]
+    compiled = DataStore(args.data_dir).compile_snapshot(out, sources)
+    for filename, rows in compiled.items():
+        print(f"{filename}: {rows} rows")
+    print(f"Wrote {out} ({os.path.getsize(out)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import uuid
+
+import pandas as pd
+
+from backend.datastore import store
+from backend.metrics import UPLOADS, stage
+
+TRAIN_ID_PATTERN = os.environ.get("KMRL_TRAIN_ID_PATTERN", r"T\d+")
+# Rows validated and written per step; bounds memory whatever the upload size
+CHUNK_ROWS = int(os.environ.get("KMRL_UPLOAD_CHUNK_ROWS", "50000"))
+# Row errors listed in the report; the counts always cover all of them
+MAX_REPORTED_ERRORS = int(os.environ.get("KMRL_UPLOAD_MAX_ERRORS", "1000"))
+
+_ISO_DATE = r"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?"
+
+
+class UploadError(Exception):
+    pass
+
+
+def _train_id(values):
+    return values.str.fullmatch(TRAIN_ID_PATTERN)
+
+
+def _choice(*options):
+    allowed = {o.lower() for o in options}
+    return lambda values: values.str.lower().isin(allowed)
+
+
+def _iso_date(values):
+    parsed = pd.to_datetime(values.where(values.str.fullmatch(_ISO_DATE)), format="ISO8601", errors="coerce")
+    return parsed.notna()
+
+
+def _clock(values):
+    return values.str.fullmatch(r"(?:[01]?\d|2[0-3]):[0-5]\d")
+
+
+def _number(integer=False):
+    def check(values):
+        num = pd.to_numeric(values, errors="coerce")
+        ok = num.notna() & (num >= 0) & (num < float("inf"))
+        return ok & (num % 1 == 0) if integer else ok
+    return check
+
+
+class Column:
+    __slots__ = ("name", "check", "required", "expected")
+
+    def __init__(self, name, check=None, required=True, expected=""):
+        self.name = name
+        self.check = check
+        self.required = required
+        self.expected = expected
+
+
+_TRAIN = Column("train_id", _train_id, expected=f"a train id matching {TRAIN_ID_PATTERN}")
+_DATE = "an ISO date (YYYY-MM-DD)"
+
+# Per source: the columns that must be present and what their values must look like.
+# Optional columns may be blank; other columns in an upload are kept as they are.
+SCHEMAS = {
+    "jobcards.csv": [_TRAIN, Column("status", _choice("Open", "Closed"), expected="Open or Closed")],
+    "fitness.csv": [_TRAIN] + [
+        Column(c, _iso_date, required=False, expected=_DATE)
+        for c in ("rolling_expiry", "signalling_expiry", "telecom_expiry")
+    ],
+    "cleaning.csv": [_TRAIN, Column("needs_cleaning", _choice("Yes", "No"), expected="Yes or No")],
+    "mileage.csv": [_TRAIN, Column("km_since_last_service", _number(integer=True), expected="a whole number >= 0")],
+    "branding.csv": [
+        _TRAIN,
+        Column("campaign_id", required=False),
+        Column("min_exposure_hours", _number(), required=False, expected="a number >= 0"),
+        Column("window_end", _iso_date, required=False, expected=_DATE),
+    ],
+    "stabling.csv": [_TRAIN, Column("stabling_bay", required=False)],
+    "cleaning_bays.csv": [
+        Column("bay"),
+        Column("opens", _clock, required=False, expected="a clock time (HH:MM)"),
+        Column("closes", _clock, required=False, expected="a clock time (HH:MM)"),
+    ],
+}
+
+
+def _validate(chunk, schema, first_row, report):
+    """Mask of the valid rows of a chunk of stripped strings; adds its errors to report."""
+    valid = pd.Series(True, index=chunk.index)
+    room = max(MAX_REPORTED_ERRORS - len(report["errors"]), 0)
+    errors = []
+    for col in schema:
+        values = chunk[col.name]
+        blank = values == ""
+        if col.check is None:
+            ok = ~blank | (not col.required)
+        else:
+            ok = (blank & (not col.required)) | (~blank & col.check(values).fillna(False).astype(bool))
+        bad = ~ok.to_numpy(dtype=bool)
+        if not bad.any():
+            continue
+        valid &= ~bad
+        report["error_count"] += int(bad.sum())
+        for i in bad.nonzero()[0][:room]:
+            value = values.iat[i]
+            errors.append({
+                "row": first_row + int(i),
+                "column": col.name,
+                "value": value,
+                "error": "missing value" if value == "" else f"expected {col.expected}",
+            })
+    report["errors"] += sorted(errors, key=lambda e: e["row"])[:room]
+    return valid.to_numpy()
+
+
+def ingest_upload(filename, fh, on_error="reject", chunksize=CHUNK_ROWS):
+    """Validate an uploaded CSV chunk by chunk and swap it in for the source file.
+
+    Valid rows go to a temporary file next to the source, which replaces it
+    with one rename, so readers see either the old file or the whole new one.
+    With on_error="reject" any invalid row leaves the source untouched; with
+    "skip" the invalid rows are dropped. Rows are numbered from 1, after the
+    header. Returns the report.
+    """
+    schema = SCHEMAS.get(filename)
+    if schema is None:
+        raise KeyError(filename)
+    try:
+        columns = pd.read_csv(fh, nrows=0).columns.tolist()
+    except pd.errors.EmptyDataError:
+        raise UploadError("Empty upload")
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise UploadError(f"Malformed CSV: {e}")
+    missing = [c.name for c in schema if c.name not in columns]
+    if missing:
+        raise UploadError(f"Missing columns: {', '.join(missing)}")
+    fh.seek(0)
+
+    report = {"source": filename, "rows": 0, "valid_rows": 0, "invalid_rows": 0,
+              "error_count": 0, "errors": [], "swapped": False}
+    path = store.path(filename)
+    tmp = os.path.join(os.path.dirname(path), f".{filename}.upload-{uuid.uuid4().hex}")
+    digest = hashlib.sha1()
+    try:
+        with open(tmp, "w", encoding="utf-8", newline="") as out:
+            reader = pd.read_csv(fh, dtype=str, keep_default_na=False, chunksize=chunksize)
+            for chunk in reader:
+                with stage("upload_validate"):
+                    chunk = chunk.apply(lambda s: s.str.strip())
+                    valid = _validate(chunk, schema, report["rows"] + 1, report)
+                report["rows"] += len(chunk)
+                report["valid_rows"] += int(valid.sum())
+                if report["error_count"] and on_error == "reject":
+                    # Won't be swapped in; keep validating for the report only
+                    continue
+                text = chunk[valid].to_csv(index=False, header=out.tell() == 0)
+                digest.update(text.encode())
+                out.write(text)
+
+        report["invalid_rows"] = report["rows"] - report["valid_rows"]
+        report["errors_truncated"] = report["error_count"] > len(report["errors"])
+        if report["invalid_rows"] and on_error == "reject":
+            UPLOADS.inc(source=filename, outcome="rejected")
+            return report
+        if report["valid_rows"] == 0:
+            # Never replace a source with an empty one
+            UPLOADS.inc(source=filename, outcome="rejected")
+            report["error"] = "No valid rows"
+            return report
+        os.replace(tmp, path)
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise UploadError(f"Malformed CSV: {e}")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    UPLOADS.inc(source=filename, outcome="swapped")
+    report["swapped"] = True
+    report["digest"] = digest.hexdigest()
+    return report
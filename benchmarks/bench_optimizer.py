@@ -0,0 +1,185 @@
+# benchmarks/bench_optimizer.py
+#
+# Times each optimizer stage on generated fleets and writes the results as JSON.
+#
+#   python benchmarks/bench_optimizer.py --sizes 1000,10000,100000
+#   python benchmarks/bench_optimizer.py --compare benchmarks/results/<earlier>.json
+#
+# With --compare the run exits with status 1 when a stage's median got slower
+# than the earlier run by more than --threshold.
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+import sklearn
+
+from gen_samples import generate_fleet, write_fleet
+from backend.datastore import store, SOURCES, parse_csv
+from backend.serialize import dumps
+from backend.optimizer.model import _ml_predict, planning_date, plan_records
+from backend.optimizer.planframe import PlanFrame
+from backend.optimizer.registry import registry, fit_model
+from backend.optimizer.rules import (
+    SOURCE_KEYS, merge_sources, finish_fleet, evaluate_rules, balance_mileage, promote_quota, feature_frame,
+)
+
+# Medians below this are too close to timer noise to call a regression
+NOISE_FLOOR_MS = 1.0
+
+
+def _timed(fn, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - t) * 1000)
+    return result, {
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+    }
+
+
+def bench_size(n_trains, n_depots, repeat, seed, required_service, max_cleaning_slots, max_mileage):
+    stages = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_fleet(generate_fleet(n_trains, n_depots=n_depots, seed=seed), data_dir)
+        raw_bytes = {}
+        for f in SOURCES:
+            with open(os.path.join(data_dir, f), "rb") as fh:
+                raw_bytes[f] = fh.read()
+
+        _, stages["csv_load"] = _timed(
+            lambda: {f: pd.read_csv(io.BytesIO(b), dtype={"train_id": str}) for f, b in raw_bytes.items()}, repeat)
+        frames, parse_total = _timed(lambda: {f: parse_csv(io.BytesIO(b)) for f, b in raw_bytes.items()}, repeat)
+        stages["date_parse"] = {k: round(max(parse_total[k] - stages["csv_load"][k], 0.0), 3) for k in parse_total}
+
+        tomorrow = planning_date()
+        sources = [frames[f"{k}.csv"] for k in SOURCE_KEYS]
+        fleet, stages["merge"] = _timed(lambda: finish_fleet(merge_sources(*sources, tomorrow)), repeat)
+
+        (status, reason, high), stages["rules"] = _timed(
+            lambda: evaluate_rules(fleet, max_cleaning_slots, max_mileage), repeat)
+
+        def balancing():
+            s, r = status.copy(), reason.copy()
+            return s, r, balance_mileage(s, r, high, max_mileage)
+        (status_b, reason_b, service_count), stages["mileage_balancing"] = _timed(balancing, repeat)
+        _, stages["quota_promotion"] = _timed(
+            lambda: promote_quota(status_b.copy(), reason_b.copy(), required_service, service_count), repeat)
+
+        _, stages["model_fit"] = _timed(lambda: fit_model(max_mileage), max(1, min(repeat, 3)))
+        registry.warm(max_mileage)
+        feats = feature_frame(fleet)
+        risk, stages["ml_inference"] = _timed(lambda: _ml_predict(feats, max_mileage), repeat)
+
+        promote_quota(status_b, reason_b, required_service, service_count)
+        _, stages["serialization"] = _timed(
+            lambda: dumps({"plan": plan_records(fleet, status_b, reason_b, risk)}), repeat)
+        _, stages["serialization_columnar"] = _timed(
+            lambda: dumps({"plan": PlanFrame.build(fleet, status_b, reason_b, risk).columnar()}), repeat)
+
+        # The API paths, through the shared data store
+        from backend.app import ingest_file
+        from backend.optimizer.model import run_optimizer
+        store.data_dir = data_dir
+        store.invalidate()
+        _, stages["store_cold_load"] = _timed(lambda: (store.invalidate(), store.frames()), repeat)
+        _, stages["ingest_page"] = _timed(
+            lambda: ingest_file("mileage.csv", offset=0, limit=10, columns=None, fmt="json", if_none_match=None), repeat)
+        _, stages["run_optimizer"] = _timed(
+            lambda: run_optimizer(required_service, max_cleaning_slots, max_mileage), repeat)
+        # Same cold load, read through a compiled snapshot instead of the CSVs
+        store.compile_snapshot()
+        _, stages["snapshot_cold_load"] = _timed(lambda: (store.invalidate(), store.frames()), repeat)
+    return stages
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current, baseline, threshold):
+    regressions = []
+    for size, stages in current["results"].items():
+        for stage, stats in stages.items():
+            before = baseline.get("results", {}).get(size, {}).get(stage)
+            if not before:
+                continue
+            old, new = before["median_ms"], stats["median_ms"]
+            if new > NOISE_FLOOR_MS and new > old * (1 + threshold):
+                regressions.append((size, stage, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage-level optimizer benchmarks")
+    parser.add_argument("--sizes", default="1000,10000", help="comma-separated fleet sizes")
+    parser.add_argument("--depots", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--required-service", type=int, default=None, help="default: 10%% of the fleet")
+    parser.add_argument("--max-cleaning-slots", type=int, default=None, help="default: 2%% of the fleet")
+    parser.add_argument("--max-mileage", type=int, default=8000)
+    parser.add_argument("--out", default=None, help="default: benchmarks/results/bench-<commit>-<time>.json")
+    parser.add_argument("--compare", default=None, help="earlier result file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown of a stage median")
+    args = parser.parse_args()
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": {},
+    }
+    for n in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        required = args.required_service if args.required_service is not None else max(1, n // 10)
+        slots = args.max_cleaning_slots if args.max_cleaning_slots is not None else max(1, n // 50)
+        stages = bench_size(n, args.depots, args.repeat, args.seed, required, slots, args.max_mileage)
+        report["results"][str(n)] = stages
+        print(f"\n{n} rakes")
+        for stage, stats in stages.items():
+            print(f"  {stage:<20} median {stats['median_ms']:>10.3f} ms   min {stats['min_ms']:>10.3f} ms")
+
+    out = args.out or os.path.join(
+        ROOT, "benchmarks", "results", f"bench-{commit}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nWrote {out}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        regressions = compare(report, baseline, args.threshold)
+        for size, stage, old, new in regressions:
+            print(f"REGRESSION {size} rakes / {stage}: {old:.3f} ms -> {new:.3f} ms")
+        if regressions:
+            sys.exit(1)
+        print(f"No stage slower than {args.threshold:.0%} vs {baseline.get('commit', args.compare)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+# benchmarks/load_test.py
+#
+# Load-tests the API with many concurrent clients and writes the results as JSON.
+#
+#   python benchmarks/load_test.py --sizes 1000,10000 --concurrency 1,8,32 --duration 10
+#   python benchmarks/load_test.py --mix plan=3,plan_columnar=3,ingest=1 --vary 20
+#   python benchmarks/load_test.py --target stub --stub-latency 20
+#   python benchmarks/load_test.py --target http://127.0.0.1:8000 --concurrency 16
+#   python benchmarks/load_test.py --endpoint live="GET /plan/live?required_service={service}" --mix live=1
+#   python benchmarks/load_test.py --serve-stub --sizes 10000 --port 8000
+#   python benchmarks/load_test.py --compare benchmarks/results/<earlier>.json
+#
+# --target app (the default) serves the real app in-process over ASGI, on a
+# generated fleet per size. --target stub puts a stand-in backend in front of
+# it: each distinct GET is answered by the real app once and then replayed
+# after --stub-latency ms, so the client side (or the dashboard, with
+# --serve-stub) can be loaded without planning cost. Any other target is the
+# base URL of a running server, planning on whatever data it has.
+#
+# With --compare the run exits with status 1 when, at the same size and
+# concurrency, p95 latency rose or throughput fell by more than --threshold,
+# or the error rate rose by more than a percentage point.
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("load_test.py needs httpx (pip install httpx)")
+
+from gen_samples import generate_fleet, write_fleet
+from backend.app import app
+from backend.datastore import store
+from backend.history import history
+
+# Latencies below this are too close to timer noise to call a regression
+NOISE_FLOOR_MS = 1.0
+
+# name -> (method, path); {service}, {slots}, {mileage} and {offset} are filled in per request
+REQUESTS = {
+    "plan": ("GET", "/plan/run?required_service={service}&max_cleaning_slots={slots}&max_mileage={mileage}"),
+    "plan_columnar": ("GET", "/plan/run?required_service={service}&max_cleaning_slots={slots}"
+                             "&max_mileage={mileage}&format=columnar"),
+    "ingest": ("GET", "/ingest/mileage.csv?offset={offset}&limit=100"),
+    "expiring": ("GET", "/fitness/expiring?days=30&limit=100"),
+    "sweep": ("GET", "/plan/mileage-sweep?required_service={service}&max_cleaning_slots={slots}&format=columnar"),
+    "horizon": ("GET", "/plan/horizon?required_service={service}&max_cleaning_slots={slots}&nights=7"
+                       "&include_plans=false"),
+    "campaigns": ("GET", "/branding/campaigns"),
+}
+DEFAULT_MIX = "plan=4,plan_columnar=2,ingest=3,expiring=1"
+# Pages of 100 rows the ingest requests spread over
+INGEST_PAGES = 10
+# Headers a replayed response keeps
+REPLAY_HEADERS = ("content-type", "etag")
+
+
+def stub_backend(real_app, latency_ms):
+    """A stand-in ASGI backend: each distinct GET is answered by real_app once, then replayed after latency_ms.
+
+    Other methods always go through to real_app, so submitted jobs still exist when they are polled.
+    """
+    from contextlib import asynccontextmanager
+
+    from starlette.applications import Starlette
+    from starlette.responses import Response
+    from starlette.routing import Route
+
+    recorded = {}
+    locks = {}
+    upstream = httpx.AsyncClient(transport=httpx.ASGITransport(app=real_app), base_url="http://app", timeout=None)
+
+    async def forward(request):
+        headers = {k: v for k, v in request.headers.items() if k == "content-type"}
+        r = await upstream.request(request.method, request.url.path, params=request.query_params,
+                                   content=await request.body(), headers=headers)
+        return r.status_code, {k: v for k, v in r.headers.items() if k in REPLAY_HEADERS}, r.content
+
+    async def handle(request):
+        if request.method != "GET":
+            status, headers, body = await forward(request)
+            return Response(body, status_code=status, headers=headers)
+        key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+        if key not in recorded:
+            async with locks.setdefault(key, asyncio.Lock()):
+                if key not in recorded:
+                    recorded[key] = await forward(request)
+        await asyncio.sleep(latency_ms / 1000)
+        status, headers, body = recorded[key]
+        return Response(body, status_code=status, headers=headers)
+
+    @asynccontextmanager
+    async def lifespan(_):
+        async with real_app.router.lifespan_context(real_app), upstream:
+            yield
+
+    return Starlette(routes=[Route("/{path:path}", handle, methods=["GET", "POST", "PUT", "DELETE"])], lifespan=lifespan)
+
+
+def parse_mix(text, requests):
+    mix = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in requests:
+            raise SystemExit(f"Unknown request {name!r}; known: {', '.join(sorted(requests))}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise SystemExit("--mix needs at least one request with a positive weight")
+    return mix
+
+
+def parse_endpoint(text):
+    # name="METHOD /path?query"
+    name, _, spec = text.partition("=")
+    method, _, path = spec.strip().partition(" ")
+    if not name.strip() or not path.strip().startswith("/"):
+        raise SystemExit(f'--endpoint takes name="METHOD /path", not {text!r}')
+    return name.strip(), (method.upper(), path.strip())
+
+
+def _percentile(sorted_values, q):
+    # Nearest rank
+    if not sorted_values:
+        return None
+    k = math.ceil(q / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, k))]
+
+
+def summarize(samples, elapsed):
+    """requests, errors, error_rate, throughput_rps and latency percentiles (ms) of (seconds, ok) samples."""
+    latencies = sorted(s * 1000 for s, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": _round(_percentile(latencies, 50)),
+        "p95_ms": _round(_percentile(latencies, 95)),
+        "p99_ms": _round(_percentile(latencies, 99)),
+        "mean_ms": _round(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": _round(latencies[-1]) if latencies else None,
+    }
+
+
+def _round(v):
+    return None if v is None else round(v, 3)
+
+
+async def _send(client, method, url, timeout):
+    started = time.perf_counter()
+    try:
+        r = await client.request(method, url, timeout=timeout)
+        # Planners report failures as {"error": ...} with a 200
+        ok = r.status_code < 400 and not r.content.startswith(b'{"error"')
+    except httpx.HTTPError:
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+async def run_level(client, requests, mix, concurrency, duration, space, seed, timeout):
+    """concurrency clients sending mix-weighted requests for duration seconds; returns the summary."""
+    names, weights = list(mix), list(mix.values())
+    samples = {name: [] for name in names}
+    stop = time.perf_counter() + duration
+
+    async def worker(k):
+        rng = random.Random(seed * 1000 + k)
+        while time.perf_counter() < stop:
+            name = rng.choices(names, weights)[0]
+            method, path = requests[name]
+            path = path.format(**{k: rng.choice(v) for k, v in space.items()})
+            samples[name].append(await _send(client, method, path, timeout))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(k) for k in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    out = summarize([s for v in samples.values() for s in v], elapsed)
+    out["endpoints"] = {name: summarize(s, elapsed) for name, s in samples.items() if s}
+    return out
+
+
+def value_space(n_trains, required_service, max_cleaning_slots, max_mileage, vary):
+    """Values each template field is drawn from: vary plans (required_service upwards) and INGEST_PAGES pages."""
+    return {
+        "service": [required_service + i for i in range(max(vary, 1))],
+        "slots": [max_cleaning_slots],
+        "mileage": [max_mileage],
+        "offset": [100 * p for p in range(max(1, min(INGEST_PAGES, n_trains // 100)))],
+    }
+
+
+def distinct_paths(path, space):
+    # Every path the template can give, so warm-up can send each one once
+    fields = sorted({f for _, f, _, _ in string.Formatter().parse(path) if f})
+    return sorted({path.format(**dict(zip(fields, combo))) for combo in itertools.product(*(space[f] for f in fields))})
+
+
+async def load_target(asgi_app, base_url, args, requests, mix, space, label):
+    transport = httpx.ASGITransport(app=asgi_app) if asgi_app is not None else None
+    limits = httpx.Limits(max_connections=max(args.concurrency_levels), max_keepalive_connections=max(args.concurrency_levels))
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits) as client:
+        # Model fits, first parses, cache fills and stub recordings are not what is being measured
+        for _ in range(args.warmup):
+            for name in mix:
+                method, path = requests[name]
+                for p in distinct_paths(path, space):
+                    await _send(client, method, p, args.timeout)
+        for c in args.concurrency_levels:
+            stats = await run_level(client, requests, mix, c, args.duration, space, args.seed, args.timeout)
+            results[str(c)] = stats
+            print(f"  {label:>8} c={c:<4} {stats['throughput_rps']:>9.2f} req/s   p50 {stats['p50_ms'] or 0:>9.2f} ms"
+                  f"   p95 {stats['p95_ms'] or 0:>9.2f} ms   p99 {stats['p99_ms'] or 0:>9.2f} ms"
+                  f"   errors {stats['error_rate']:>7.2%}")
+    return results
+
+
+async def load_in_process(target, args, requests, mix, n, data_dir):
+    store.data_dir = data_dir
+    store.invalidate()
+    required = args.required_service if args.required_service is not None else max(1, n // 10)
+    slots = args.max_cleaning_slots if args.max_cleaning_slots is not None else max(1, n // 50)
+    space = value_space(n, required, slots, args.max_mileage, args.vary)
+    served = stub_backend(app, args.stub_latency) if target == "stub" else app
+    async with served.router.lifespan_context(served):
+        return await load_target(served, "http://loadtest", args, requests, mix, space, str(n))
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current, baseline, threshold):
+    regressions = []
+    for size, levels in current["results"].items():
+        for level, stats in levels.items():
+            before = baseline.get("results", {}).get(size, {}).get(level)
+            if not before:
+                continue
+            old, new = before["p95_ms"], stats["p95_ms"]
+            if old is not None and new is not None and new > NOISE_FLOOR_MS and new > old * (1 + threshold):
+                regressions.append((size, level, "p95_ms", old, new))
+            old, new = before["throughput_rps"], stats["throughput_rps"]
+            if new < old * (1 - threshold):
+                regressions.append((size, level, "throughput_rps", old, new))
+            old, new = before["error_rate"], stats["error_rate"]
+            if new > old + 0.01:
+                regressions.append((size, level, "error_rate", old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent API load test")
+    parser.add_argument("--target", default="app", help="app, stub or the base URL of a running server")
+    parser.add_argument("--sizes", default="1000,10000", help="comma-separated fleet sizes (app and stub targets)")
+    parser.add_argument("--depots", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="comma-separated request=weight; see REQUESTS")
+    parser.add_argument("--endpoint", action="append", default=[], metavar='NAME="METHOD /path"',
+                        help="add a request to choose from in --mix; may use {service}, {slots}, {mileage}, {offset}")
+    parser.add_argument("--vary", type=int, default=1, help="distinct required_service values to spread plans over")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured rounds of every distinct request in the mix")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before a request counts as an error")
+    parser.add_argument("--required-service", type=int, default=None, help="default: 10%% of the fleet")
+    parser.add_argument("--max-cleaning-slots", type=int, default=None, help="default: 2%% of the fleet")
+    parser.add_argument("--max-mileage", type=int, default=8000)
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="ms the stub waits before each replay")
+    parser.add_argument("--serve-stub", action="store_true", help="serve the stub over HTTP instead of loading it")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--out", default=None, help="default: benchmarks/results/load-<commit>-<time>.json")
+    parser.add_argument("--compare", default=None, help="earlier result file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed p95 rise or throughput drop")
+    args = parser.parse_args()
+
+    requests = dict(REQUESTS)
+    requests.update(parse_endpoint(e) for e in args.endpoint)
+    mix = parse_mix(args.mix, requests)
+    args.concurrency_levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Plans committed during the run (if the mix has any) stay out of the real history
+        history.path = os.path.join(tmp, "history.db")
+
+        if args.serve_stub:
+            import uvicorn
+            data_dir = os.path.join(tmp, "fleet")
+            write_fleet(generate_fleet(sizes[0], n_depots=args.depots, seed=args.seed), data_dir)
+            store.data_dir = data_dir
+            store.invalidate()
+            print(f"Stub backend for a {sizes[0]}-rake fleet on http://127.0.0.1:{args.port}")
+            uvicorn.run(stub_backend(app, args.stub_latency), host="127.0.0.1", port=args.port)
+            return
+
+        commit = _git_commit()
+        report = {
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "target": args.target if args.target in ("app", "stub") else "url",
+            "stub_latency_ms": args.stub_latency if args.target == "stub" else None,
+            "duration_s": args.duration,
+            "mix": mix,
+            "requests": {name: requests[name] for name in mix},
+            "vary": args.vary,
+            "results": {},
+        }
+        if args.target in ("app", "stub"):
+            for n in sizes:
+                data_dir = os.path.join(tmp, f"fleet-{n}")
+                write_fleet(generate_fleet(n, n_depots=args.depots, seed=args.seed), data_dir)
+                print(f"\n{n} rakes")
+                report["results"][str(n)] = asyncio.run(load_in_process(args.target, args, requests, mix, n, data_dir))
+        else:
+            # A running server: its own data, so the size is not known
+            required = args.required_service if args.required_service is not None else 10
+            slots = args.max_cleaning_slots if args.max_cleaning_slots is not None else 2
+            space = value_space(1000, required, slots, args.max_mileage, args.vary)
+            print(f"\n{args.target}")
+            report["results"]["url"] = asyncio.run(
+                load_target(None, args.target, args, requests, mix, space, "url"))
+
+    out = args.out or os.path.join(
+        ROOT, "benchmarks", "results", f"load-{commit}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nWrote {out}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        regressions = compare(report, baseline, args.threshold)
+        for size, level, metric, old, new in regressions:
+            print(f"REGRESSION {size} / c={level} / {metric}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print(f"No level worse than {args.threshold:.0%} vs {baseline.get('commit', args.compare)}")
+
+
+if __name__ == "__main__":
+    main()
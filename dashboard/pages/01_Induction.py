@@ -1,8 +1,18 @@
+import json
+import time
+from contextlib import ExitStack
+from urllib.parse import urlencode
 import streamlit as st
 import requests
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+try:
+    from websockets.sync.client import connect as ws_connect
+except ImportError:  # live updates are hidden without the websockets client
+    ws_connect = None
+
 st.markdown(
     """
     <!-- Load Google Font -->
@@ -108,46 +118,120 @@ run_btn = st.button("Run Plan")
 if "plan_df" not in st.session_state:
     st.session_state.plan_df = pd.DataFrame()
 
+def columns_frame(plan):
+    # format=columnar plan: coded columns come as a list of values and one code per row
+    return pd.DataFrame({
+        k: np.asarray(v["values"], dtype=object)[v["codes"]] if isinstance(v, dict) else v
+        for k, v in plan.items() if k != "rows"
+    })
+
+def plan_frame(plan_list):
+    if isinstance(plan_list, dict) and "rows" in plan_list:
+        df = columns_frame(plan_list)
+        df["Rakes Assigned"] = 1
+    else:
+        if isinstance(plan_list, dict):
+            plan_list = [plan_list]
+        df = pd.DataFrame(plan_list)
+
+    # Rename ML columns
+    if "ml_risk_score" in df.columns:
+        df.rename(columns={"ml_risk_score": "AI Risk Score"}, inplace=True)
+    if "ml_recommendation" in df.columns:
+        df.rename(columns={"ml_recommendation": "AI Recommendation"}, inplace=True)
+
+    # Ensure numeric for bar chart
+    if "Rakes Assigned" in df.columns:
+        df["Rakes Assigned"] = pd.to_numeric(df["Rakes Assigned"], errors="coerce").fillna(0)
+    return df
+
+def mileage_sweep(required_service, max_cleaning_slots):
+    # Plans for every mileage slider position, fetched once and revalidated with the ETag
+    cache = st.session_state.setdefault("sweep_cache", {})
+    key = (required_service, max_cleaning_slots)
+    headers = {"If-None-Match": cache[key][0]} if key in cache else {}
+    r = requests.get(
+        "http://127.0.0.1:8000/plan/mileage-sweep",
+        params={"required_service": required_service, "max_cleaning_slots": max_cleaning_slots,
+                "min_mileage": 1000, "max_mileage": 20000, "step": 500, "format": "columnar"},
+        headers=headers,
+        timeout=120,
+    )
+    if r.status_code == 304:
+        return cache[key][1]
+    r.raise_for_status()
+    sweep = r.json()
+    if "error" in sweep:
+        raise RuntimeError(sweep["error"])
+    cache[key] = (r.headers.get("ETag", ""), sweep)
+    return sweep
+
+def plan_at(sweep, max_mileage):
+    # First step is a full plan, later steps only the rows that changed; the last change of a train wins
+    steps = [columns_frame(s.get("plan", s.get("changes"))) for s in sweep["steps"] if s["max_mileage"] <= max_mileage]
+    rows = pd.concat(steps, ignore_index=True)
+    rows = rows[~rows["train_id"].duplicated(keep="last")].set_index("train_id")
+    plan = rows.reindex(steps[0]["train_id"]).reset_index()
+    plan["Rakes Assigned"] = 1
+    return plan
+
 # --- Run backend plan ---
 if run_btn:
     try:
-        res = requests.get(
-            f"http://127.0.0.1:8000/plan/run?required_service={required_service}&max_mileage={max_mileage}&max_cleaning_slots={max_cleaning_slots}",
+        # Submit as a background job and poll, so long plans don't hit the request timeout
+        res = requests.post(
+            "http://127.0.0.1:8000/plan/jobs",
+            json={"required_service": required_service, "max_mileage": max_mileage, "max_cleaning_slots": max_cleaning_slots,
+                  "plan_format": "columnar", "turnout": True},
             timeout=15,
         )
         res.raise_for_status()
-        payload = res.json()
+        job = res.json()
+        deadline = time.time() + 300
+        with st.spinner("Computing plan..."):
+            while job["status"] in ("queued", "running") and time.time() < deadline:
+                time.sleep(0.5)
+                job = requests.get(f"http://127.0.0.1:8000/plan/jobs/{job['job_id']}", timeout=15).json()
+
+        if job["status"] == "done":
+            payload = job["result"]
+        elif job["status"] == "failed":
+            payload = {"error": job.get("error", "unknown error")}
+        else:
+            payload = {"error": "Timed out waiting for the plan"}
 
         if "error" in payload:
             st.error(f"Backend error: {payload['error']}")
             df = pd.DataFrame()
         else:
-            plan_list = payload.get("plan", [])
-            if isinstance(plan_list, dict):
-                plan_list = [plan_list]
-            df = pd.DataFrame(plan_list)
-
-            # Rename ML columns
-            if "ml_risk_score" in df.columns:
-                df.rename(columns={"ml_risk_score": "AI Risk Score"}, inplace=True)
-            if "ml_recommendation" in df.columns:
-                df.rename(columns={"ml_recommendation": "AI Recommendation"}, inplace=True)
-
-            # Ensure numeric for bar chart
-            if "Rakes Assigned" in df.columns:
-                df["Rakes Assigned"] = pd.to_numeric(df["Rakes Assigned"], errors="coerce").fillna(0)
-
-            st.session_state.plan_df = df
+            st.session_state.plan_df = plan_frame(payload.get("plan", []))
+            st.session_state.turnout = payload.get("turnout")
+            st.session_state.plan_params = (required_service, max_cleaning_slots, max_mileage)
             st.success("Plan computed ✅")
 
     except Exception as e:
         st.session_state.plan_df = pd.DataFrame()
         st.error(f"Failed to get plan: {e}")
 
-df = st.session_state.plan_df.copy()
+# Moving only the mileage slider switches to that threshold's plan from the sweep, without replanning
+elif st.session_state.get("plan_params", (None, None, None))[:2] == (required_service, max_cleaning_slots) \
+        and st.session_state.plan_params[2] != max_mileage:
+    try:
+        with st.spinner("Loading mileage thresholds..."):
+            sweep = mileage_sweep(required_service, max_cleaning_slots)
+        st.session_state.plan_df = plan_frame(plan_at(sweep, max_mileage))
+        # The turnout belongs to the plan that was run, not to this threshold's
+        st.session_state.turnout = None
+        st.session_state.plan_params = (required_service, max_cleaning_slots, max_mileage)
+    except Exception as e:
+        st.error(f"Failed to get mileage sweep: {e}")
 
 # --- Table & Search ---
-if not df.empty:
+def show_plan(df):
+    if df.empty:
+        st.info("No plan yet — choose required service and click **Run Plan**")
+        return
+
     # Status emojis
     status_col = "status" if "status" in df.columns else df.columns[-1]
     df[status_col] = df[status_col].apply(lambda x: str(x) if not pd.isna(x) else "")
@@ -177,9 +261,130 @@ if not df.empty:
         ax1.axis("equal")
         st.pyplot(fig1)
 
+def live_rows(required_service, max_mileage, max_cleaning_slots):
+    # One socket per session: the server sends the plan once, then only the rows that change
+    params = {"required_service": required_service, "max_mileage": max_mileage, "max_cleaning_slots": max_cleaning_slots}
+    ws = st.session_state.get("plan_ws")
+    if ws is None:
+        # Held open across reruns: entered through an ExitStack that close_live() closes
+        stack = ExitStack()
+        ws = stack.enter_context(ws_connect(f"ws://127.0.0.1:8000/ws/plan?{urlencode(params)}", open_timeout=5))
+        st.session_state.plan_ws = ws
+        st.session_state.plan_ws_stack = stack
+        st.session_state.live_rows = {}
+    elif st.session_state.get("plan_ws_params") != params:
+        ws.send(json.dumps(params))
+    st.session_state.plan_ws_params = params
 
+    rows = st.session_state.live_rows
+    while True:
+        try:
+            # Wait for the first full plan, then only drain what has arrived
+            msg = json.loads(ws.recv(timeout=0 if rows else 30))
+        except TimeoutError:
+            break
+        if msg["type"] == "plan":
+            rows = {r["train_id"]: r for r in msg["plan"]}
+        elif msg["type"] == "diff":
+            for r in msg["changes"]:
+                rows[r["train_id"]] = r
+            for t in msg["removed"]:
+                rows.pop(t, None)
+        elif msg["type"] == "error":
+            st.error(f"Backend error: {msg['error']}")
+    st.session_state.live_rows = rows
+    return list(rows.values())
+
+def close_live():
+    stack = st.session_state.pop("plan_ws_stack", None)
+    if stack is not None:
+        stack.close()
+    st.session_state.pop("plan_ws", None)
+    st.session_state.pop("plan_ws_params", None)
+
+@st.fragment(run_every=2)
+def live_plan(required_service, max_mileage, max_cleaning_slots):
+    # Reruns on its own every couple of seconds without re-running the rest of the page
+    try:
+        st.session_state.plan_df = plan_frame(live_rows(required_service, max_mileage, max_cleaning_slots))
+    except Exception as e:
+        close_live()
+        st.error(f"Live updates unavailable: {e}")
+    show_plan(st.session_state.plan_df.copy())
+
+live = ws_connect is not None and st.toggle(
+    "Live updates", value=False, help="Keep a WebSocket open and apply plan changes as they happen"
+)
+if live:
+    live_plan(required_service, max_mileage, max_cleaning_slots)
 else:
-    st.info("No plan yet — choose required service and click **Run Plan**")
+    close_live()
+    show_plan(st.session_state.plan_df.copy())
+    if turnout := st.session_state.get("turnout"):
+        st.markdown("### Morning Turnout")
+        st.caption(
+            f"{turnout['departures']} departures, {turnout['shunting_moves']} shunting moves "
+            f"(at least {turnout['lower_bound']} needed{', optimal' if turnout['optimal'] else ''})"
+        )
+        if turnout["unreachable"]:
+            st.warning(f"No room to get out: {', '.join(turnout['unreachable'])}")
+        if turnout["pending"]:
+            st.warning(f"Time ran out before these were sequenced: {', '.join(turnout['pending'])}")
+        st.dataframe(pd.DataFrame(turnout["sequence"]), use_container_width=True)
+
+# --- Two-week outlook ---
+def horizon(required_service, max_mileage, max_cleaning_slots, nights=14):
+    # One rolling-horizon call; revalidated with the ETag like the mileage sweep
+    cache = st.session_state.setdefault("horizon_cache", {})
+    key = (required_service, max_mileage, max_cleaning_slots, nights)
+    headers = {"If-None-Match": cache[key][0]} if key in cache else {}
+    r = requests.get(
+        "http://127.0.0.1:8000/plan/horizon",
+        params={"required_service": required_service, "max_mileage": max_mileage,
+                "max_cleaning_slots": max_cleaning_slots, "nights": nights},
+        headers=headers,
+        timeout=120,
+    )
+    if r.status_code == 304:
+        return cache[key][1]
+    r.raise_for_status()
+    outlook = r.json()
+    if "error" in outlook:
+        raise RuntimeError(outlook["error"])
+    cache[key] = (r.headers.get("ETag", ""), outlook)
+    return outlook
+
+st.markdown("---")
+st.markdown("### Two-Week Outlook")
+if st.toggle("Show 14-night outlook", value=False, help="Project mileage, expiry and cleaning night by night"):
+    try:
+        with st.spinner("Planning the next 14 nights..."):
+            outlook = horizon(required_service, max_mileage, max_cleaning_slots)
+        summary = pd.DataFrame(outlook["summary"]).set_index("night")
+        st.line_chart(summary[["service", "standby", "ibl"]])
+        emoji = {"Service": "🟢", "Standby": "🟡", "IBL": "🔴"}
+        matrix = pd.DataFrame(
+            {night: [emoji.get(s, s) for s in statuses] for night, statuses in zip(outlook["nights"], outlook["status"])},
+            index=outlook["train_id"],
+        )
+        st.dataframe(matrix, use_container_width=True)
+    except Exception as e:
+        st.error(f"Failed to get outlook: {e}")
+
+# --- Branding campaigns ---
+st.markdown("---")
+st.markdown("### Branding Campaigns")
+if st.toggle("Show campaign exposure", value=False, help="Exposure recorded from committed plans against each campaign's target"):
+    try:
+        r = requests.get("http://127.0.0.1:8000/branding/campaigns", timeout=15)
+        r.raise_for_status()
+        campaigns = pd.DataFrame(r.json()["campaigns"])
+        if campaigns.empty:
+            st.info("No campaign is running.")
+        else:
+            st.dataframe(campaigns.set_index("campaign_id"), use_container_width=True)
+    except Exception as e:
+        st.error(f"Failed to get campaigns: {e}")
 
 # --- CSV Data Previews ---
 st.markdown("---")
@@ -192,9 +397,15 @@ tabs = st.tabs([f.split(".")[0].capitalize() for f in files])
 for i, f in enumerate(files):
     with tabs[i]:
         try:
-            r = requests.get(f"http://127.0.0.1:8000/ingest/{f}", timeout=5)
-            if r.status_code == 200:
-                d = r.json()
+            # Revalidate with the last ETag; an unchanged file answers 304 and we reuse the stored preview
+            cache = st.session_state.setdefault("preview_cache", {})
+            key = (f, num_rows)
+            headers = {"If-None-Match": cache[key][0]} if key in cache else {}
+            r = requests.get(f"http://127.0.0.1:8000/ingest/{f}", params={"limit": num_rows}, headers=headers, timeout=5)
+            if r.status_code == 200 and "ETag" in r.headers:
+                cache[key] = (r.headers["ETag"], r.json())
+            if r.status_code in (200, 304):
+                d = cache[key][1] if key in cache else r.json()
                 st.write(f"**{f}** — rows: {d.get('rows', '?')}, columns: {d.get('columns', [])}")
                 preview = d.get("preview", [])
                 if preview:
@@ -1,88 +1,110 @@
 # gen_samples.py
+import argparse
 import os
-import random
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
+
+
+# Rakes per stabling bay when the bay count is left to the fleet size
+RAKES_PER_BAY = 3
 
-os.makedirs("data_samples", exist_ok=True)
 
 def gen_train_ids(n):
-    return [f"T{str(i+1).zfill(3)}" for i in range(n)]
-
-def write_jobcards(train_ids, p_open=0.15):
-    rows = []
-    for t in train_ids:
-        status = "Open" if random.random() < p_open else "Closed"
-        rows.append({"train_id": t, "status": status})
-    pd.DataFrame(rows).to_csv("data_samples/jobcards.csv", index=False)
-
-def write_fitness(train_ids, pct_expired=0.1):
-    rows = []
-    today = datetime.now().date()
-    for t in train_ids:
-        # some expiry dates in past (expired), some future
-        def rand_expiry(expired=False):
-            if expired:
-                days = -random.randint(1, 30)
-            else:
-                days = random.randint(7, 120)
-            return (today + timedelta(days=days)).isoformat()
-        expired_flag = random.random() < pct_expired
-        rows.append({
-            "train_id": t,
-            "rolling_expiry": rand_expiry(expired_flag),
-            "signalling_expiry": rand_expiry(expired_flag if random.random()<0.5 else False),
-            "telecom_expiry": rand_expiry(expired_flag if random.random()<0.2 else False),
-        })
-    pd.DataFrame(rows).to_csv("data_samples/fitness.csv", index=False)
-
-def write_cleaning(train_ids, p_needs=0.2):
-    rows = []
-    for t in train_ids:
-        rows.append({
-            "train_id": t,
-            "needs_cleaning": "Yes" if random.random() < p_needs else "No"
-        })
-    pd.DataFrame(rows).to_csv("data_samples/cleaning.csv", index=False)
-
-def write_mileage(train_ids, low=2000, high=20000, skew_high_pct=0.25):
-    rows = []
-    for t in train_ids:
-        if random.random() < skew_high_pct:
-            km = random.randint(int(high*0.8), high+5000)
-        else:
-            km = random.randint(low, int(high*0.8))
-        rows.append({"train_id": t, "km_since_last_service": km})
-    pd.DataFrame(rows).to_csv("data_samples/mileage.csv", index=False)
-
-def write_branding(train_ids, pct_branding=0.25):
-    rows = []
-    campaigns = [f"B{str(i).zfill(2)}" for i in range(1, 10)]
-    for t in train_ids:
-        if random.random() < pct_branding:
-            c = random.choice(campaigns)
-            exposure = random.randint(2, 30)
-            window_end = (datetime.now().date() + timedelta(days=random.randint(5,60))).isoformat()
-            rows.append({"train_id": t, "campaign_id": c, "min_exposure_hours": exposure, "window_end": window_end})
-        else:
-            rows.append({"train_id": t, "campaign_id": "", "min_exposure_hours": "", "window_end": ""})
-    pd.DataFrame(rows).to_csv("data_samples/branding.csv", index=False)
-
-def write_stabling(train_ids, bays=10):
-    rows = []
-    for i, t in enumerate(train_ids):
-        bay = f"Bay-{(i % bays) + 1}"
-        rows.append({"train_id": t, "stabling_bay": bay})
-    pd.DataFrame(rows).to_csv("data_samples/stabling.csv", index=False)
+    width = max(3, len(str(n)))
+    return np.array([f"T{str(i+1).zfill(width)}" for i in range(n)], dtype=object)
 
-if __name__ == "__main__":
-    # pick a size
-    n_trains = 50   # change to 20, 100, etc.
+def _iso_days_from_today(days):
+    today = np.datetime64(datetime.now().date(), "D")
+    return np.datetime_as_string(today + days.astype("timedelta64[D]"), unit="D")
+
+def gen_depots(train_ids, rng, n_depots=1):
+    # Uneven depot sizes, like a network with one main yard and smaller ones
+    weights = rng.dirichlet(np.full(n_depots, 4.0))
+    codes = rng.choice(n_depots, size=len(train_ids), p=weights)
+    return np.array([f"D{str(d+1).zfill(2)}" for d in range(n_depots)], dtype=object)[codes]
+
+def gen_jobcards(train_ids, rng, p_open=0.15):
+    status = np.where(rng.random(len(train_ids)) < p_open, "Open", "Closed")
+    return pd.DataFrame({"train_id": train_ids, "status": status})
+
+def gen_fitness(train_ids, rng, pct_expired=0.1):
+    # some expiry dates in past (expired), some future
+    n = len(train_ids)
+    expired_flag = rng.random(n) < pct_expired
+    cols = {"train_id": train_ids}
+    for col, p_follow in [("rolling_expiry", 1.0), ("signalling_expiry", 0.5), ("telecom_expiry", 0.2)]:
+        expired = expired_flag & (rng.random(n) < p_follow)
+        days = np.where(expired, -rng.integers(1, 31, n), rng.integers(7, 121, n))
+        cols[col] = _iso_days_from_today(days)
+    return pd.DataFrame(cols)
+
+def gen_cleaning(train_ids, rng, p_needs=0.2):
+    needs = np.where(rng.random(len(train_ids)) < p_needs, "Yes", "No")
+    return pd.DataFrame({"train_id": train_ids, "needs_cleaning": needs})
+
+def gen_mileage(train_ids, rng, low=2000, high=20000, skew_high_pct=0.25):
+    n = len(train_ids)
+    skewed = rng.random(n) < skew_high_pct
+    km = np.where(
+        skewed,
+        rng.integers(int(high*0.8), high+5000, n, endpoint=True),
+        rng.integers(low, int(high*0.8), n, endpoint=True),
+    )
+    return pd.DataFrame({"train_id": train_ids, "km_since_last_service": km})
+
+def gen_branding(train_ids, rng, pct_branding=0.25, n_campaigns=9):
+    n = len(train_ids)
+    campaigns = np.array([f"B{str(i).zfill(2)}" for i in range(1, n_campaigns+1)], dtype=object)
+    branded = rng.random(n) < pct_branding
+    window_end = _iso_days_from_today(rng.integers(5, 61, n)).astype(object)
+    return pd.DataFrame({
+        "train_id": train_ids,
+        "campaign_id": np.where(branded, rng.choice(campaigns, n), ""),
+        "min_exposure_hours": np.where(branded, rng.integers(2, 31, n).astype(object), ""),
+        "window_end": np.where(branded, window_end, ""),
+    })
+
+def gen_stabling(train_ids, depots, bays=None):
+    # Bays are numbered per depot, filled round-robin in train order; without a bay count
+    # each depot gets enough bays for about RAKES_PER_BAY rakes each
+    df = pd.DataFrame({"train_id": train_ids, "depot": depots})
+    slot = df.groupby("depot").cumcount().to_numpy()
+    if bays is None:
+        bays = np.ceil(df.groupby("depot")["train_id"].transform("size").to_numpy() / RAKES_PER_BAY).astype(int)
+    df["stabling_bay"] = "Bay-" + pd.Series((slot % bays) + 1).astype(str)
+    if df["depot"].nunique() == 1:
+        df = df.drop(columns="depot")
+    return df[[c for c in ["train_id", "stabling_bay", "depot"] if c in df.columns]]
+
+def generate_fleet(n_trains=50, n_depots=1, seed=None, p_open=0.12, pct_expired=0.12, p_needs=0.22,
+                   low=2000, high=20000, skew_high_pct=0.28, pct_branding=0.3, bays=None):
+    rng = np.random.default_rng(seed)
     ids = gen_train_ids(n_trains)
-    write_jobcards(ids, p_open=0.12)
-    write_fitness(ids, pct_expired=0.12)
-    write_cleaning(ids, p_needs=0.22)
-    write_mileage(ids, low=2000, high=20000, skew_high_pct=0.28)
-    write_branding(ids, pct_branding=0.3)
-    write_stabling(ids, bays=12)
-    print(f"Generated sample CSVs for {n_trains} trains in data_samples/")
+    depots = gen_depots(ids, rng, n_depots)
+    return {
+        "jobcards.csv": gen_jobcards(ids, rng, p_open=p_open),
+        "fitness.csv": gen_fitness(ids, rng, pct_expired=pct_expired),
+        "cleaning.csv": gen_cleaning(ids, rng, p_needs=p_needs),
+        "mileage.csv": gen_mileage(ids, rng, low=low, high=high, skew_high_pct=skew_high_pct),
+        "branding.csv": gen_branding(ids, rng, pct_branding=pct_branding),
+        "stabling.csv": gen_stabling(ids, depots, bays=bays),
+    }
+
+def write_fleet(frames, out_dir="data_samples"):
+    os.makedirs(out_dir, exist_ok=True)
+    for name, df in frames.items():
+        df.to_csv(os.path.join(out_dir, name), index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic depot CSVs")
+    parser.add_argument("--trains", type=int, default=50)
+    parser.add_argument("--depots", type=int, default=1)
+    parser.add_argument("--bays", type=int, default=None,
+                        help=f"stabling bays per depot (default: one per {RAKES_PER_BAY} rakes of the depot)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default="data_samples")
+    args = parser.parse_args()
+
+    write_fleet(generate_fleet(args.trains, n_depots=args.depots, seed=args.seed, bays=args.bays), args.out)
+    print(f"Generated sample CSVs for {args.trains} trains across {args.depots} depot(s) in {args.out}/")
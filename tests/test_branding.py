@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+from backend.history import HistoryStore
+from backend.optimizer.branding import SERVICE_HOURS, ExposureTracker, exposure_deficits
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BRANDING = pd.DataFrame({
+    "train_id": ["T1", "T2", "T3"],
+    "campaign_id": ["C1", "C1", "C2"],
+    "min_exposure_hours": [100, 100, 50],
+    "window_end": ["2030-01-10"] * 3,
+})
+
+# Commits a plan with the given Service rakes, in a process of its own
+COMMIT = """
+import sys
+import numpy as np
+import pandas as pd
+sys.path.insert(0, {root!r})
+from backend.history import HistoryStore
+from backend.optimizer.planframe import PlanFrame
+
+ids = ["T1", "T2", "T3"]
+service = set(sys.argv[3].split(","))
+status = np.array(["Service" if t in service else "Standby" for t in ids], dtype=object)
+n = len(ids)
+plan = PlanFrame(np.array(ids, dtype=object), status, np.full(n, "Healthy", dtype=object),
+                 np.full(n, 1000.0), np.zeros(n), np.full(n, "Low", dtype=object))
+fleet = pd.DataFrame({{"train_id": ids, "has_data": True, "dte": 30.0, "km": 1000.0,
+                      "needs_cleaning": 0, "jobcard_open": 0}})
+branding = pd.DataFrame({branding!r})
+params = {{"mode": "rules", "required_service": 1, "max_cleaning_slots": 2, "max_mileage": 8000}}
+HistoryStore(sys.argv[1]).commit(sys.argv[2], params, plan, fleet, "v1", branding)
+"""
+
+
+def _commit_elsewhere(db, plan_date, service):
+    script = COMMIT.format(root=ROOT, branding=BRANDING.to_dict("list"))
+    subprocess.run([sys.executable, "-c", script, db, plan_date, ",".join(service)], check=True)
+
+
+def test_commit_in_another_process_reaches_the_totals_held_here(tmp_path):
+    db = str(tmp_path / "history.db")
+    history = HistoryStore(db)
+    tracker = ExposureTracker(history.exposure_totals, history.exposure_revision)
+    assert tracker.hours(["T1", "T2"], ["C1", "C1"]).tolist() == [0.0, 0.0]
+    before = tracker.revision()
+
+    _commit_elsewhere(db, "2030-01-01", ["T1", "T2"])
+    assert tracker.hours(["T1", "T2"], ["C1", "C1"]).tolist() == [SERVICE_HOURS, SERVICE_HOURS]
+    assert tracker.campaign_hours("C1") == 2 * SERVICE_HOURS
+    assert tracker.revision() != before
+
+    # Planning here sees the deficit left by the other process's commit
+    deficit, days = exposure_deficits(["T1", "T3"], BRANDING, "2030-01-02", tracker=tracker)
+    assert deficit.tolist() == [100 - SERVICE_HOURS, 50.0]
+    assert days.tolist() == [9.0, 9.0]
+
+
+def test_recommit_in_another_process_replaces_the_night(tmp_path):
+    db = str(tmp_path / "history.db")
+    history = HistoryStore(db)
+    tracker = ExposureTracker(history.exposure_totals, history.exposure_revision)
+    _commit_elsewhere(db, "2030-01-01", ["T1", "T2"])
+    assert tracker.campaign_hours("C1") == 2 * SERVICE_HOURS
+
+    _commit_elsewhere(db, "2030-01-01", ["T2", "T3"])
+    assert tracker.hours(["T1", "T2", "T3"], ["C1", "C1", "C2"]).tolist() == [0.0, SERVICE_HOURS, SERVICE_HOURS]
+    assert tracker.campaign_hours("C1") == SERVICE_HOURS
+
+
+def test_in_memory_tracker_adds_updates():
+    tracker = ExposureTracker()
+    tracker.update(lambda: ((["T1"], ["C1"], [SERVICE_HOURS]), None))
+    tracker.update(lambda: ((["T1"], ["C1"], [SERVICE_HOURS]), None))
+    assert tracker.hours(["T1", "T9"], ["C1", "C1"]).tolist() == [2 * SERVICE_HOURS, 0.0]
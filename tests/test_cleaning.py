@@ -0,0 +1,63 @@
+import math
+
+from backend.optimizer.cleaning import night_minutes, schedule
+
+# Night minutes: 21:00 the evening before is 1260, 05:00 the morning after is 1740
+OPENS, CLOSES = 1260, 1740
+
+
+def request(priority, row, depot=None, ready=-math.inf, until=math.inf, duration=90):
+    return ((priority, row), row, depot, ready, until, duration)
+
+
+def test_night_minutes():
+    assert night_minutes("21:00", 0) == OPENS
+    assert night_minutes("05:00", 0) == CLOSES
+    assert night_minutes(None, 7) == 7
+    assert night_minutes(" ", 7) == 7
+
+
+def test_shared_bays_fill_in_turn():
+    bays = [("CB1", None, OPENS, CLOSES), ("CB2", None, OPENS, CLOSES)]
+    out = schedule([request(k, k) for k in range(3)], bays, max_slots=10)
+    assert out == {0: (0, 1260, 1350), 1: (1, 1260, 1350), 2: (0, 1350, 1440)}
+
+
+def test_depot_bays_serve_only_their_depot():
+    bays = [("A1", "D1", OPENS, CLOSES), ("B1", "D2", OPENS, CLOSES)]
+    out = schedule([request(0, 0, "D1"), request(1, 1, "D1"), request(2, 2, "D2")], bays, max_slots=10)
+    assert out == {0: (0, 1260, 1350), 1: (0, 1350, 1440), 2: (1, 1260, 1350)}
+
+
+def test_shared_bay_takes_a_depot_train_when_it_starts_earlier():
+    bays = [("A1", "D1", OPENS, CLOSES), ("S1", None, OPENS + 30, CLOSES)]
+    out = schedule([request(0, 0, "D1"), request(1, 1, "D1"), request(2, 2, "D1")], bays, max_slots=10)
+    assert out == {0: (0, 1260, 1350), 1: (1, 1290, 1380), 2: (0, 1350, 1440)}
+    # A train without a depot never gets a depot's bay
+    out = schedule([request(0, 0)], [("A1", "D1", OPENS, CLOSES)], max_slots=10)
+    assert out == {}
+
+
+def test_availability_window():
+    bays = [("CB1", None, OPENS, CLOSES)]
+    # Not back in the depot until 23:00
+    assert schedule([request(0, 0, ready=1380)], bays, max_slots=10) == {0: (0, 1380, 1470)}
+    # Leaves at 22:00, before a 90 minute cleaning could finish
+    assert schedule([request(0, 0, until=1320)], bays, max_slots=10) == {}
+    # The bay is busy with the first train until after the second has to leave
+    out = schedule([request(0, 0), request(1, 1, until=1400)], bays, max_slots=10)
+    assert out == {0: (0, 1260, 1350)}
+
+
+def test_bay_closing_time_and_cleaning_length():
+    bays = [("Short", None, OPENS, OPENS + 60), ("Long", None, OPENS, CLOSES)]
+    out = schedule([request(0, 0), request(1, 1, duration=45)], bays, max_slots=10)
+    assert out == {0: (1, 1260, 1350), 1: (0, 1260, 1305)}
+
+
+def test_max_slots_keeps_the_highest_priority():
+    bays = [("CB1", None, OPENS, CLOSES), ("CB2", None, OPENS, CLOSES)]
+    requests = [request(5 - k, k) for k in range(5)]
+    out = schedule(requests, bays, max_slots=2)
+    assert sorted(out) == [3, 4]
+    assert schedule(requests, bays, max_slots=0) == {}
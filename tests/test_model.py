@@ -0,0 +1,68 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from backend.datastore import store
+from backend.optimizer.model import plan_fingerprint, run_optimizer
+from backend.optimizer.shard import DEFAULT_DEPOT
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_samples")
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # A copy of the sample data the store reads from, without a compiled snapshot
+    shutil.copytree(SAMPLES, tmp_path, dirs_exist_ok=True)
+    monkeypatch.setattr(store, "data_dir", str(tmp_path))
+    monkeypatch.setattr(store, "snapshot_path", "off")
+    monkeypatch.setattr(store, "_entries", {})
+    return tmp_path
+
+
+def _move_depots(data_dir, depots):
+    stabling = pd.read_csv(data_dir / "stabling.csv")
+    stabling["depot"] = [depots[k % len(depots)] for k in range(len(stabling))]
+    stabling.to_csv(data_dir / "stabling.csv", index=False)
+
+
+@pytest.mark.parametrize("params", [
+    {"mode": "sharded"},
+    {"mode": "rules", "cleaning": "priority"},
+    {"mode": "rules", "turnout": True},
+])
+def test_fingerprint_follows_stabling_when_the_plan_reads_it(data_dir, params):
+    before = plan_fingerprint(params)
+    _move_depots(data_dir, ["Muttom", "Aluva"])
+    assert plan_fingerprint(params) != before
+
+
+def test_fingerprint_ignores_stabling_when_the_plan_does_not_read_it(data_dir):
+    params = {"mode": "rules", "cleaning": "fcfs"}
+    before = plan_fingerprint(params)
+    _move_depots(data_dir, ["Muttom", "Aluva"])
+    assert plan_fingerprint(params) == before
+
+
+def test_sharded_plans_the_whole_fleet_as_one_depot_without_stabling(data_dir):
+    os.remove(data_dir / "stabling.csv")
+    result = run_optimizer(2, mode="sharded")
+    assert "error" not in result
+    assert [d["depot"] for d in result["depots"]] == [DEFAULT_DEPOT]
+    assert len(result["plan"]) == len(pd.read_csv(data_dir / "fitness.csv"))
+
+
+@pytest.mark.parametrize("missing", ["branding.csv", "stabling.csv"])
+def test_priority_cleaning_plans_without_optional_files(data_dir, missing):
+    os.remove(data_dir / missing)
+    result = run_optimizer(2, cleaning="priority")
+    assert "error" not in result
+    assert len(result["cleaning_schedule"]) <= 2
+
+
+def test_milp_plans_without_branding(data_dir):
+    os.remove(data_dir / "branding.csv")
+    result = run_optimizer(2, mode="milp", time_limit=5)
+    assert "error" not in result
+    assert not any(r["reason"] == "Assigned to service for branding exposure" for r in result["plan"])
@@ -0,0 +1,106 @@
+import random
+import time
+from collections import deque
+
+import pandas as pd
+
+from backend.optimizer.stabling import _solve, plan_turnout
+
+
+def solve(stacks, leaving, capacity, seconds=5.0):
+    """_solve on copies of stacks, each bay listed from the back of the track to the exit as yard_tracks gives them."""
+    return _solve([list(s) for s in stacks], set(leaving), capacity, time.perf_counter() + seconds)
+
+
+def fewest_moves(stacks, leaving, capacity):
+    # Breadth-first search over yard states; None when some leaving rake can never get out
+    def drain(state):
+        state = [list(s) for s in state]
+        for s in state:
+            while s and s[-1] in leaving:
+                s.pop()
+        return state
+
+    start = drain(stacks)
+    queue, seen = deque([(start, 0)]), {tuple(map(tuple, start))}
+    while queue:
+        state, moves = queue.popleft()
+        if not any(t in leaving for s in state for t in s):
+            return moves
+        for a, src in enumerate(state):
+            for b, dst in enumerate(state):
+                if a == b or not src or len(dst) >= capacity[b]:
+                    continue
+                nxt = [list(s) for s in state]
+                nxt[b].append(nxt[a].pop())
+                nxt = drain(nxt)
+                key = tuple(map(tuple, nxt))
+                if key not in seen:
+                    seen.add(key)
+                    queue.append((nxt, moves + 1))
+    return None
+
+
+def test_clear_way_out_needs_no_moves():
+    yard, bound, optimal, complete = solve([["S1", "X"], ["S2"]], {"X"}, [2, 2])
+    assert (yard.moves, bound, optimal, complete) == (0, 0, True, True)
+    assert yard.steps == [("depart", "X", 0, None)]
+
+
+def test_blockers_go_to_an_empty_bay():
+    yard, bound, optimal, complete = solve([["X", "S1", "S2"], []], {"X"}, [3, 3])
+    assert (yard.moves, bound, optimal, complete) == (2, 2, True, True)
+    assert [s[0] for s in yard.steps] == ["shunt", "shunt", "depart"]
+
+
+def test_no_clean_bay_costs_one_move_over_the_bound():
+    # The first shunt has to park in front of the other leaving rake and is moved again later
+    yard, bound, optimal, complete = solve([["X", "S1"], ["Y", "S2"]], {"X", "Y"}, [3, 3])
+    assert (yard.moves, bound, optimal, complete) == (3, 2, True, True)
+    assert not any(yard.left)
+
+
+def test_no_room_leaves_the_rake_stuck():
+    yard, bound, optimal, complete = solve([["X", "S1"]], {"X"}, [2])
+    assert complete
+    assert yard.left == [1]
+    assert yard.moves == 0
+
+
+def test_matches_the_fewest_moves_on_small_yards():
+    rng = random.Random(7)
+    for _ in range(150):
+        trains = iter(f"T{i}" for i in range(20))
+        stacks = [[next(trains) for _ in range(rng.randint(0, 4))] for _ in range(rng.randint(2, 4))]
+        leaving = {t for s in stacks for t in s if rng.random() < 0.3}
+        capacity = [len(s) + rng.randint(0, 2) for s in stacks]
+        best = fewest_moves(stacks, leaving, capacity)
+        yard, bound, optimal, complete = solve(stacks, leaving, capacity)
+        assert complete
+        if best is None:
+            assert any(yard.left)
+        else:
+            assert bound <= best
+            assert not any(yard.left)
+            assert yard.moves >= best
+            if optimal:
+                assert yard.moves == best
+
+
+def test_passed_deadline_returns_the_partial_sequence():
+    yard, bound, optimal, complete = _solve([["X", "S1"], []], {"X"}, [2, 2], time.perf_counter() - 1)
+    assert (optimal, complete) == (False, False)
+    assert yard.left == [1, 0]
+
+
+def test_turnout_out_of_time_lists_pending_rakes():
+    stabling = pd.DataFrame({"train_id": ["T1", "T2", "T3"], "stabling_bay": ["B1", "B1", "B2"]})
+    out = plan_turnout(["T2"], stabling, time_limit=0)
+    assert out["complete"] is False and out["optimal"] is False
+    assert out["pending"] == ["T2"]
+    assert out["unreachable"] == []
+
+    out = plan_turnout(["T2"], stabling, time_limit=5)
+    assert out["complete"] is True
+    assert out["shunting_moves"] == 1 and out["lower_bound"] == 1 and out["optimal"] is True
+    assert out["pending"] == [] and out["unreachable"] == []